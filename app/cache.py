@@ -0,0 +1,144 @@
+"""Small in-process read-through caches with TTL + LRU eviction.
+
+Keys are tuples whose first element names the endpoint, e.g.
+``("dish", 42)``; ``invalidate("dish")`` drops every key with that prefix.
+Caches created with ``tables=...`` stamp each entry loaded through
+:meth:`TTLCache.load` with those tables' ``table_versions`` rows and treat
+it as a miss once the stamp no longer matches. The counters are bumped by
+triggers, so writes from any connection (another worker process, a seed
+script, ...) are seen, while writes to other tables (orders, ratings,
+logins) leave the cache alone.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional, Sequence, Tuple
+
+from .etag import CANTEEN_TABLES, DISH_TABLES, OPTION_TABLES
+from .table_versions import read_versions
+
+_registry: List["TTLCache"] = []
+
+
+class TTLCache:
+    def __init__(self, name: str, maxsize: int = 256, ttl: float = 300.0, tables: Sequence[str] = ()):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.tables = tuple(sorted(set(tables)))
+        self._data: "OrderedDict[Hashable, Tuple[float, Any, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        _registry.append(self)
+
+    def get(self, key: Hashable, stamp: Any = None) -> Tuple[bool, Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            expires_at, entry_stamp, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            if entry_stamp != stamp:
+                del self._data[key]
+                self.invalidations += 1
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def set(self, key: Hashable, value: Any, stamp: Any = None) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, stamp, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key: Hashable) -> None:
+        """Drop a single entry if present."""
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def invalidate(self, prefix: Optional[Hashable] = None) -> None:
+        """Drop every entry, or only the keys whose first element is ``prefix``."""
+        with self._lock:
+            if prefix is None:
+                self._data.clear()
+            else:
+                for key in [k for k in self._data if k[0] == prefix]:
+                    del self._data[key]
+            self.invalidations += 1
+
+    def load(self, conn, key: Hashable, loader: Callable[..., Any], *args: Any) -> Any:
+        """Read-through lookup: return the cached value or ``loader(conn, *args)``.
+
+        Meant to be called on a DB worker thread, e.g.
+        ``await run_in_db(cache.load, ("dish", dish_id), _get_dish, dish_id)``.
+        Exceptions from ``loader`` (such as 404s) are not cached.
+        """
+        # Read before loading: a write landing in between stamps newer rows
+        # with the older versions, which only costs one extra miss
+        stamp = tuple(read_versions(conn, self.tables)) if self.tables else None
+        hit, value = self.get(key, stamp)
+        if hit:
+            return value
+        value = loader(conn, *args)
+        self.set(key, value, stamp)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+def cache_stats() -> dict:
+    return {cache.name: cache.stats() for cache in _registry}
+
+
+# Canteens, dishes and option configs change a few times a day at most
+catalog_cache = TTLCache(
+    "catalog",
+    maxsize=int(os.getenv("CATALOG_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("CATALOG_CACHE_TTL", "300")),
+    tables=CANTEEN_TABLES + DISH_TABLES + OPTION_TABLES,
+)
+
+
+# Formatted RAG context blocks for /chat. Invalidated explicitly when a rating
+# is written; the TTL bounds staleness from writes made by other processes
+context_cache = TTLCache(
+    "chat_context",
+    maxsize=int(os.getenv("CHAT_CONTEXT_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("CHAT_CONTEXT_CACHE_TTL", "600")),
+)
+
+# Finished LLM answers keyed on (normalised message, context hash); see chat_cache
+response_cache = TTLCache(
+    "chat_responses",
+    maxsize=int(os.getenv("CHAT_RESPONSE_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("CHAT_RESPONSE_CACHE_TTL", "600")),
+)
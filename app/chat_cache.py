@@ -0,0 +1,126 @@
+"""Reuse of LLM answers across identical chat prompts.
+
+At meal times many students ask the same thing within seconds. A prompt is
+identified by the normalised user message plus a hash of the RAG context it
+would be sent with, so two students only share an answer when the model would
+have seen exactly the same input. Concurrent identical prompts are coalesced
+into one upstream call (``SingleFlight``); finished answers are kept in
+``response_cache`` for repeats.
+"""
+import asyncio
+import hashlib
+import re
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, Hashable, NamedTuple, Tuple
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = "?？!！。.,，~～ "
+
+
+def normalize_message(message: str) -> str:
+    """Fold width/case/whitespace and trailing punctuation differences."""
+    text = unicodedata.normalize("NFKC", message).casefold()
+    return _WHITESPACE.sub(" ", text).strip().rstrip(_TRAILING_PUNCTUATION)
+
+
+def prompt_key(message: str, context_text: str) -> Tuple[str, str]:
+    digest = hashlib.sha256(context_text.encode("utf-8")).hexdigest()
+    return ("prompt", hashlib.sha256(f"{normalize_message(message)}\0{digest}".encode("utf-8")).hexdigest())
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers share its result.
+
+    The call runs in its own task, so a caller that goes away (client
+    disconnect) doesn't cancel it for the others still waiting.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, "asyncio.Task[Any]"] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return ``(result, shared)``; ``shared`` is True for callers that joined an existing call."""
+        task = self._calls.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task), shared
+
+    def _finish(self, key: Hashable, task: "asyncio.Task[Any]") -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark a failure as retrieved even if every caller has gone away
+        if not task.cancelled():
+            task.exception()
+
+
+class ChatMetrics:
+    """Counters for answer reuse; all updates happen on the event loop thread."""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+        self.upstream_seconds = 0.0
+        self.saved_seconds = 0.0
+        self.fallbacks: Dict[str, int] = {}
+
+    def record_hit(self, upstream_latency: float) -> None:
+        self.requests += 1
+        self.cache_hits += 1
+        self.saved_seconds += upstream_latency
+
+    def record_coalesced(self, upstream_latency: float) -> None:
+        self.requests += 1
+        self.coalesced += 1
+        self.saved_seconds += upstream_latency
+
+    def record_upstream(self, upstream_latency: float) -> None:
+        self.requests += 1
+        self.upstream_calls += 1
+        self.upstream_seconds += upstream_latency
+
+    def record_error(self) -> None:
+        self.requests += 1
+        self.upstream_errors += 1
+
+    def record_short_circuit(self) -> None:
+        """A request answered without trying the upstream (breaker open)."""
+        self.requests += 1
+
+    def record_fallback(self, reason: str) -> None:
+        self.fallbacks[reason] = self.fallbacks.get(reason, 0) + 1
+
+    def snapshot(self, in_flight: int = 0) -> dict:
+        reused = self.cache_hits + self.coalesced
+        return {
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "upstream_calls": self.upstream_calls,
+            "upstream_errors": self.upstream_errors,
+            "in_flight": in_flight,
+            "hit_rate": round(reused / self.requests, 4) if self.requests else None,
+            "avg_upstream_latency": (
+                round(self.upstream_seconds / self.upstream_calls, 4) if self.upstream_calls else None
+            ),
+            "saved_upstream_seconds": round(self.saved_seconds, 3),
+            "fallbacks": dict(self.fallbacks),
+        }
+
+
+class TimedAnswer(NamedTuple):
+    answer: str
+    # Upstream round trip that produced the answer; what a reuse saves
+    latency: float
+
+
+singleflight = SingleFlight()
+chat_metrics = ChatMetrics()
@@ -1,84 +1,321 @@
+import asyncio
+import contextvars
+import os
+import queue
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from time import perf_counter
+from typing import List
+
+from .metrics import metrics
+from .migrations import migrate
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 DB_PATH = BASE_DIR / "canteen.db"
-SCHEMA_PATH = BASE_DIR / "schema.sql"
 
+# Connection pool / PRAGMA tuning (overridable through .env)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "5"))
+CACHE_SIZE_KIB = int(os.getenv("DB_CACHE_SIZE_KIB", "16384"))
+MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+# Worker threads for run_in_db; never more than the pool can serve without waiting
+DB_THREADS = min(int(os.getenv("DB_THREADS", str(POOL_SIZE))), POOL_SIZE)
 
-def get_connection():
-    conn = sqlite3.connect(DB_PATH)
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Raised when no pooled connection becomes free within the pool timeout."""
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that reports each statement's execute and fetch time to :mod:`app.metrics`.
+
+    Rows are counted as they come out of ``fetchone``/``fetchmany``/``fetchall``;
+    rows read by iterating the cursor directly are timed with the next execute
+    rather than counted one by one (a Python-level ``__next__`` would cost more
+    than the query on small result sets).
+    """
+
+    _sql = ""
+
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        start = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.record_sql(sql, perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql = sql
+        start = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.record_sql(sql, perf_counter() - start)
+
+    def fetchone(self):
+        start = perf_counter()
+        row = super().fetchone()
+        metrics.record_sql(self._sql, perf_counter() - start, 0 if row is None else 1, call=False)
+        return row
+
+    def fetchmany(self, size=None):
+        start = perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        metrics.record_sql(self._sql, perf_counter() - start, len(rows), call=False)
+        return rows
+
+    def fetchall(self):
+        start = perf_counter()
+        rows = super().fetchall()
+        metrics.record_sql(self._sql, perf_counter() - start, len(rows), call=False)
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors (including ``conn.execute`` shortcuts) are instrumented."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # The C implementations of these shortcuts create a plain cursor directly
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _configure(conn: sqlite3.Connection, foreign_keys: bool = True) -> sqlite3.Connection:
+    """Apply per-connection settings once, right after the connection is opened."""
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    if foreign_keys:
+        conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
     return conn
 
 
-def init_db():
-    """Initialize database using schema.sql if DB file does not exist, or migrate existing DB."""
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        
-        # Check if DB exists and has tables
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-        db_exists = cur.fetchone() is not None
-        
-        if not db_exists:
-            # Create new database from schema
-            with open(SCHEMA_PATH, "r", encoding="utf-8") as f:
-                sql_script = f.read()
-            conn.executescript(sql_script)
-            conn.commit()
+def get_connection():
+    """Open a new connection owned by the caller (used by init_db and the data scripts).
+
+    Foreign keys stay at SQLite's default (off) here so the seed/update scripts
+    can load rows in any order; pooled request connections enforce them.
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, factory=InstrumentedConnection)
+    return _configure(conn, foreign_keys=False)
+
+
+class ConnectionPool:
+    """Bounded pool of pre-configured SQLite connections shared between threads.
+
+    Idle connections are kept in a LIFO queue so the most recently used (and
+    therefore warmest page cache) connection is handed out first.
+    """
+
+    def __init__(self, db_path=None, max_size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.db_path = db_path or DB_PATH
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path, timeout=BUSY_TIMEOUT, check_same_thread=False, factory=InstrumentedConnection
+        )
+        return _configure(conn)
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            pass
         else:
-            # Migrate existing database: add new columns if they don't exist
-            try:
-                cur.execute("ALTER TABLE users ADD COLUMN email TEXT")
-            except sqlite3.OperationalError:
-                pass  # Column already exists
-            
-            try:
-                cur.execute("ALTER TABLE users ADD COLUMN last_login DATETIME")
-            except sqlite3.OperationalError:
-                pass  # Column already exists
-            
-            # Add ingredients and calories columns to dishes table
-            try:
-                cur.execute("ALTER TABLE dishes ADD COLUMN ingredients TEXT")
-            except sqlite3.OperationalError:
-                pass  # Column already exists
-            
-            try:
-                cur.execute("ALTER TABLE dishes ADD COLUMN calories INTEGER")
-            except sqlite3.OperationalError:
-                pass  # Column already exists
-            
-            try:
-                cur.execute("ALTER TABLE dishes ADD COLUMN ingredients_zh TEXT")
-            except sqlite3.OperationalError:
-                pass  # Column already exists
-            
-            # Add options column to order_items
+            with self._lock:
+                self.hits += 1
+            return conn
+
+        with self._lock:
+            can_create = self._created < self.max_size
+            if can_create:
+                self._created += 1
+                self.misses += 1
+            else:
+                self.waits += 1
+
+        if can_create:
             try:
-                cur.execute("ALTER TABLE order_items ADD COLUMN options TEXT")
-            except sqlite3.OperationalError:
-                pass  # Column already exists
-            
-            # Create dish_option_configs table if it doesn't exist
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeoutError(
+                f"No database connection available after {self.timeout:.1f}s (pool size {self.max_size})"
+            )
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Broken connection: drop it and let the next acquire open a fresh one
+            with self._lock:
+                self._created -= 1
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    def close_all(self) -> None:
+        while True:
             try:
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS dish_option_configs (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        dish_id INTEGER NOT NULL,
-                        option_type TEXT NOT NULL,
-                        option_name_zh TEXT NOT NULL,
-                        option_name_en TEXT NOT NULL,
-                        option_values TEXT NOT NULL,
-                        is_required INTEGER NOT NULL DEFAULT 0,
-                        FOREIGN KEY (dish_id) REFERENCES dishes(id) ON DELETE CASCADE
-                    )
-                """)
-            except sqlite3.OperationalError:
-                pass  # Table already exists
-            
-            conn.commit()
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self._created,
+                "max_size": self.max_size,
+                "idle": self._idle.qsize(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+            }
+
+
+_pool = None
+_executor = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _pool_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+    return _executor
+
+
+def close_pool() -> None:
+    """Stop the DB worker threads and close every idle pooled connection."""
+    global _pool, _executor
+    with _pool_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+        if _pool is not None:
+            _pool.close_all()
+            _pool = None
+
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection for the duration of the ``with`` block.
+
+    Any transaction left open (e.g. because an HTTPException was raised before
+    ``commit()``) is rolled back when the connection goes back to the pool.
+    """
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def get_db():
+    """FastAPI dependency variant of :func:`db_connection`."""
+    with db_connection() as conn:
+        yield conn
+
+
+async def run_in_db(fn, *args, **kwargs):
+    """Run ``fn(conn, *args, **kwargs)`` on the bounded DB thread pool.
+
+    The blocking sqlite3 work happens on a worker thread with a pooled
+    connection, so the event loop keeps serving other requests (including
+    in-flight ``/chat`` calls) while the query runs. Exceptions raised by
+    ``fn`` (e.g. HTTPException) propagate to the awaiting coroutine.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+
+    def call():
+        with db_connection() as conn:
+            return fn(conn, *args, **kwargs)
+
+    return await loop.run_in_executor(get_executor(), ctx.run, call)
+
+
+def tuple_cursor(conn: sqlite3.Connection) -> sqlite3.Cursor:
+    """Cursor returning plain tuples instead of ``sqlite3.Row`` (see :func:`fetch_dicts`)."""
+    cur = conn.cursor()
+    cur.row_factory = None
+    return cur
+
+
+def fetch_dicts(cur: sqlite3.Cursor) -> List[dict]:
+    """Remaining rows of a :func:`tuple_cursor` as dicts, reading the column names once.
+
+    ``dict(zip(names, row))`` over tuples is cheaper than building a
+    ``sqlite3.Row`` per row and converting it with ``dict(row)``.
+    """
+    names = [column[0] for column in cur.description]
+    return [dict(zip(names, row)) for row in cur.fetchall()]
+
+
+def dict_rows(conn: sqlite3.Connection, sql: str, params=()) -> List[dict]:
+    cur = tuple_cursor(conn)
+    cur.execute(sql, params)
+    return fetch_dicts(cur)
+
+
+def pool_stats() -> dict:
+    return get_pool().stats()
+
+
+def init_db():
+    """Create or upgrade the database schema (see :mod:`app.migrations`).
+
+    On an up-to-date database this is a single ``PRAGMA user_version`` read.
+    """
+    conn = get_connection()
+    try:
+        migrate(conn)
     finally:
         conn.close()
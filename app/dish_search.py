@@ -0,0 +1,77 @@
+"""Full-text search over dishes with an FTS5 index (``dishes_fts``).
+
+The index is an external-content FTS5 table over ``dishes`` (name, category,
+ingredients, ingredients_zh) using the ``trigram`` tokenizer: Chinese has no
+word boundaries, and trigrams also give substring matches for Latin text
+("nood" finds "Noodles"). Triggers (created by migration 4) keep it in step
+with every write to ``dishes``, in the writer's own transaction.
+
+Trigrams can't match terms shorter than three characters (most two-character
+Chinese words), so those go to a second, contentless FTS5 table
+(``dishes_fts_bigram``, migration 11) holding every two-character window of
+the same columns as ``unicode61`` tokens. Only short terms with punctuation,
+or databases without FTS5, fall back to ``LIKE`` filters.
+"""
+import sqlite3
+from typing import List, Optional, Set, Tuple
+
+# Column weights for bm25(): a hit in the name counts most
+BM25_WEIGHTS = (10.0, 2.0, 1.0, 1.0)
+MIN_TRIGRAM_CHARS = 3
+
+
+def rebuild_dish_fts(conn: sqlite3.Connection, commit: bool = True) -> None:
+    """Re-index every dish from the ``dishes`` table."""
+    conn.execute("INSERT INTO dishes_fts (dishes_fts) VALUES ('rebuild')")
+    if "dishes_fts_bigram" in fts_tables(conn):
+        conn.execute("INSERT INTO dishes_fts_bigram (dishes_fts_bigram) VALUES ('delete-all')")
+        conn.execute(
+            "INSERT INTO dishes_fts_bigram (rowid, name, category, ingredients, ingredients_zh) "
+            "SELECT id, name, category, ingredients, ingredients_zh FROM dishes_bigram_text"
+        )
+    if commit:
+        conn.commit()
+
+
+def fts_tables(conn: sqlite3.Connection) -> Set[str]:
+    """Which of the two search indexes this database has."""
+    cur = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name IN ('dishes_fts', 'dishes_fts_bigram')"
+    )
+    return {row[0] for row in cur.fetchall()}
+
+
+def split_query(q: str) -> Tuple[List[str], List[str]]:
+    """Split a search string into (trigram-searchable terms, short terms)."""
+    terms = [t for t in q.split() if t]
+    long_terms = [t for t in terms if len(t) >= MIN_TRIGRAM_CHARS]
+    short_terms = [t for t in terms if len(t) < MIN_TRIGRAM_CHARS]
+    return long_terms, short_terms
+
+
+def bigram_searchable(term: str) -> bool:
+    """Whether a short term is made of token characters only (no punctuation to split on)."""
+    return term.isalnum()
+
+
+def bigram_match_expression(terms: List[str]) -> Optional[str]:
+    """``dishes_fts_bigram`` MATCH string requiring every short term.
+
+    A two-character term is one indexed window; a single character matches
+    the windows starting with it (every occurrence starts one).
+    """
+    if not terms:
+        return None
+    return " ".join(f'"{t}"' + ("*" if len(t) == 1 else "") for t in terms)
+
+
+def match_expression(terms: List[str]) -> Optional[str]:
+    """FTS5 MATCH string requiring every term, each quoted as a literal phrase."""
+    if not terms:
+        return None
+    return " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def like_pattern(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
@@ -0,0 +1,116 @@
+"""Conditional GET (``ETag`` / ``Last-Modified`` / 304) for the catalog and stats endpoints.
+
+An endpoint declares the tables its body is derived from; its strong ETag
+is a hash of those tables' ``table_versions`` rows plus the request URL.
+Checking a client's ``If-None-Match`` therefore costs one lookup in a
+five-row table, and a match is answered with 304 without running the
+endpoint's query at all.
+
+Responses carry ``Cache-Control: no-cache`` so browsers keep the body but
+revalidate it on every use instead of guessing a freshness lifetime from
+``Last-Modified``.
+"""
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from fastapi import Request
+from starlette.responses import Response
+
+from .db import run_in_db
+from .responses import FastJSONResponse
+from .table_versions import read_versions
+
+# Tables each group of endpoints reads
+CANTEEN_TABLES = ("canteens", "dishes")
+DISH_TABLES = ("dishes",)
+DISH_RATING_TABLES = ("ratings",)
+OPTION_TABLES = ("dishes", "dish_option_configs")
+STATS_TABLES = ("canteens", "dishes", "dish_rating_stats")
+
+CACHE_CONTROL = "no-cache"
+
+
+class Validators:
+    """The ETag and Last-Modified of one response."""
+
+    __slots__ = ("etag", "modified_at")
+
+    def __init__(self, etag: str, modified_at: int):
+        self.etag = etag
+        self.modified_at = modified_at
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {
+            "ETag": self.etag,
+            "Last-Modified": formatdate(self.modified_at, usegmt=True),
+            "Cache-Control": CACHE_CONTROL,
+        }
+
+    def not_modified(self, if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+        """RFC 9110 evaluation: If-None-Match wins; If-Modified-Since only counts without it."""
+        if if_none_match is not None:
+            if if_none_match.strip() == "*":
+                return True
+            # Weak comparison, as If-None-Match requires
+            return any(tag.strip().removeprefix("W/") == self.etag for tag in if_none_match.split(","))
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return since.tzinfo is not None and self.modified_at <= since.timestamp()
+        return False
+
+
+def current_validators(conn, tables: Sequence[str], key: str) -> Validators:
+    """Validators for the response at ``key`` (URL plus any variant) built from ``tables``."""
+    rows = read_versions(conn, tables)
+    # modified_at is hashed too, so a re-created database never reuses an old tag
+    state = ";".join(f"{name}={version}@{modified_at}" for name, version, modified_at in rows)
+    digest = hashlib.sha256(f"{key}\0{state}".encode("utf-8")).hexdigest()[:32]
+    return Validators(f'"{digest}"', max(modified_at for _, _, modified_at in rows))
+
+
+_NOT_MODIFIED = object()
+
+
+def _load_unless_current(conn, tables, key, if_none_match, if_modified_since, loader, *args):
+    # Versions are read before the body, so a write landing in between
+    # leaves an older tag on newer data (one extra 200 later), never the reverse
+    validators = current_validators(conn, tables, key)
+    if validators.not_modified(if_none_match, if_modified_since):
+        return validators, _NOT_MODIFIED
+    return validators, loader(conn, *args)
+
+
+async def conditional_get(
+    request: Request,
+    tables: Sequence[str],
+    loader: Callable[..., Any],
+    *args: Any,
+    render: Callable[[Any], Response] = FastJSONResponse,
+    variant: str = "",
+) -> Response:
+    """304 if the client's copy is current, else ``render(loader(conn, *args))``.
+
+    The version check and the load share one ``run_in_db`` call. ``variant``
+    tells apart bodies that differ for the same URL and data (e.g. the
+    weekday a default parameter depends on).
+    """
+    key = f"{request.url.path}?{request.url.query}\0{variant}"
+    validators, value = await run_in_db(
+        _load_unless_current,
+        tables,
+        key,
+        request.headers.get("if-none-match"),
+        request.headers.get("if-modified-since"),
+        loader,
+        *args,
+    )
+    if value is _NOT_MODIFIED:
+        return Response(status_code=304, headers=validators.headers)
+    response = render(value)
+    response.headers.update(validators.headers)
+    return response
@@ -0,0 +1,391 @@
+"""Normalised ingredients and an in-memory bitmap index for include/exclude filters.
+
+``dishes.ingredients`` / ``ingredients_zh`` hold free-text lists ("Chicken,
+Peanuts, Dried Chili" / "鸡肉、花生、干辣椒"), position-aligned as written by
+``update_ingredients_zh.py``. They are parsed into:
+
+* ``ingredients`` - one row per distinct ingredient (English and Chinese name),
+* ``ingredient_aliases`` - every spelling that resolves to it (English plural
+  and singular, Chinese),
+* ``dish_ingredients`` - the dish <-> ingredient links.
+
+Triggers on ``dishes`` (created by migration 5) queue changed dishes in
+``dish_ingredients_dirty``, and the writer re-parses just those with
+``parse_queued_dishes`` before it commits, so readers never write. ``IngredientIndex`` then keeps
+one bitmap (a Python int, bit = dish position) per ingredient, so a filter is
+a handful of AND/OR/AND-NOT operations over whole bitmaps - one per ingredient
+named, whatever the number of dishes.
+"""
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .table_versions import read_versions
+
+INGREDIENT_INDEX_MAX_AGE = float(os.getenv("INGREDIENT_INDEX_MAX_AGE", "300"))
+
+_SPLIT_EN = re.compile(r"\s*[,，;；]\s*")
+_SPLIT_ZH = re.compile(r"\s*[、,，;；]\s*")
+_WHITESPACE = re.compile(r"\s+")
+_LATIN = re.compile(r"[a-z]")
+# Bits decoded per step when turning a result bitmap into dish ids
+_CHUNK_BITS = 4096
+_CHUNK_MASK = (1 << _CHUNK_BITS) - 1
+
+
+def normalize_name(name: str) -> str:
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", name).casefold()).strip()
+
+
+def singular(name: str) -> str:
+    """Naive English singular of the last word: "chili peppers" -> "chili pepper"."""
+    if name.endswith("ies") and len(name) > 4:
+        return name[:-3] + "y"
+    if name.endswith("oes") and len(name) > 4:
+        return name[:-2]
+    if name.endswith("s") and not name.endswith(("ss", "us")) and len(name) > 3:
+        return name[:-1]
+    return name
+
+
+def parse_ingredients(text_en: Optional[str], text_zh: Optional[str]) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Pair up the English and Chinese lists into ``(name_en, name_zh)`` items.
+
+    The two lists are pairable when they have the same length; otherwise each
+    side is returned unpaired.
+    """
+    en = [item for item in _SPLIT_EN.split(text_en.strip()) if item] if text_en else []
+    zh = [item for item in _SPLIT_ZH.split(text_zh.strip()) if item] if text_zh else []
+    if len(en) == len(zh):
+        return list(zip(en, zh))
+    return [(item, None) for item in en] + [(None, item) for item in zh]
+
+
+def rebuild_ingredients(conn) -> int:
+    """Re-parse every dish in one transaction; returns the number of dishes processed."""
+    cur = conn.cursor()
+    cur.execute("INSERT OR IGNORE INTO dish_ingredients_dirty (dish_id) SELECT id FROM dishes")
+    processed = parse_queued_dishes(cur)
+    conn.commit()
+    return processed
+
+
+def _resolve(cur, aliases: Dict[str, int], name_en: Optional[str], name_zh: Optional[str]) -> int:
+    """Ingredient id for one parsed item, creating the ingredient and its aliases if new."""
+    en = normalize_name(name_en) if name_en else None
+    zh = normalize_name(name_zh) if name_zh else None
+    key = singular(en) if en else zh
+    ingredient_id = aliases.get(key)
+    if ingredient_id is None and en is None:
+        ingredient_id = aliases.get(zh)
+    if ingredient_id is None:
+        cur.execute(
+            "INSERT INTO ingredients (name_key, name_en, name_zh) VALUES (?, ?, ?)",
+            (key, name_en.strip() if name_en else None, name_zh.strip() if name_zh else None),
+        )
+        ingredient_id = cur.lastrowid
+    elif zh is not None:
+        cur.execute("UPDATE ingredients SET name_zh = ? WHERE id = ? AND name_zh IS NULL", (name_zh.strip(), ingredient_id))
+    for alias in (key, en, zh):
+        if alias and alias not in aliases:
+            aliases[alias] = ingredient_id
+            cur.execute(
+                "INSERT OR IGNORE INTO ingredient_aliases (alias, ingredient_id) VALUES (?, ?)", (alias, ingredient_id)
+            )
+    return ingredient_id
+
+
+def parse_queued_dishes(cur) -> int:
+    """Re-parse the dishes queued in ``dish_ingredients_dirty`` within the caller's transaction.
+
+    Every writer of ``dishes`` calls this before committing.
+    """
+    cur.execute(
+        """
+        SELECT q.dish_id, d.id IS NOT NULL AS present, d.ingredients, d.ingredients_zh
+        FROM dish_ingredients_dirty q
+        LEFT JOIN dishes d ON d.id = q.dish_id
+        """
+    )
+    queued = cur.fetchall()
+    aliases = dict(cur.execute("SELECT alias, ingredient_id FROM ingredient_aliases").fetchall())
+    links = []
+    for dish_id, present, text_en, text_zh in queued:
+        if not present:
+            continue
+        for position, (name_en, name_zh) in enumerate(parse_ingredients(text_en, text_zh)):
+            links.append((dish_id, _resolve(cur, aliases, name_en, name_zh), position))
+    cur.execute("DELETE FROM dish_ingredients WHERE dish_id IN (SELECT dish_id FROM dish_ingredients_dirty)")
+    cur.executemany(
+        "INSERT OR IGNORE INTO dish_ingredients (dish_id, ingredient_id, position) VALUES (?, ?, ?)", links
+    )
+    cur.execute("DELETE FROM dish_ingredients_dirty")
+    return len(queued)
+
+
+def sync_dish_ingredients(conn) -> int:
+    """Re-parse the queued dishes in a transaction of its own; returns how many were processed.
+
+    Run at startup for changes left queued by writers outside the app (e.g.
+    the sqlite3 shell).
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT EXISTS (SELECT 1 FROM dish_ingredients_dirty)")
+    if not cur.fetchone()[0]:
+        return 0
+    # Take the write lock before reading the queue so no trigger adds to it unseen
+    if conn.in_transaction:
+        conn.commit()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        processed = parse_queued_dishes(cur)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return processed
+
+
+class UnknownIngredientError(ValueError):
+    def __init__(self, names: List[str]):
+        super().__init__(", ".join(names))
+        self.names = names
+
+
+class _Snapshot:
+    """Bitmaps a query reads; replaced wholesale on refresh."""
+
+    def __init__(self, dish_ids, bitmaps, all_dishes, available, ingredients, aliases):
+        self.dish_ids = dish_ids
+        self.bitmaps = bitmaps
+        self.all_dishes = all_dishes
+        self.available = available
+        self.ingredients = ingredients
+        self.aliases = aliases
+
+
+def _id_array(concatenated: Optional[str]) -> np.ndarray:
+    """Parse a ``group_concat`` of integer ids (far cheaper than fetching a row per id)."""
+    if not concatenated:
+        return np.zeros(0, dtype=np.int64)
+    return np.array(concatenated.split(","), dtype=np.int64)
+
+
+def _positions(dish_ids: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Bit positions of ``ids`` within the sorted ``dish_ids``, skipping ids not in it."""
+    positions = np.searchsorted(dish_ids, ids)
+    known = positions < len(dish_ids)
+    known[known] = dish_ids[positions[known]] == ids[known]
+    return positions[known]
+
+
+def _bitmap(positions: np.ndarray, n_bytes: int) -> int:
+    buf = np.zeros(n_bytes, dtype=np.uint8)
+    np.bitwise_or.at(buf, positions >> 3, np.left_shift(1, positions & 7).astype(np.uint8))
+    return int.from_bytes(buf.tobytes(), "little")
+
+
+class IngredientIndex:
+    def __init__(self, max_age: float = INGREDIENT_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+        self._versions = None
+        self.built_at: Optional[float] = None
+        self.build_seconds = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    def is_stale(self) -> bool:
+        return self.built_at is None or time.monotonic() - self.built_at > self.max_age
+
+    def refresh(self, conn) -> None:
+        """Rebuild every bitmap from the ingredient tables."""
+        with self._lock:
+            started = time.perf_counter()
+            # Read before the tables, so a write racing the rebuild triggers another
+            versions = read_versions(conn, ("dishes",))
+            cur = conn.cursor()
+            cur.execute("SELECT group_concat(id) FROM dishes")
+            dish_ids = np.sort(_id_array(cur.fetchone()[0]))
+            n_bytes = (len(dish_ids) + 7) // 8
+            cur.execute("SELECT group_concat(id) FROM dishes WHERE is_available")
+            available = _bitmap(_positions(dish_ids, _id_array(cur.fetchone()[0])), n_bytes)
+            # Links can outlive a dish deleted after the reads above; _positions drops them
+            cur.execute("SELECT ingredient_id, group_concat(dish_id) FROM dish_ingredients GROUP BY ingredient_id")
+            bitmaps = {
+                ingredient_id: _bitmap(_positions(dish_ids, _id_array(linked)), n_bytes)
+                for ingredient_id, linked in cur.fetchall()
+            }
+            cur.execute("SELECT id, name_en, name_zh FROM ingredients ORDER BY id")
+            ingredients = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+            cur.execute("SELECT alias, ingredient_id FROM ingredient_aliases")
+            aliases = [(row[0], row[1]) for row in cur.fetchall()]
+
+            self._versions = versions
+            self._snapshot = _Snapshot(
+                dish_ids=dish_ids,
+                bitmaps=bitmaps,
+                all_dishes=(1 << len(dish_ids)) - 1,
+                available=available,
+                ingredients=ingredients,
+                aliases=aliases,
+            )
+            self.built_at = time.monotonic()
+            self.build_seconds = time.perf_counter() - started
+
+    def ensure_fresh(self, conn) -> None:
+        """Build on first use; rebuild when dishes changed or once older than ``max_age``.
+
+        Only reads: dish changes reach the ingredient tables in the writer's
+        own transaction. While a rebuild runs, other callers keep querying the
+        previous snapshot.
+        """
+        if not self.is_stale() and read_versions(conn, ("dishes",)) == self._versions:
+            return
+        if not self._build_lock.acquire(blocking=not self.ready):
+            return
+        try:
+            self.refresh(conn)
+        finally:
+            self._build_lock.release()
+
+    # ------------------------------------------------------------------
+    # Querying
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _matching(snap: _Snapshot, name: str) -> Set[int]:
+        """Ingredients a user-supplied name refers to.
+
+        Besides exact aliases, an English name matches every ingredient having
+        it as a whole word ("pork" -> "Pork Belly", "Ground Pork") and a
+        Chinese name every ingredient containing it ("花生" -> "花生酱"), so an
+        exclusion also covers the derived ingredients.
+        """
+        term = normalize_name(name)
+        if not term:
+            return set()
+        if _LATIN.search(term):
+            word = re.compile(r"(?<![a-z])" + re.escape(singular(term)) + r"(?:s|es)?(?![a-z])")
+            return {ingredient_id for alias, ingredient_id in snap.aliases if word.search(alias)}
+        return {ingredient_id for alias, ingredient_id in snap.aliases if term in alias}
+
+    @staticmethod
+    def _union(snap: _Snapshot, ingredient_ids: Iterable[int]) -> int:
+        bits = 0
+        for ingredient_id in ingredient_ids:
+            bits |= snap.bitmaps.get(ingredient_id, 0)
+        return bits
+
+    def filter(
+        self,
+        include: List[str],
+        exclude: List[str],
+        available_only: bool = True,
+        after_id: Optional[int] = None,
+        limit: int = 50,
+    ) -> Tuple[List[int], bool]:
+        """Dish ids containing every ``include`` ingredient and none of ``exclude``.
+
+        Returns one page of ids in id order starting after ``after_id``, and
+        whether more pages follow. Raises UnknownIngredientError for names
+        matching no ingredient.
+        """
+        snap = self._snapshot
+        if snap is None:
+            return [], False
+        resolved = [(name, self._matching(snap, name)) for name in include + exclude]
+        unknown = [name for name, ids in resolved if not ids]
+        if unknown:
+            raise UnknownIngredientError(unknown)
+
+        bits = snap.available if available_only else snap.all_dishes
+        # Every included name needs one of its ingredients; any excluded one disqualifies
+        for _, ids in resolved[:len(include)]:
+            bits &= self._union(snap, ids)
+        excluded: Set[int] = set()
+        for _, ids in resolved[len(include):]:
+            excluded |= ids
+        bits &= ~self._union(snap, excluded)
+
+        if after_id is not None:
+            start = int(np.searchsorted(snap.dish_ids, after_id, side="right"))
+            bits = bits >> start << start
+        # Decode a chunk of bits at a time rather than shifting the whole bitmap per dish
+        page: List[int] = []
+        offset = 0
+        while bits and len(page) < limit:
+            chunk = bits & _CHUNK_MASK
+            if chunk:
+                found = np.flatnonzero(
+                    np.unpackbits(np.frombuffer(chunk.to_bytes(_CHUNK_BITS // 8, "little"), dtype=np.uint8),
+                                  bitorder="little")
+                )[:limit - len(page)]
+                page.extend(snap.dish_ids[found + offset].tolist())
+                if len(found) and len(page) == limit:
+                    bits &= ~((1 << (int(found[-1]) + 1)) - 1)
+                    break
+            bits >>= _CHUNK_BITS
+            offset += _CHUNK_BITS
+        return page, bool(bits)
+
+    def dishes_containing(self, names: List[str]) -> Tuple[np.ndarray, List[str]]:
+        """Sorted ids of the dishes containing any of ``names``, and the names matching no ingredient.
+
+        Names resolve as in :meth:`filter`, so derived ingredients count too.
+        """
+        snap = self._snapshot
+        if snap is None:
+            return np.zeros(0, dtype=np.int64), list(names)
+        matched: Set[int] = set()
+        unknown: List[str] = []
+        for name in names:
+            ids = self._matching(snap, name)
+            if not ids:
+                unknown.append(name)
+            matched |= ids
+        bits = self._union(snap, matched)
+        n_bytes = (len(snap.dish_ids) + 7) // 8
+        found = np.flatnonzero(
+            np.unpackbits(np.frombuffer(bits.to_bytes(n_bytes, "little"), dtype=np.uint8), bitorder="little")
+        )
+        return snap.dish_ids[found], unknown
+
+    def ingredient_counts(self, available_only: bool = True) -> List[dict]:
+        """Every ingredient with the number of dishes containing it, most used first."""
+        snap = self._snapshot
+        if snap is None:
+            return []
+        scope = snap.available if available_only else snap.all_dishes
+        counts = [
+            {
+                "id": ingredient_id,
+                "name_en": name_en,
+                "name_zh": name_zh,
+                "dish_count": (snap.bitmaps.get(ingredient_id, 0) & scope).bit_count(),
+            }
+            for ingredient_id, (name_en, name_zh) in snap.ingredients.items()
+        ]
+        counts.sort(key=lambda item: (-item["dish_count"], item["id"]))
+        return counts
+
+    def stats(self) -> dict:
+        snap = self._snapshot
+        return {
+            "dishes": 0 if snap is None else len(snap.dish_ids),
+            "ingredients": 0 if snap is None else len(snap.bitmaps),
+            "aliases": 0 if snap is None else len(snap.aliases),
+            "age": None if self.built_at is None else round(time.monotonic() - self.built_at, 1),
+            "build_seconds": round(self.build_seconds, 4),
+        }
+
+
+ingredient_index = IngredientIndex()
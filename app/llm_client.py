@@ -0,0 +1,118 @@
+"""Long-lived HTTP client and settings for the Moonshot chat-completions API.
+
+One ``httpx.AsyncClient`` is created at application startup and reused by
+every ``/chat`` request, so messages ride on already-open keep-alive
+connections instead of paying a TCP+TLS handshake each time. Settings are
+read from the environment once, when the client starts (after ``.env`` has
+been loaded).
+"""
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def _env_flag(name: str, default: str = "0") -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class MoonshotSettings:
+    api_key: Optional[str]
+    model: str
+    api_base: str
+    language: str
+    assistant_name: str
+    timeout: float
+    max_connections: int
+    max_keepalive_connections: int
+    keepalive_expiry: float
+    http2: bool
+
+    @property
+    def completions_url(self) -> str:
+        return f"{self.api_base.rstrip('/')}/chat/completions"
+
+    @classmethod
+    def from_env(cls) -> "MoonshotSettings":
+        return cls(
+            api_key=os.getenv("MOONSHOT_API_KEY"),
+            model=os.getenv("MOONSHOT_MODEL_NAME", "kimi-k2-0711-preview"),
+            api_base=os.getenv("MOONSHOT_API_BASE", "https://api.moonshot.cn/v1"),
+            language=os.getenv("LLM_DEFAULT_LANGUAGE", "zh"),
+            assistant_name=os.getenv("LLM_ASSISTANT_NAME", "CampusCanteenAssistant"),
+            timeout=float(os.getenv("MOONSHOT_TIMEOUT", "30")),
+            max_connections=int(os.getenv("MOONSHOT_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("MOONSHOT_MAX_KEEPALIVE", "10")),
+            keepalive_expiry=float(os.getenv("MOONSHOT_KEEPALIVE_EXPIRY", "60")),
+            http2=_env_flag("MOONSHOT_HTTP2"),
+        )
+
+
+_settings: Optional[MoonshotSettings] = None
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _build_client(settings: MoonshotSettings) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.max_connections,
+        max_keepalive_connections=settings.max_keepalive_connections,
+        keepalive_expiry=settings.keepalive_expiry,
+    )
+    http2 = settings.http2
+    if http2:
+        try:
+            import h2  # noqa: F401  (httpx[http2] extra)
+        except ImportError:
+            logger.warning("MOONSHOT_HTTP2 is set but the 'h2' package is not installed; using HTTP/1.1")
+            http2 = False
+
+    # 如果环境变量设置了代理，使用代理（没有HTTP代理时HTTP流量也走HTTPS代理）
+    http_proxy = os.getenv("HTTP_PROXY") or os.getenv("http_proxy")
+    https_proxy = os.getenv("HTTPS_PROXY") or os.getenv("https_proxy")
+    mounts: Dict[str, httpx.AsyncHTTPTransport] = {}
+    for scheme, proxy in (("https://", https_proxy), ("http://", http_proxy or https_proxy)):
+        if proxy:
+            mounts[scheme] = httpx.AsyncHTTPTransport(proxy=proxy, limits=limits, http2=http2, verify=True)
+
+    return httpx.AsyncClient(
+        timeout=settings.timeout,
+        verify=True,  # SSL验证
+        limits=limits,
+        http2=http2,
+        mounts=mounts or None,
+    )
+
+
+def start_llm_client() -> None:
+    """Read the Moonshot settings and open the shared client (app startup)."""
+    global _settings, _client
+    _settings = MoonshotSettings.from_env()
+    _client = _build_client(_settings)
+
+
+async def close_llm_client() -> None:
+    """Close the shared client and its pooled connections (app shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_settings() -> MoonshotSettings:
+    global _settings
+    if _settings is None:
+        _settings = MoonshotSettings.from_env()
+    return _settings
+
+
+def get_llm_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it lazily outside the app lifecycle."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client(get_settings())
+    return _client
@@ -1,35 +1,79 @@
+import os
 from pathlib import Path
 
 from dotenv import load_dotenv
-from fastapi import FastAPI
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
 
-from .db import init_db
-from .routers import auth, canteens, chat, dishes, ratings, stats, orders, options
-
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-# Load environment variables from .env at project root
+# Load environment variables from .env at project root before importing the
+# modules below, several of which read their tuning knobs at import time
 load_dotenv(BASE_DIR / ".env")
 
-app = FastAPI(title="Campus Canteen Ordering System")
+# Responses at least this large are gzipped for clients that accept it
+# (precompressed static assets pass through untouched)
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+
+from .db import close_pool, db_connection, init_db  # noqa: E402
+from .ingredients import ingredient_index, sync_dish_ingredients  # noqa: E402
+from .llm_client import close_llm_client, start_llm_client  # noqa: E402
+from .metrics import MetricsMiddleware, metrics  # noqa: E402
+from .recommender import recommender  # noqa: E402
+from .responses import FastJSONResponse  # noqa: E402
+from .retrieval import dish_index  # noqa: E402
+from .routers import auth, canteens, chat, dishes, ratings, stats, orders, options  # noqa: E402
+from .static_assets import DIST_DIR, DIST_URL, PrecompressedStaticFiles, get_bundle  # noqa: E402
+
+app = FastAPI(title="Campus Canteen Ordering System", default_response_class=FastJSONResponse)
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_LEVEL)
+# Per-route latency histograms and SQL counters, scraped from /metrics
+# (added last so it is outermost and its latency includes compression)
+app.add_middleware(MetricsMiddleware)
 
 
 @app.on_event("startup")
 def on_startup() -> None:
     # Initialize database if needed
     init_db()
+    # Hash and precompress the frontend assets, rewrite index.html to use them
+    get_bundle()
+    # Warm the in-memory recommender, chat retrieval and ingredient indexes so
+    # the first request doesn't build them, after parsing any dish changes
+    # left queued by writers outside the app
+    with db_connection() as conn:
+        sync_dish_ingredients(conn)
+        recommender.build(conn)
+        dish_index.refresh(conn)
+        ingredient_index.refresh(conn)
+    # One pooled HTTP client for all LLM calls
+    start_llm_client()
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    await close_llm_client()
+    close_pool()
 
 
 @app.get("/")
-async def root() -> FileResponse:
-    """Serve the main frontend page."""
-    index_path = BASE_DIR / "static" / "index.html"
-    return FileResponse(index_path)
+async def root(request: Request) -> Response:
+    """Serve the main frontend page (referencing the fingerprinted assets)."""
+    return get_bundle().index_response(request)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics() -> PlainTextResponse:
+    """Request latency and per-route / per-statement SQL metrics (Prometheus text format)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
-# Mount static files (CSS, JS, etc.)
+# Fingerprinted, precompressed assets (cached for a year), then the plain
+# static files (CSS, JS, etc.) under their original names
+app.mount(DIST_URL, PrecompressedStaticFiles(directory=DIST_DIR, check_dir=False), name="static-dist")
 app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
 
 
@@ -0,0 +1,279 @@
+"""Per-request SQL and latency metrics, rendered in Prometheus text format.
+
+``MetricsMiddleware`` opens a :class:`RequestStats` for every HTTP request in
+a context variable; the instrumented cursor in :mod:`app.db` adds each
+statement's time and row count to it (``run_in_db`` copies the context to
+the DB worker thread) and to per-statement totals keyed by the normalised
+SQL text. When the response finishes, the request's totals are folded into
+per-route counters and a latency histogram under the route *template*
+(``/dishes/{dish_id}``), so label cardinality stays bounded.
+
+Statements slower than ``SLOW_QUERY_MS`` are also kept in a small ring
+buffer with the route that issued them (``GET /stats/slow-queries``).
+"""
+import bisect
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional, Tuple
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "50"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "100"))
+# Distinct normalised statements tracked; anything beyond is counted as "other"
+MAX_STATEMENTS = int(os.getenv("METRICS_MAX_STATEMENTS", "500"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED_ROUTE = "unmatched"
+OTHER_STATEMENT = "other"
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w$?])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST_RE = re.compile(r"\?(?:\s*,\s*\?)+")
+_SPACE_RE = re.compile(r"\s+")
+_normalized: Dict[str, str] = {}
+_NORMALIZED_CACHE_SIZE = 4096
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace, literals and ``IN (?, ?, ...)`` lists into one shape.
+
+    Statements built with a variable number of placeholders therefore share a
+    single entry. Results are memoised by the raw text, which is almost always
+    one of a few hundred string constants.
+    """
+    shape = _normalized.get(sql)
+    if shape is None:
+        shape = _SPACE_RE.sub(" ", sql).strip()
+        shape = _STRING_RE.sub("?", shape)
+        shape = _NUMBER_RE.sub("?", shape)
+        shape = _PLACEHOLDER_LIST_RE.sub("?, ...", shape)
+        if len(_normalized) >= _NORMALIZED_CACHE_SIZE:
+            _normalized.clear()
+        _normalized[sql] = shape
+    return shape
+
+
+class RequestStats:
+    """SQL totals for the request currently being served."""
+
+    __slots__ = ("scope", "queries", "sql_seconds", "rows")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+
+    @property
+    def route(self) -> str:
+        return route_label(self.scope)
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def route_label(scope: dict) -> str:
+    """The matched route template; mounts by prefix; anything else is ``unmatched``.
+
+    Routes of an included router may carry only their router-relative template
+    (``/{dish_id}``), so the include prefix is recovered from the request path.
+    """
+    template = getattr(scope.get("route"), "path", None)
+    if not template:
+        return scope.get("root_path") or UNMATCHED_ROUTE
+    path = scope["path"]
+    try:
+        matched = template.format(**scope.get("path_params", {}))
+    except (KeyError, IndexError, ValueError):
+        return template
+    if matched != path and path.endswith(matched):
+        return path[: len(path) - len(matched)] + template
+    return template
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self, slow_query_ms: float = SLOW_QUERY_MS, slow_log_size: int = SLOW_QUERY_LOG_SIZE):
+        self.slow_query_seconds = slow_query_ms / 1000.0
+        self._lock = threading.Lock()
+        # (method, route, status) -> latency histogram
+        self._latency: Dict[Tuple[str, str, str], Histogram] = {}
+        # (method, route) -> [queries, sql seconds, rows]
+        self._route_sql: Dict[Tuple[str, str], List[float]] = {}
+        # normalised statement -> [calls, seconds, rows, max seconds, slow calls]
+        self._statements: Dict[str, List[float]] = {}
+        self._slow: Deque[dict] = deque(maxlen=slow_log_size)
+
+    def record_sql(self, sql: str, seconds: float, rows: int = 0, call: bool = True) -> None:
+        """Account one execute (``call=True``) or one fetch of rows for ``sql``."""
+        stats = current_request.get()
+        shape = normalize_sql(sql)
+        slow = seconds >= self.slow_query_seconds
+        with self._lock:
+            entry = self._statements.get(shape)
+            if entry is None:
+                key = shape if len(self._statements) < MAX_STATEMENTS else OTHER_STATEMENT
+                entry = self._statements.setdefault(key, [0, 0.0, 0, 0.0, 0])
+            if call:
+                entry[0] += 1
+            entry[1] += seconds
+            entry[2] += rows
+            if seconds > entry[3]:
+                entry[3] = seconds
+            if stats is not None:
+                if call:
+                    stats.queries += 1
+                stats.sql_seconds += seconds
+                stats.rows += rows
+            if slow:
+                entry[4] += 1
+                self._slow.append(
+                    {
+                        "statement": shape,
+                        "seconds": round(seconds, 6),
+                        "phase": "execute" if call else "fetch",
+                        "route": stats.route if stats is not None else None,
+                        "at": time.time(),
+                    }
+                )
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats) -> None:
+        with self._lock:
+            key = (method, route, str(status))
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram()
+            histogram.observe(seconds)
+            totals = self._route_sql.get((method, route))
+            if totals is None:
+                totals = self._route_sql[(method, route)] = [0, 0.0, 0]
+            totals[0] += stats.queries
+            totals[1] += stats.sql_seconds
+            totals[2] += stats.rows
+
+    def slow_queries(self, limit: int = 20) -> dict:
+        """Most recent slow statements, and the statements with the most total time."""
+        with self._lock:
+            recent = list(self._slow)[-limit:][::-1]
+            top = sorted(self._statements.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return {
+            "threshold_ms": self.slow_query_seconds * 1000,
+            "recent": recent,
+            "top_statements": [
+                {
+                    "statement": shape,
+                    "calls": int(calls),
+                    "total_seconds": round(seconds, 6),
+                    "rows": int(rows),
+                    "max_seconds": round(max_seconds, 6),
+                    "slow_calls": int(slow_calls),
+                }
+                for shape, (calls, seconds, rows, max_seconds, slow_calls) in top
+            ],
+        }
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            latency = [(key, list(h.counts), h.total, h.count) for key, h in self._latency.items()]
+            route_sql = [(key, list(v)) for key, v in self._route_sql.items()]
+            statements = [(shape, list(v)) for shape, v in self._statements.items()]
+
+        lines: List[str] = []
+        name = "canteen_http_request_duration_seconds"
+        lines += [f"# HELP {name} HTTP request latency by route template.", f"# TYPE {name} histogram"]
+        for (method, route, status), counts, total, count in sorted(latency):
+            labels = f'method="{_escape(method)}",route="{_escape(route)}",status="{status}"'
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS, counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{name}_sum{{{labels}}} {total:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {count}")
+
+        route_series = (
+            ("canteen_route_sql_queries_total", "SQL statements executed while serving the route.", 0),
+            ("canteen_route_sql_seconds_total", "Time spent in SQLite while serving the route.", 1),
+            ("canteen_route_sql_rows_total", "Rows fetched from SQLite while serving the route.", 2),
+        )
+        for name, help_text, index in route_series:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (method, route), values in sorted(route_sql):
+                labels = f'method="{_escape(method)}",route="{_escape(route)}"'
+                lines.append(f"{name}{{{labels}}} {_number(values[index])}")
+
+        statement_series = (
+            ("canteen_sql_statement_calls_total", "Executions per normalised SQL statement.", 0),
+            ("canteen_sql_statement_seconds_total", "Execute plus fetch time per normalised SQL statement.", 1),
+            ("canteen_sql_statement_rows_total", "Rows fetched per normalised SQL statement.", 2),
+            ("canteen_sql_statement_slow_total", f"Calls slower than {SLOW_QUERY_MS:g} ms.", 4),
+        )
+        for name, help_text, index in statement_series:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for shape, values in sorted(statements):
+                lines.append(f'{name}{{statement="{_escape(shape)}"}} {_number(values[index])}')
+        lines.append("")
+        return "\n".join(lines)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(value) if isinstance(value, int) else f"{value:.6f}"
+
+
+metrics = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (no response buffering, so streaming stays streaming).
+
+    Latency runs until the last body chunk has been sent.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry = metrics):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_request.reset(token)
+            self.registry.record_request(
+                scope["method"], route_label(scope), status, time.perf_counter() - start, stats
+            )
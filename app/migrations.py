@@ -0,0 +1,512 @@
+"""Versioned schema migrations keyed on ``PRAGMA user_version``.
+
+Each step in ``MIGRATIONS`` runs once, in order, in a transaction of its own
+that also bumps ``user_version`` and commits, so a database is always at
+exactly one version and a failing step leaves the ones before it applied.
+Every step runs under ``BEGIN EXCLUSIVE``: when several workers start at
+once, one migrates while the others wait on the lock, re-read the version
+and skip whatever was applied meanwhile. An up-to-date database costs a
+single ``PRAGMA user_version`` read.
+
+To change the schema, append a step; never edit one that has shipped.
+Steps spell out their own DDL rather than reading it from the modules that
+use the tables, so later edits there can't change what an old step does.
+"""
+import os
+import sqlite3
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+from . import ingredients
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "schema.sql"
+# How long a starting worker waits for another one's migration to finish
+MIGRATION_LOCK_TIMEOUT = float(os.getenv("DB_MIGRATION_LOCK_TIMEOUT", "120"))
+
+# Columns added to databases created before they were part of the schema
+_LEGACY_COLUMNS = (
+    ("users", "email", "TEXT"),
+    ("users", "last_login", "DATETIME"),
+    ("dishes", "ingredients", "TEXT"),
+    ("dishes", "calories", "INTEGER"),
+    ("dishes", "ingredients_zh", "TEXT"),
+    ("order_items", "options", "TEXT"),
+)
+
+
+def run_script(conn: sqlite3.Connection, script: str) -> None:
+    """Execute a multi-statement script inside the current transaction.
+
+    ``Connection.executescript`` would COMMIT first, releasing the migration lock.
+    """
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
+    if statement.strip():
+        raise ValueError(f"Incomplete SQL statement: {statement.strip()[:80]}")
+
+
+def _table_exists(conn: sqlite3.Connection, name: str) -> bool:
+    cur = conn.execute("SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (name,))
+    return cur.fetchone() is not None
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+# ----------------------------------------------------------------------
+# Steps
+# ----------------------------------------------------------------------
+def _baseline(conn: sqlite3.Connection) -> None:
+    """schema.sql, plus the columns older databases were created without."""
+    for table, column, decl in _LEGACY_COLUMNS:
+        if _table_exists(conn, table) and column not in _columns(conn, table):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    run_script(conn, SCHEMA_PATH.read_text(encoding="utf-8"))
+
+
+def _pagination_indexes(conn: sqlite3.Connection) -> None:
+    run_script(
+        conn,
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id);
+        CREATE INDEX IF NOT EXISTS idx_ratings_created ON ratings (created_at);
+        CREATE INDEX IF NOT EXISTS idx_ratings_dish_created ON ratings (dish_id, created_at);
+        """,
+    )
+
+
+def _fill_rating_stats(conn: sqlite3.Connection) -> None:
+    """Recompute every dish_rating_stats row from ratings (steps 3 and 9)."""
+    run_script(
+        conn,
+        """
+        DELETE FROM dish_rating_stats;
+        INSERT INTO dish_rating_stats
+            (dish_id, rating_count, score_sum, avg_score, score_1, score_2, score_3, score_4, score_5)
+        SELECT dish_id, COUNT(*), SUM(score), AVG(score),
+               SUM(score = 1), SUM(score = 2), SUM(score = 3), SUM(score = 4), SUM(score = 5)
+        FROM ratings
+        GROUP BY dish_id;
+        """,
+    )
+
+
+def _rating_stats(conn: sqlite3.Connection) -> None:
+    existed = _table_exists(conn, "dish_rating_stats")
+    run_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS dish_rating_stats (
+            dish_id INTEGER PRIMARY KEY,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            score_sum INTEGER NOT NULL DEFAULT 0,
+            avg_score REAL,
+            score_1 INTEGER NOT NULL DEFAULT 0,
+            score_2 INTEGER NOT NULL DEFAULT 0,
+            score_3 INTEGER NOT NULL DEFAULT 0,
+            score_4 INTEGER NOT NULL DEFAULT 0,
+            score_5 INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (dish_id) REFERENCES dishes(id) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS idx_dish_rating_stats_rank
+            ON dish_rating_stats (avg_score DESC, rating_count DESC);
+        """,
+    )
+    if not existed:
+        _fill_rating_stats(conn)
+
+
+def _dish_fts(conn: sqlite3.Connection) -> None:
+    existed = _table_exists(conn, "dishes_fts")
+    try:
+        run_script(
+            conn,
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS dishes_fts USING fts5(
+                name, category, ingredients, ingredients_zh,
+                content='dishes', content_rowid='id', tokenize='trigram'
+            );
+            CREATE TRIGGER IF NOT EXISTS dishes_fts_ai AFTER INSERT ON dishes BEGIN
+                INSERT INTO dishes_fts (rowid, name, category, ingredients, ingredients_zh)
+                VALUES (new.id, new.name, new.category, new.ingredients, new.ingredients_zh);
+            END;
+            CREATE TRIGGER IF NOT EXISTS dishes_fts_ad AFTER DELETE ON dishes BEGIN
+                INSERT INTO dishes_fts (dishes_fts, rowid, name, category, ingredients, ingredients_zh)
+                VALUES ('delete', old.id, old.name, old.category, old.ingredients, old.ingredients_zh);
+            END;
+            CREATE TRIGGER IF NOT EXISTS dishes_fts_au AFTER UPDATE OF name, category, ingredients, ingredients_zh ON dishes BEGIN
+                INSERT INTO dishes_fts (dishes_fts, rowid, name, category, ingredients, ingredients_zh)
+                VALUES ('delete', old.id, old.name, old.category, old.ingredients, old.ingredients_zh);
+                INSERT INTO dishes_fts (rowid, name, category, ingredients, ingredients_zh)
+                VALUES (new.id, new.name, new.category, new.ingredients, new.ingredients_zh);
+            END;
+            """,
+        )
+    except sqlite3.OperationalError:
+        # No FTS5 / trigram tokenizer (SQLite < 3.34): search falls back to LIKE
+        return
+    if not existed:
+        conn.execute("INSERT INTO dishes_fts (dishes_fts) VALUES ('rebuild')")
+
+
+def _ingredient_tables(conn: sqlite3.Connection) -> None:
+    existed = _table_exists(conn, "dish_ingredients")
+    run_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS ingredients (
+            id INTEGER PRIMARY KEY,
+            name_key TEXT NOT NULL UNIQUE,
+            name_en TEXT,
+            name_zh TEXT
+        );
+        CREATE TABLE IF NOT EXISTS ingredient_aliases (
+            alias TEXT PRIMARY KEY,
+            ingredient_id INTEGER NOT NULL,
+            FOREIGN KEY (ingredient_id) REFERENCES ingredients(id) ON DELETE CASCADE
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS dish_ingredients (
+            dish_id INTEGER NOT NULL,
+            ingredient_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (dish_id, ingredient_id),
+            FOREIGN KEY (dish_id) REFERENCES dishes(id) ON DELETE CASCADE,
+            FOREIGN KEY (ingredient_id) REFERENCES ingredients(id) ON DELETE CASCADE
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_dish_ingredients_ingredient ON dish_ingredients (ingredient_id, dish_id);
+        CREATE TABLE IF NOT EXISTS dish_ingredients_dirty (
+            dish_id INTEGER PRIMARY KEY
+        );
+        CREATE TRIGGER IF NOT EXISTS dish_ingredients_ai AFTER INSERT ON dishes BEGIN
+            INSERT OR IGNORE INTO dish_ingredients_dirty (dish_id) VALUES (new.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS dish_ingredients_au AFTER UPDATE OF ingredients, ingredients_zh, is_available ON dishes BEGIN
+            INSERT OR IGNORE INTO dish_ingredients_dirty (dish_id) VALUES (new.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS dish_ingredients_ad AFTER DELETE ON dishes BEGIN
+            INSERT OR IGNORE INTO dish_ingredients_dirty (dish_id) VALUES (old.id);
+        END;
+        """,
+    )
+    if not existed:
+        cur = conn.cursor()
+        cur.execute("INSERT OR IGNORE INTO dish_ingredients_dirty (dish_id) SELECT id FROM dishes")
+        ingredients.parse_queued_dishes(cur)
+
+
+def _browse_indexes(conn: sqlite3.Connection) -> None:
+    # Composite indexes for /dishes/browse: an equality prefix (canteen or
+    # category, then availability) followed by the sort/range column, with
+    # the remaining filter columns appended so no row has to be read from the
+    # table to filter it. idx_dishes_facets serves the facet counts, grouped
+    # in index order
+    run_script(
+        conn,
+        """
+        CREATE INDEX IF NOT EXISTS idx_dishes_available_price
+            ON dishes (is_available, price, calories, canteen_id, category);
+        CREATE INDEX IF NOT EXISTS idx_dishes_available_calories
+            ON dishes (is_available, calories, price, canteen_id, category);
+        CREATE INDEX IF NOT EXISTS idx_dishes_canteen_available_price
+            ON dishes (canteen_id, is_available, price, calories, category);
+        CREATE INDEX IF NOT EXISTS idx_dishes_canteen_available_calories
+            ON dishes (canteen_id, is_available, calories, price, category);
+        CREATE INDEX IF NOT EXISTS idx_dishes_category_available_price
+            ON dishes (category, is_available, price, calories, canteen_id);
+        CREATE INDEX IF NOT EXISTS idx_dishes_category_available_calories
+            ON dishes (category, is_available, calories, price, canteen_id);
+        CREATE INDEX IF NOT EXISTS idx_dishes_facets
+            ON dishes (is_available, category, canteen_id, price, calories);
+        """,
+    )
+
+
+def _covering_indexes(conn: sqlite3.Connection) -> None:
+    # Covering indexes for the hot per-dish / per-user / per-order lookups,
+    # replacing the narrower indexes of step 2, plus the per-dish option
+    # lookup, which had no index at all. Each carries its ORDER BY
+    # columns (including id for the keyset tiebreak) right after the equality
+    # column, then every other column those queries read, so the plan is an
+    # index range walk in output order with no table lookups and no sort.
+    # check_query_plans.py asserts these plans
+    run_script(
+        conn,
+        """
+        DROP INDEX IF EXISTS idx_ratings_dish_created;
+        DROP INDEX IF EXISTS idx_orders_user_created;
+        DROP INDEX IF EXISTS idx_order_items_order;
+        CREATE INDEX IF NOT EXISTS idx_ratings_dish_recent
+            ON ratings (dish_id, created_at, id, user_id, score, comment);
+        CREATE INDEX IF NOT EXISTS idx_ratings_user_dish
+            ON ratings (user_id, dish_id, score);
+        CREATE INDEX IF NOT EXISTS idx_orders_user_recent
+            ON orders (user_id, created_at, id, total_price, status);
+        CREATE INDEX IF NOT EXISTS idx_order_items_order
+            ON order_items (order_id, id, dish_id, quantity, price, options);
+        CREATE INDEX IF NOT EXISTS idx_dish_option_configs_dish ON dish_option_configs (dish_id);
+        """,
+    )
+
+
+def _table_versions(conn: sqlite3.Connection) -> None:
+    # One counter row per tracked table, bumped by a trigger per write event
+    run_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            modified_at INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        """,
+    )
+    now = "CAST(strftime('%s', 'now') AS INTEGER)"
+    for table in ("canteens", "dishes", "dish_option_configs", "ratings", "dish_rating_stats"):
+        conn.execute(
+            f"INSERT OR IGNORE INTO table_versions (name, version, modified_at) VALUES ('{table}', 0, {now})"
+        )
+        for suffix, event in (("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE")):
+            conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS table_versions_{table}_{suffix} AFTER {event} ON {table} BEGIN\n"
+                f"    UPDATE table_versions SET version = version + 1, modified_at = {now} WHERE name = '{table}';\n"
+                "END"
+            )
+
+
+def _unique_ratings(conn: sqlite3.Connection) -> None:
+    # One rating per (user, dish): keep the newest of any duplicates that
+    # concurrent submissions raced in, then let a unique index enforce it
+    # (the rating endpoint upserts against it). idx_ratings_user_dish is
+    # replaced by the unique index, which serves the same per-user lookups.
+    # The aggregates move from application code into triggers on ratings
+    # and are rebuilt once for the removed duplicates
+    run_script(
+        conn,
+        """
+        DELETE FROM ratings
+        WHERE EXISTS (
+            SELECT 1 FROM ratings newer
+            WHERE newer.user_id = ratings.user_id
+              AND newer.dish_id = ratings.dish_id
+              AND (newer.created_at, newer.id) > (ratings.created_at, ratings.id)
+        );
+        DROP INDEX IF EXISTS idx_ratings_user_dish;
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_ratings_user_dish ON ratings (user_id, dish_id);
+        """,
+    )
+    run_script(
+        conn,
+        """
+        CREATE TRIGGER IF NOT EXISTS dish_rating_stats_ai AFTER INSERT ON ratings BEGIN
+            INSERT INTO dish_rating_stats
+                (dish_id, rating_count, score_sum, avg_score, score_1, score_2, score_3, score_4, score_5)
+            VALUES (new.dish_id, 1, new.score, CAST(new.score AS REAL),
+                    new.score = 1, new.score = 2, new.score = 3, new.score = 4, new.score = 5)
+            ON CONFLICT(dish_id) DO UPDATE SET
+                rating_count = rating_count + 1,
+                score_sum = score_sum + excluded.score_sum,
+                avg_score = CAST(score_sum + excluded.score_sum AS REAL) / (rating_count + 1),
+                score_1 = score_1 + excluded.score_1,
+                score_2 = score_2 + excluded.score_2,
+                score_3 = score_3 + excluded.score_3,
+                score_4 = score_4 + excluded.score_4,
+                score_5 = score_5 + excluded.score_5;
+        END;
+        CREATE TRIGGER IF NOT EXISTS dish_rating_stats_ad AFTER DELETE ON ratings BEGIN
+            UPDATE dish_rating_stats
+            SET rating_count = rating_count - 1,
+                score_sum = score_sum - old.score,
+                avg_score = CAST(score_sum - old.score AS REAL) / NULLIF(rating_count - 1, 0),
+                score_1 = score_1 - (old.score = 1),
+                score_2 = score_2 - (old.score = 2),
+                score_3 = score_3 - (old.score = 3),
+                score_4 = score_4 - (old.score = 4),
+                score_5 = score_5 - (old.score = 5)
+            WHERE dish_id = old.dish_id;
+            DELETE FROM dish_rating_stats WHERE dish_id = old.dish_id AND rating_count <= 0;
+        END;
+        CREATE TRIGGER IF NOT EXISTS dish_rating_stats_au AFTER UPDATE OF dish_id, score ON ratings
+        WHEN old.dish_id IS NOT new.dish_id OR old.score IS NOT new.score BEGIN
+            UPDATE dish_rating_stats
+            SET rating_count = rating_count - 1,
+                score_sum = score_sum - old.score,
+                avg_score = CAST(score_sum - old.score AS REAL) / NULLIF(rating_count - 1, 0),
+                score_1 = score_1 - (old.score = 1),
+                score_2 = score_2 - (old.score = 2),
+                score_3 = score_3 - (old.score = 3),
+                score_4 = score_4 - (old.score = 4),
+                score_5 = score_5 - (old.score = 5)
+            WHERE dish_id = old.dish_id;
+            DELETE FROM dish_rating_stats WHERE dish_id = old.dish_id AND rating_count <= 0;
+            INSERT INTO dish_rating_stats
+                (dish_id, rating_count, score_sum, avg_score, score_1, score_2, score_3, score_4, score_5)
+            VALUES (new.dish_id, 1, new.score, CAST(new.score AS REAL),
+                    new.score = 1, new.score = 2, new.score = 3, new.score = 4, new.score = 5)
+            ON CONFLICT(dish_id) DO UPDATE SET
+                rating_count = rating_count + 1,
+                score_sum = score_sum + excluded.score_sum,
+                avg_score = CAST(score_sum + excluded.score_sum AS REAL) / (rating_count + 1),
+                score_1 = score_1 + excluded.score_1,
+                score_2 = score_2 + excluded.score_2,
+                score_3 = score_3 + excluded.score_3,
+                score_4 = score_4 + excluded.score_4,
+                score_5 = score_5 + excluded.score_5;
+        END;
+        """,
+    )
+    _fill_rating_stats(conn)
+
+
+def _browse_order_indexes(conn: sqlite3.Connection) -> None:
+    # Step 6's sort indexes put the other filter columns straight after the
+    # sort column, so ORDER BY <column>, id still sorted the matches, and no
+    # index served id order under a canteen or category filter. Every
+    # equality prefix now has an index per sort column with id right after
+    # it (making the index order the output order), followed by the
+    # remaining filter columns. The id-ordered ones also replace the rowid
+    # walk for unfiltered catalogue order
+    run_script(
+        conn,
+        """
+        DROP INDEX IF EXISTS idx_dishes_available_price;
+        DROP INDEX IF EXISTS idx_dishes_available_calories;
+        DROP INDEX IF EXISTS idx_dishes_canteen_available_price;
+        DROP INDEX IF EXISTS idx_dishes_canteen_available_calories;
+        DROP INDEX IF EXISTS idx_dishes_category_available_price;
+        DROP INDEX IF EXISTS idx_dishes_category_available_calories;
+        CREATE INDEX IF NOT EXISTS idx_dishes_available_id
+            ON dishes (is_available, id, price, calories, canteen_id, category);
+        CREATE INDEX IF NOT EXISTS idx_dishes_available_price
+            ON dishes (is_available, price, id, calories, canteen_id, category);
+        CREATE INDEX IF NOT EXISTS idx_dishes_available_calories
+            ON dishes (is_available, calories, id, price, canteen_id, category);
+        CREATE INDEX IF NOT EXISTS idx_dishes_canteen_available_id
+            ON dishes (canteen_id, is_available, id, price, calories, category);
+        CREATE INDEX IF NOT EXISTS idx_dishes_canteen_available_price
+            ON dishes (canteen_id, is_available, price, id, calories, category);
+        CREATE INDEX IF NOT EXISTS idx_dishes_canteen_available_calories
+            ON dishes (canteen_id, is_available, calories, id, price, category);
+        CREATE INDEX IF NOT EXISTS idx_dishes_category_available_id
+            ON dishes (category, is_available, id, price, calories, canteen_id);
+        CREATE INDEX IF NOT EXISTS idx_dishes_category_available_price
+            ON dishes (category, is_available, price, id, calories, canteen_id);
+        CREATE INDEX IF NOT EXISTS idx_dishes_category_available_calories
+            ON dishes (category, is_available, calories, id, price, canteen_id);
+        """,
+    )
+
+
+def _dish_fts_bigram(conn: sqlite3.Connection) -> None:
+    # Step 4's trigram index can't match terms under three characters (most
+    # two-character Chinese words), which fell back to a LIKE scan of every
+    # dish. dishes_fts_bigram indexes every two-character window of the
+    # searched columns, computed by the dishes_bigram_text view, as
+    # unicode61 tokens: a two-character term is a single token, and a single
+    # character a prefix query over the windows it starts (hence prefix='1').
+    # The table is contentless; the triggers hand it the windows of the old
+    # row to delete, so the UPDATE/DELETE ones run BEFORE the row changes
+    existed = _table_exists(conn, "dishes_fts_bigram")
+    conn.execute("SAVEPOINT dish_fts_bigram")
+    try:
+        run_script(
+            conn,
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS dishes_fts_bigram USING fts5(
+                name, category, ingredients, ingredients_zh,
+                content='', tokenize='unicode61 remove_diacritics 0', prefix='1'
+            );
+            CREATE VIEW IF NOT EXISTS dishes_bigram_text AS
+            SELECT id,
+                (SELECT group_concat(substr(name, key + 1, 2), ' ') FROM json_each(
+                    '[' || rtrim(replace(hex(zeroblob(length(name))), '00', '0,'), ',') || ']')) AS name,
+                (SELECT group_concat(substr(category, key + 1, 2), ' ') FROM json_each(
+                    '[' || rtrim(replace(hex(zeroblob(length(category))), '00', '0,'), ',') || ']')) AS category,
+                (SELECT group_concat(substr(ingredients, key + 1, 2), ' ') FROM json_each(
+                    '[' || rtrim(replace(hex(zeroblob(length(ingredients))), '00', '0,'), ',') || ']')) AS ingredients,
+                (SELECT group_concat(substr(ingredients_zh, key + 1, 2), ' ') FROM json_each(
+                    '[' || rtrim(replace(hex(zeroblob(length(ingredients_zh))), '00', '0,'), ',') || ']')) AS ingredients_zh
+            FROM dishes;
+            CREATE TRIGGER IF NOT EXISTS dishes_fts_bigram_ai AFTER INSERT ON dishes BEGIN
+                INSERT INTO dishes_fts_bigram (rowid, name, category, ingredients, ingredients_zh)
+                SELECT id, name, category, ingredients, ingredients_zh FROM dishes_bigram_text WHERE id = new.id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS dishes_fts_bigram_bd BEFORE DELETE ON dishes BEGIN
+                INSERT INTO dishes_fts_bigram (dishes_fts_bigram, rowid, name, category, ingredients, ingredients_zh)
+                SELECT 'delete', id, name, category, ingredients, ingredients_zh FROM dishes_bigram_text WHERE id = old.id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS dishes_fts_bigram_bu BEFORE UPDATE OF name, category, ingredients, ingredients_zh ON dishes BEGIN
+                INSERT INTO dishes_fts_bigram (dishes_fts_bigram, rowid, name, category, ingredients, ingredients_zh)
+                SELECT 'delete', id, name, category, ingredients, ingredients_zh FROM dishes_bigram_text WHERE id = old.id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS dishes_fts_bigram_au AFTER UPDATE OF name, category, ingredients, ingredients_zh ON dishes BEGIN
+                INSERT INTO dishes_fts_bigram (rowid, name, category, ingredients, ingredients_zh)
+                SELECT id, name, category, ingredients, ingredients_zh FROM dishes_bigram_text WHERE id = new.id;
+            END;
+            """,
+        )
+        if not existed:
+            conn.execute(
+                "INSERT INTO dishes_fts_bigram (rowid, name, category, ingredients, ingredients_zh) "
+                "SELECT id, name, category, ingredients, ingredients_zh FROM dishes_bigram_text"
+            )
+    except sqlite3.OperationalError:
+        # No FTS5 or JSON functions: short terms keep the LIKE fallback
+        conn.execute("ROLLBACK TO dish_fts_bigram")
+    conn.execute("RELEASE dish_fts_bigram")
+
+
+# (version, description, step); versions are consecutive from 1
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "baseline schema", _baseline),
+    (2, "keyset pagination indexes", _pagination_indexes),
+    (3, "dish_rating_stats aggregates", _rating_stats),
+    (4, "dishes_fts full-text index", _dish_fts),
+    (5, "normalised ingredient tables", _ingredient_tables),
+    (6, "dish browse indexes", _browse_indexes),
+    (7, "covering indexes for hot lookups", _covering_indexes),
+    (8, "table_versions change counters", _table_versions),
+    (9, "unique rating per user and dish", _unique_ratings),
+    (10, "dish browse indexes in output order", _browse_order_indexes),
+    (11, "dishes_fts_bigram index for short terms", _dish_fts_bigram),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> List[int]:
+    """Apply every pending step; returns the versions applied (usually none)."""
+    current = schema_version(conn)
+    if current >= SCHEMA_VERSION:
+        return []
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute(f"PRAGMA busy_timeout = {int(MIGRATION_LOCK_TIMEOUT * 1000)}")
+    applied: List[int] = []
+    for version, _, step in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute("BEGIN EXCLUSIVE")
+        try:
+            # Another worker may have applied it while we waited for the lock
+            current = schema_version(conn)
+            if version <= current:
+                conn.commit()
+                continue
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        current = version
+        applied.append(version)
+    return applied
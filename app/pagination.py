@@ -0,0 +1,102 @@
+"""Opaque keyset-pagination cursors shared by the list endpoints.
+
+A cursor encodes the sort key of the last row of a page, e.g.
+``(created_at, id)``. The next page is fetched with a row-value comparison
+against it, so every page costs one index range scan however deep the
+client pages. The cursor for the following page is returned in the
+``X-Next-Cursor`` response header.
+"""
+import base64
+import binascii
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+from fastapi import HTTPException
+
+from .responses import FastJSONResponse
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(*values: Any) -> str:
+    raw = json.dumps(values, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int, nullable: Sequence[int] = ()) -> List[Any]:
+    """Decode a cursor produced by :func:`encode_cursor` holding ``size`` values.
+
+    Every value must be a string or a number that fits an SQLite INTEGER, as
+    sort keys are; anything else (a tampered cursor) would otherwise fail in
+    SQLite parameter binding. Only the positions in ``nullable`` (sort
+    columns with missing values) may also be null.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    for position, value in enumerate(values):
+        if value is None and position in nullable:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if isinstance(value, int) and not -(2 ** 63) <= value < 2 ** 63:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> List[str]:
+    """Parse a ``fields=a,b,c`` projection against the endpoint's column whitelist.
+
+    An empty/missing value selects every allowed column.
+    """
+    if not fields:
+        return list(allowed)
+    requested = []
+    for name in fields.split(","):
+        name = name.strip()
+        if name and name not in requested:
+            requested.append(name)
+    unknown = [name for name in requested if name not in allowed]
+    if unknown or not requested:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(allowed)}",
+        )
+    return requested
+
+
+def select_list(fields: Sequence[str], keys: Sequence[str], expressions: Optional[Dict[str, str]] = None) -> str:
+    """SQL select list for ``fields`` plus the pagination ``keys`` (always fetched)."""
+    expressions = expressions or {}
+    columns = list(fields) + [key for key in keys if key not in fields]
+    return ", ".join(f"{expressions[c]} AS {c}" if c in expressions else c for c in columns)
+
+
+def project(rows, fields: Sequence[str]) -> List[dict]:
+    """Convert tuple rows selected with :func:`select_list` to dicts of the requested ``fields``.
+
+    ``select_list`` puts ``fields`` first, so zipping drops the trailing
+    pagination keys.
+    """
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def key_values(cur, row, keys: Sequence[str]) -> List[Any]:
+    """Values of the ``keys`` columns in a tuple ``row`` fetched through ``cur``."""
+    names = [column[0] for column in cur.description]
+    return [row[names.index(key)] for key in keys]
+
+
+def page_response(content: Any, next_cursor: Optional[str]) -> FastJSONResponse:
+    """JSON response for one page, with the cursor of the next page (if any) in a header."""
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return FastJSONResponse(content, headers=headers)
+
+
+def render_page(page) -> FastJSONResponse:
+    """:func:`page_response` for the ``(content, next_cursor)`` pair a list loader returns."""
+    return page_response(*page)
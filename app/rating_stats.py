@@ -0,0 +1,49 @@
+"""Incrementally maintained per-dish rating aggregates (``dish_rating_stats``).
+
+Readers that used to run ``AVG(score)``/``COUNT(id)`` over the whole ratings
+table join this table instead. Triggers on ``ratings`` (created by migration
+9) keep it in step inside the same transaction as the rating change;
+``rebuild_rating_stats`` reconciles any drift against the raw ``ratings``
+table.
+"""
+import sqlite3
+
+SCORE_COLUMNS = ("score_1", "score_2", "score_3", "score_4", "score_5")
+
+_AGGREGATE_SELECT = """
+    SELECT dish_id,
+           COUNT(*),
+           SUM(score),
+           AVG(score),
+           SUM(score = 1),
+           SUM(score = 2),
+           SUM(score = 3),
+           SUM(score = 4),
+           SUM(score = 5)
+    FROM ratings
+"""
+
+
+def rebuild_rating_stats(conn: sqlite3.Connection, commit: bool = True) -> int:
+    """Rebuild every aggregates row from ``ratings`` (and commit, unless ``commit=False``).
+
+    Returns the number of dishes whose stored aggregates had drifted
+    (wrong values, missing row or stale row).
+    """
+    columns = ("dish_id", "rating_count", "score_sum", "avg_score") + SCORE_COLUMNS
+    cur = conn.cursor()
+    cur.execute(f"SELECT {', '.join(columns)} FROM dish_rating_stats")
+    stored = {row[0]: tuple(row) for row in cur.fetchall()}
+    cur.execute(_AGGREGATE_SELECT + " GROUP BY dish_id")
+    fresh = {row[0]: tuple(row) for row in cur.fetchall()}
+
+    drifted = sum(1 for dish_id in stored.keys() | fresh.keys() if stored.get(dish_id) != fresh.get(dish_id))
+
+    cur.execute("DELETE FROM dish_rating_stats")
+    cur.executemany(
+        f"INSERT INTO dish_rating_stats ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        fresh.values(),
+    )
+    if commit:
+        conn.commit()
+    return drifted
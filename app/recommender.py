@@ -0,0 +1,370 @@
+"""Item-item collaborative filtering recommender kept in memory.
+
+The ratings table is loaded once into a user x dish CSR matrix
+(``indptr``/``indices``/``data`` NumPy arrays) plus its dish x user transpose
+(CSC). The dish x dish co-rating matrix ``S = X^T X`` is never materialised:
+it is produced block by block as sparse ``(dish, dish, value)`` triples, only
+for pairs of dishes some user rated both of, and reduced straight away to
+each dish's ``top_k`` most cosine-similar neighbours. Memory is therefore
+O(ratings + dishes * top_k) however large the catalog grows. Serving a user
+is a couple of array gathers plus a ``bincount`` over their rated dishes'
+neighbour lists.
+
+New ratings are folded in incrementally: the rated dish's own row of ``S``
+is recomputed from its raters, and its new similarity is offered to the
+neighbour lists of the dishes co-rated with it. Each list also keeps an
+upper bound on the similarity of the dishes missing from it, so it is only
+recomputed in full when the dish it held drops below that bound.
+"""
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+TOP_K = int(os.getenv("RECOMMENDER_TOP_K", "20"))
+# Other worker processes don't see this process's incremental updates, so
+# the model is rebuilt from the database once it is older than this
+MAX_AGE = float(os.getenv("RECOMMENDER_MAX_AGE", "600"))
+# Co-rating triples materialised at once while building the neighbour lists
+_BUILD_BLOCK_PAIRS = 1 << 22
+
+
+def _gather(indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, rows: np.ndarray):
+    """Concatenate the CSR ``rows``: (position in ``rows`` of each entry, columns, values)."""
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    total = int(lengths.sum())
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.repeat(starts - offsets, lengths) + np.arange(total)
+    return owner, indices[positions], data[positions]
+
+
+def _top_k(items: np.ndarray, others: np.ndarray, values: np.ndarray, sq_norms: np.ndarray, k: int):
+    """Reduce ``(item, other, co-rating)`` triples to each item's ``k`` best cosine neighbours.
+
+    Triples for the same pair are summed first. Returns ``(items, ranks,
+    neighbours, similarities)`` with one entry per kept neighbour, ranks
+    ``0..k-1`` plus rank ``k`` for the best dish that didn't make the list.
+    """
+    n = len(sq_norms)
+    if len(items) == 0:
+        return items, items, others, values
+    keys, inverse = np.unique(items * n + others, return_inverse=True)
+    totals = np.bincount(inverse, weights=values)
+    items, others = keys // n, keys % n
+    sims = totals / np.sqrt(sq_norms[items] * sq_norms[others])
+    # Sort by item, similarity descending, then dish index. A float key makes
+    # lexsort several times slower than one argsort over an integer key that
+    # packs the three, using each similarity's dense rank in place of itself
+    by_sim = np.argsort(-sims)
+    ordered = sims[by_sim]
+    dense = np.zeros(len(sims), dtype=np.int64)
+    np.cumsum(ordered[1:] != ordered[:-1], out=dense[1:])
+    sim_ranks = np.empty_like(dense)
+    sim_ranks[by_sim] = dense
+    first, levels = items[0], int(dense[-1]) + 1
+    if (int(items[-1] - first) + 1) * levels * n < 2 ** 63:
+        order = np.argsort(((items - first) * levels + sim_ranks) * n + others)
+    else:
+        order = np.lexsort((others, sim_ranks, items))
+    items, others, sims = items[order], others[order], sims[order]
+    positions = np.arange(len(items))
+    starts = np.where(np.r_[True, items[1:] != items[:-1]], positions, 0)
+    ranks = positions - np.maximum.accumulate(starts)
+    keep = ranks <= k
+    return items[keep], ranks[keep], others[keep], sims[keep]
+
+
+class ItemItemRecommender:
+    def __init__(self, top_k: int = TOP_K, max_age: float = MAX_AGE):
+        self.top_k = top_k
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self.built_at: Optional[float] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._dish_ids = np.empty(0, dtype=np.int64)
+        self._dish_index: Dict[int, int] = {}
+        self._user_index: Dict[int, int] = {}
+        self._user_ids = np.empty(0, dtype=np.int64)
+        # CSR user x dish matrix as loaded at build time
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._indices = np.empty(0, dtype=np.int32)
+        self._data = np.empty(0, dtype=np.float64)
+        # The same ratings as CSC: dish -> (user row, score)
+        self._col_ptr = np.zeros(1, dtype=np.int64)
+        self._col_users = np.empty(0, dtype=np.int64)
+        self._col_data = np.empty(0, dtype=np.float64)
+        # Users touched since the build: user_id -> {dish_idx: score}
+        self._overlay: Dict[int, Dict[int, float]] = {}
+        # dish_idx -> overlay users who have rated it
+        self._overlay_raters: Dict[int, Set[int]] = {}
+        # Diagonal of S: sum of squared scores per dish
+        self._sq_norms = np.empty(0, dtype=np.float64)
+        # Neighbour lists, padded with similarity 0 (which contributes nothing)
+        self._neighbors = np.zeros((0, 0), dtype=np.int32)
+        self._similarities = np.zeros((0, 0), dtype=np.float32)
+        # Upper bound on the similarity of any dish missing from a dish's list
+        self._bounds = np.empty(0, dtype=np.float32)
+
+    @property
+    def ready(self) -> bool:
+        return self.built_at is not None
+
+    def is_stale(self) -> bool:
+        return self.built_at is None or time.monotonic() - self.built_at > self.max_age
+
+    # ------------------------------------------------------------------
+    # Building
+    # ------------------------------------------------------------------
+    def build(self, conn) -> None:
+        """(Re)build the whole model from the ratings table."""
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM dishes ORDER BY id")
+        dish_ids = np.fromiter((row[0] for row in cur.fetchall()), dtype=np.int64)
+        dish_index = {int(d): i for i, d in enumerate(dish_ids)}
+
+        cur.execute("SELECT user_id, dish_id, score FROM ratings ORDER BY user_id")
+        user_index: Dict[int, int] = {}
+        indptr = [0]
+        indices: List[int] = []
+        data: List[float] = []
+        for user_id, dish_id, score in cur.fetchall():
+            idx = dish_index.get(dish_id)
+            if idx is None:
+                continue
+            if user_id not in user_index:
+                if user_index:
+                    indptr.append(len(indices))
+                user_index[user_id] = len(user_index)
+            indices.append(idx)
+            data.append(float(score))
+        if user_index:
+            indptr.append(len(indices))
+
+        indptr_arr = np.asarray(indptr, dtype=np.int64)
+        indices_arr = np.asarray(indices, dtype=np.int32)
+        data_arr = np.asarray(data, dtype=np.float64)
+
+        n_items = len(dish_ids)
+        n_users = len(user_index)
+        entry_users = np.repeat(np.arange(n_users, dtype=np.int64), np.diff(indptr_arr))
+        order = np.argsort(indices_arr, kind="stable")
+        col_ptr = np.zeros(n_items + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices_arr, minlength=n_items), out=col_ptr[1:])
+        col_users, col_data = entry_users[order], data_arr[order]
+        sq_norms = np.bincount(indices_arr, weights=data_arr * data_arr, minlength=n_items)
+
+        k = min(self.top_k, max(n_items - 1, 0))
+        neighbors = np.zeros((n_items, k), dtype=np.int32)
+        similarities = np.zeros((n_items, k), dtype=np.float32)
+        bounds = np.zeros(n_items, dtype=np.float32)
+        if k and n_users:
+            # Triples each dish expands to: the ratings count of each of its raters
+            degrees = np.diff(indptr_arr)
+            cost = np.zeros(n_items + 1, dtype=np.int64)
+            np.cumsum(np.bincount(indices_arr, weights=degrees[entry_users], minlength=n_items).astype(np.int64),
+                      out=cost[1:])
+            start = 0
+            while start < n_items:
+                stop = max(int(np.searchsorted(cost, cost[start] + _BUILD_BLOCK_PAIRS, side="right")) - 1, start + 1)
+                lo, hi = col_ptr[start], col_ptr[stop]
+                if hi > lo:
+                    owner, others, values = _gather(indptr_arr, indices_arr, data_arr, col_users[lo:hi])
+                    items = np.repeat(np.arange(start, stop), np.diff(col_ptr[start:stop + 1]))[owner]
+                    values = values * col_data[lo:hi][owner]
+                    mask = others != items
+                    rows, ranks, cols, sims = _top_k(items[mask], others[mask], values[mask], sq_norms, k)
+                    listed = ranks < k
+                    neighbors[rows[listed], ranks[listed]] = cols[listed]
+                    similarities[rows[listed], ranks[listed]] = sims[listed]
+                    bounds[rows[~listed]] = sims[~listed]
+                start = stop
+
+        with self._lock:
+            self._reset()
+            self._dish_ids = dish_ids
+            self._dish_index = dish_index
+            self._user_index = user_index
+            self._user_ids = np.fromiter(user_index, dtype=np.int64, count=n_users)
+            self._indptr, self._indices, self._data = indptr_arr, indices_arr, data_arr
+            self._col_ptr, self._col_users, self._col_data = col_ptr, col_users, col_data
+            self._sq_norms = sq_norms
+            self._neighbors, self._similarities, self._bounds = neighbors, similarities, bounds
+            self.built_at = time.monotonic()
+
+    def ensure_fresh(self, conn) -> None:
+        """Build on first use and rebuild once older than ``max_age``.
+
+        While a rebuild runs, other callers keep serving the previous model.
+        """
+        if not self.is_stale():
+            return
+        if not self._build_lock.acquire(blocking=not self.ready):
+            return
+        try:
+            if self.is_stale():
+                self.build(conn)
+        finally:
+            self._build_lock.release()
+
+    # ------------------------------------------------------------------
+    # Incremental updates
+    # ------------------------------------------------------------------
+    def _user_ratings(self, user_id: int) -> Dict[int, float]:
+        if user_id in self._overlay:
+            return self._overlay[user_id]
+        row = self._user_index.get(user_id)
+        if row is None:
+            return {}
+        lo, hi = self._indptr[row], self._indptr[row + 1]
+        return dict(zip(self._indices[lo:hi].tolist(), self._data[lo:hi].tolist()))
+
+    def _co_ratings(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Row ``i`` of ``S`` without the diagonal: (dishes co-rated with ``i``, co-rating sums)."""
+        others: List[np.ndarray] = []
+        values: List[np.ndarray] = []
+        if i + 1 < len(self._col_ptr):
+            lo, hi = self._col_ptr[i], self._col_ptr[i + 1]
+            users, scores = self._col_users[lo:hi], self._col_data[lo:hi]
+            if self._overlay and len(users):
+                # Overlay users' current ratings are added below instead
+                fresh = np.fromiter(
+                    (int(u) not in self._overlay for u in self._user_ids[users]), dtype=bool, count=len(users)
+                )
+                users, scores = users[fresh], scores[fresh]
+            if len(users):
+                owner, cols, vals = _gather(self._indptr, self._indices, self._data, users)
+                others.append(cols.astype(np.int64))
+                values.append(vals * scores[owner])
+        for user_id in self._overlay_raters.get(i, ()):
+            ratings = self._overlay[user_id]
+            others.append(np.fromiter(ratings.keys(), dtype=np.int64, count=len(ratings)))
+            values.append(np.fromiter(ratings.values(), dtype=np.float64, count=len(ratings)) * ratings[i])
+        if not others:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        cols, vals = np.concatenate(others), np.concatenate(values)
+        mask = cols != i
+        cols, inverse = np.unique(cols[mask], return_inverse=True)
+        return cols, np.bincount(inverse, weights=vals[mask])
+
+    def _refresh_neighbors(self, rows: Iterable[int]) -> None:
+        """Recompute the top-K neighbour lists of the given dish rows from scratch."""
+        k = self._neighbors.shape[1]
+        for i in rows:
+            self._neighbors[i] = 0
+            self._similarities[i] = 0.0
+            self._bounds[i] = 0.0
+            if k == 0:
+                continue
+            cols, vals = self._co_ratings(i)
+            if len(cols):
+                _, ranks, others, sims = _top_k(np.full(len(cols), i), cols, vals, self._sq_norms, k)
+                listed = ranks < k
+                self._neighbors[i, ranks[listed]] = others[listed]
+                self._similarities[i, ranks[listed]] = sims[listed]
+                self._bounds[i] = sims[~listed].max(initial=0.0)
+
+    def _offer(self, j: int, i: int, sim: float) -> None:
+        """Update dish ``j``'s neighbour list after its similarity to ``i`` changed to ``sim``."""
+        neighbors, similarities = self._neighbors[j], self._similarities[j]
+        held = np.nonzero((neighbors == i) & (similarities > 0))[0]
+        if len(held):
+            if sim < self._bounds[j]:
+                # A dish missing from the list may now outrank i; only a full pass can tell
+                self._refresh_neighbors((j,))
+                return
+            slot = held[0]
+        else:
+            slot = len(similarities) - 1
+            if sim <= similarities[slot]:
+                self._bounds[j] = max(self._bounds[j], sim)
+                return
+            self._bounds[j] = max(self._bounds[j], similarities[slot])
+        neighbors[slot], similarities[slot] = i, sim
+        order = np.lexsort((neighbors, -similarities))
+        self._neighbors[j], self._similarities[j] = neighbors[order], similarities[order]
+
+    def _add_dish(self, dish_id: int) -> int:
+        idx = len(self._dish_ids)
+        self._dish_ids = np.append(self._dish_ids, dish_id)
+        self._dish_index[dish_id] = idx
+        self._sq_norms = np.append(self._sq_norms, 0.0)
+        self._bounds = np.append(self._bounds, np.float32(0.0))
+        k = min(self.top_k, idx)
+        old_k = self._neighbors.shape[1]
+        neighbors = np.zeros((idx + 1, k), dtype=np.int32)
+        similarities = np.zeros((idx + 1, k), dtype=np.float32)
+        neighbors[:idx, :old_k] = self._neighbors
+        similarities[:idx, :old_k] = self._similarities
+        self._neighbors, self._similarities = neighbors, similarities
+        if k > old_k:
+            # Only while the catalog is smaller than top_k
+            self._refresh_neighbors(range(idx + 1))
+        return idx
+
+    def record_rating(self, user_id: int, dish_id: int, score: int) -> None:
+        """Fold a new or changed rating into the model (no-op before the first build)."""
+        with self._lock:
+            if not self.ready:
+                return
+            i = self._dish_index.get(dish_id)
+            if i is None:
+                i = self._add_dish(dish_id)
+            ratings = dict(self._user_ratings(user_id))
+            old = ratings.get(i, 0.0)
+            new = float(score)
+            if old == new:
+                return
+            ratings[i] = new
+            self._overlay[user_id] = ratings
+            for j in ratings:
+                self._overlay_raters.setdefault(j, set()).add(user_id)
+            self._sq_norms[i] += new * new - old * old
+
+            # Every similarity involving dish i changed (its norm did), and
+            # no other pair did: redo i's list, then offer i to its co-rated dishes
+            self._refresh_neighbors((i,))
+            if self._neighbors.shape[1] == 0:
+                return
+            cols, vals = self._co_ratings(i)
+            sims = vals / np.sqrt(self._sq_norms[i] * self._sq_norms[cols])
+            for j, sim in zip(cols.tolist(), sims.astype(np.float32).tolist()):
+                self._offer(j, i, sim)
+
+    # ------------------------------------------------------------------
+    # Serving
+    # ------------------------------------------------------------------
+    def recommend(self, user_id: int, limit: int) -> List[Tuple[int, float]]:
+        """Return up to ``limit`` (dish_id, predicted_score) pairs the user hasn't rated."""
+        with self._lock:
+            ratings = self._user_ratings(user_id)
+            if not ratings or self._neighbors.shape[1] == 0:
+                return []
+            rated = np.fromiter(ratings.keys(), dtype=np.int64, count=len(ratings))
+            scores = np.fromiter(ratings.values(), dtype=np.float64, count=len(ratings))
+            neighbors = self._neighbors[rated]
+            sims = self._similarities[rated].astype(np.float64)
+            n_items = len(self._dish_ids)
+            dish_ids = self._dish_ids
+
+        weight = np.bincount(neighbors.ravel(), weights=sims.ravel(), minlength=n_items)
+        weighted = np.bincount(
+            neighbors.ravel(), weights=(sims * scores[:, None]).ravel(), minlength=n_items
+        )
+        weight[rated] = 0.0
+        candidates = np.nonzero(weight > 0)[0]
+        if len(candidates) == 0:
+            return []
+        predicted = weighted[candidates] / weight[candidates]
+        # Highest predicted score first, more supporting similarity breaks ties
+        order = np.lexsort((-weight[candidates], -predicted))[:limit]
+        return [(int(dish_ids[c]), float(predicted[o])) for o, c in zip(order, candidates[order])]
+
+
+recommender = ItemItemRecommender()
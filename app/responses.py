@@ -0,0 +1,36 @@
+"""JSON response class used as the app default and returned directly by list endpoints.
+
+For a plain ``dict``/``list`` return value FastAPI first walks the whole
+structure with ``jsonable_encoder`` and only then encodes it; on a
+2000-row dish list the walk alone costs ~40x the encoding. List endpoints
+therefore build their rows as plain dicts and return ``FastJSONResponse``
+themselves, which skips the walk. Encoding uses orjson (a requirement); the
+standard library encoder, with the same output, is only a safety net for an
+environment where it failed to install. Anything orjson can't encode natively
+(numpy scalars, pydantic models) is passed through ``jsonable_encoder``.
+"""
+import json
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # listed in requirements.txt; keep serving, just slower
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if hasattr(value, "item") and callable(value.item):
+        return value.item()  # numpy scalar
+    return jsonable_encoder(value)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(
+            content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
@@ -0,0 +1,348 @@
+"""In-process TF-IDF retrieval over dishes for the chat context.
+
+Each dish is turned into a bag of features: words and character trigrams
+for Latin text, character unigrams and bigrams for Chinese (which has no
+spaces to split on), taken from its name, stall, canteen, ``ingredients``
+and ``ingredients_zh`` plus a few tags derived from price and calories.
+Weights are sublinear TF x smoothed IDF, L2-normalised per dish, and stored
+as an inverted index (feature -> postings) in NumPy arrays, so a query only
+touches the postings of the handful of features it contains.
+
+Messages are also scanned for a budget ("15元以内", "under 12") and for
+exclusions ("不要花生", "without pork"), which are applied as filters rather
+than as similarity terms. Exclusions naming an ingredient resolve through the
+ingredient index, exactly as ``/dishes/by-ingredients`` does.
+
+The index is built at startup and refreshed from the database once older
+than ``RETRIEVAL_MAX_AGE``; only dishes whose text changed are re-tokenised.
+"""
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .ingredients import ingredient_index, singular
+
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+RETRIEVAL_MAX_AGE = float(os.getenv("RETRIEVAL_MAX_AGE", "300"))
+
+CHEAP_PRICE = 10.0
+LIGHT_CALORIES = 450
+HEARTY_CALORIES = 800
+# Drop matches scoring below this share of the best one (single shared characters)
+MIN_RELATIVE_SCORE = 0.3
+
+_RUNS = re.compile(r"[一-鿿]+|[a-z]+")
+_BUDGET_PATTERNS = [
+    re.compile(r"(\d+(?:\.\d+)?)\s*(?:元|块|rmb|yuan)", re.IGNORECASE),
+    re.compile(r"[¥￥]\s*(\d+(?:\.\d+)?)"),
+    re.compile(r"(?:under|below|less than|within|budget(?: of)?|up to|max)\s*[¥￥]?\s*(\d+(?:\.\d+)?)", re.IGNORECASE),
+]
+_EXCLUDE_ZH = [
+    # A bare 无 only at the start of a phrase, and not the 无 of 无锡 (排骨)
+    re.compile(r"(?:不吃|不要|不含|不加|忌口|去掉|别放|(?<![一-鿿])无(?!锡))([一-鿿、和与及]{1,12})"),
+    re.compile(r"对([一-鿿、和与及]{1,12}?)过敏"),
+]
+_EXCLUDE_EN = re.compile(
+    r"\b(?:without|no|not|avoid|allergic to|free of)\s+([a-z]+(?:\s*(?:,|\band\b|\bor\b)\s*[a-z]+)*)"
+    r"|\b([a-z]+)[- ]free\b",
+    re.IGNORECASE,
+)
+_ZH_PARTICLES = re.compile(r"[的了呢吗啊吧]")
+_EN_STOPWORDS = {"a", "an", "the", "any", "too", "much", "meat", "food", "dish", "dishes"}
+
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def _features(text: str) -> Counter:
+    features: Counter = Counter()
+    for run in _RUNS.findall(_normalize(text)):
+        if run[0] >= "一":
+            features.update(run)
+            features.update(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            features["w:" + run] += 1
+            padded = f" {run} "
+            features.update("g:" + padded[i:i + 3] for i in range(len(padded) - 2))
+    return features
+
+
+def parse_budget(message: str) -> Optional[float]:
+    """The first price limit mentioned in a message, if any."""
+    for pattern in _BUDGET_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def parse_exclusions(message: str) -> List[str]:
+    """Ingredient terms the user wants to avoid, e.g. ``不要花生和香菜`` -> [花生, 香菜]."""
+    terms: List[str] = []
+    for pattern in _EXCLUDE_ZH:
+        for match in pattern.finditer(message):
+            for term in re.split(r"[、和与及]", match.group(1)):
+                term = _ZH_PARTICLES.split(term)[0]
+                if term:
+                    terms.append(term)
+    for match in _EXCLUDE_EN.finditer(message):
+        for term in re.split(r"\s*(?:,|\band\b|\bor\b)\s*", (match.group(1) or match.group(2)).lower()):
+            term = term.strip()
+            if term and term not in _EN_STOPWORDS:
+                # "peanuts" should also exclude "Peanut Sauce"
+                terms.append(term[:-1] if len(term) > 3 and term.endswith("s") else term)
+    return terms
+
+
+def _term_matcher(terms: List[str]):
+    """``search`` for any of ``terms`` in normalised text; English ones as whole words (plural or not)."""
+    if not terms:
+        return None
+    alternatives = [
+        r"(?<![a-z])" + re.escape(singular(term)) + r"(?:s|es)?(?![a-z])" if term[0] < "一" else re.escape(term)
+        for term in terms
+    ]
+    return re.compile("|".join(alternatives)).search
+
+
+def _dish_text(row: dict) -> str:
+    parts = [row["name"], row["name"], row.get("category"), row.get("canteen_name"),
+             row.get("ingredients"), row.get("ingredients_zh")]
+    price, calories = row.get("price"), row.get("calories")
+    if price is not None and price <= CHEAP_PRICE:
+        parts.append("cheap budget 便宜 实惠")
+    if calories:
+        if calories <= LIGHT_CALORIES:
+            parts.append("light low calorie healthy 低卡 清淡 健康")
+        elif calories >= HEARTY_CALORIES:
+            parts.append("hearty filling 高热量 管饱")
+    return " ".join(p for p in parts if p)
+
+
+def _ranked(candidates: np.ndarray, scores: np.ndarray, first: int) -> Iterator[int]:
+    """``candidates`` best score first.
+
+    Only the top ``first`` are ranked up front (a partial sort); the rest are
+    sorted if the caller reads past them, e.g. when exclusions drop most of
+    the best matches.
+    """
+    fetch = min(len(candidates), first)
+    top = candidates[np.argpartition(-scores[candidates], fetch - 1)[:fetch]]
+    yield from top[np.argsort(-scores[top], kind="stable")].tolist()
+    if fetch < len(candidates):
+        rest = np.setdiff1d(candidates, top, assume_unique=True)
+        yield from rest[np.argsort(-scores[rest], kind="stable")].tolist()
+
+
+class _Snapshot:
+    """Immutable arrays a query reads; replaced wholesale on refresh."""
+
+    def __init__(self, dish_ids, meta, vocab, indptr, postings_doc, postings_weight, idf,
+                 prices, available, names, haystacks):
+        self.dish_ids = dish_ids
+        self.meta = meta
+        self.vocab = vocab
+        self.indptr = indptr
+        self.postings_doc = postings_doc
+        self.postings_weight = postings_weight
+        self.idf = idf
+        self.prices = prices
+        self.available = available
+        self.names = names
+        self.haystacks = haystacks
+
+
+class DishRetrievalIndex:
+    def __init__(self, top_k: int = RETRIEVAL_TOP_K, max_age: float = RETRIEVAL_MAX_AGE):
+        self.top_k = top_k
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        # Grow-only feature -> column id, shared by every snapshot
+        self._vocab: Dict[str, int] = {}
+        # dish_id -> (source row, feature ids, sublinear tf); kept between refreshes
+        self._docs: Dict[int, Tuple[dict, np.ndarray, np.ndarray]] = {}
+        self._snapshot: Optional[_Snapshot] = None
+        self.built_at: Optional[float] = None
+        self.last_changed = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    def is_stale(self) -> bool:
+        return self.built_at is None or time.monotonic() - self.built_at > self.max_age
+
+    # ------------------------------------------------------------------
+    # Building
+    # ------------------------------------------------------------------
+    def _vectorize(self, row: dict) -> Tuple[dict, np.ndarray, np.ndarray]:
+        features = _features(_dish_text(row))
+        ids = np.fromiter(
+            (self._vocab.setdefault(f, len(self._vocab)) for f in features), dtype=np.int32, count=len(features)
+        )
+        tf = 1.0 + np.log(np.fromiter(features.values(), dtype=np.float64, count=len(features)))
+        return row, ids, tf
+
+    def refresh(self, conn) -> int:
+        """Sync with the dishes table; returns how many dishes were (re)tokenised or dropped."""
+        with self._lock:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT d.id, d.name, d.category, d.price, d.calories, d.ingredients,
+                       d.ingredients_zh, d.is_available, d.canteen_id, c.name AS canteen_name
+                FROM dishes d
+                LEFT JOIN canteens c ON c.id = d.canteen_id
+                ORDER BY d.id
+                """
+            )
+            rows = [dict(row) for row in cur.fetchall()]
+
+            changed = 0
+            docs: Dict[int, Tuple[dict, np.ndarray, np.ndarray]] = {}
+            for row in rows:
+                previous = self._docs.get(row["id"])
+                if previous is not None and previous[0] == row:
+                    docs[row["id"]] = previous
+                else:
+                    docs[row["id"]] = self._vectorize(row)
+                    changed += 1
+            changed += len(self._docs.keys() - docs.keys())
+
+            if changed or self._snapshot is None:
+                self._snapshot = self._index(docs, dict(self._vocab))
+            self._docs = docs
+            self.built_at = time.monotonic()
+            self.last_changed = changed
+            return changed
+
+    def ensure_fresh(self, conn) -> None:
+        """Build on first use and refresh once older than ``max_age``.
+
+        While a refresh runs, other callers keep querying the previous snapshot.
+        """
+        if not self.is_stale():
+            return
+        if not self._build_lock.acquire(blocking=not self.ready):
+            return
+        try:
+            if self.is_stale():
+                self.refresh(conn)
+        finally:
+            self._build_lock.release()
+
+    @staticmethod
+    def _index(docs: Dict[int, Tuple[dict, np.ndarray, np.ndarray]], vocab: Dict[str, int]) -> _Snapshot:
+        n_docs, n_features = len(docs), len(vocab)
+        dish_ids = np.fromiter(docs.keys(), dtype=np.int64, count=n_docs)
+        values = list(docs.values())
+        lengths = np.fromiter((len(ids) for _, ids, _ in values), dtype=np.int64, count=n_docs)
+        feats_arr = np.concatenate([ids for _, ids, _ in values]) if n_docs else np.zeros(0, dtype=np.int32)
+        tf = np.concatenate([tf for _, _, tf in values]) if n_docs else np.zeros(0)
+        docs_arr = np.repeat(np.arange(n_docs, dtype=np.int32), lengths)
+
+        doc_freq = np.bincount(feats_arr, minlength=n_features)
+        idf = np.log((1.0 + n_docs) / (1.0 + doc_freq)) + 1.0
+        weights = tf * idf[feats_arr]
+        norms = np.sqrt(np.bincount(docs_arr, weights=weights * weights, minlength=n_docs))
+        weights = weights / np.where(norms > 0, norms, 1.0)[docs_arr]
+
+        order = np.argsort(feats_arr, kind="stable")
+        indptr = np.zeros(n_features + 1, dtype=np.int64)
+        np.cumsum(doc_freq, out=indptr[1:])
+
+        meta = [row for row, _, _ in values]
+        prices = np.asarray([m["price"] if m["price"] is not None else np.inf for m in meta], dtype=np.float64)
+        available = np.asarray([bool(m["is_available"]) for m in meta], dtype=bool)
+        names = [_normalize(m["name"] or "") for m in meta]
+        haystacks = [
+            _normalize(" ".join(filter(None, (m["name"], m.get("ingredients"), m.get("ingredients_zh")))))
+            for m in meta
+        ]
+        return _Snapshot(dish_ids, meta, vocab, indptr, docs_arr[order],
+                         weights[order].astype(np.float32), idf, prices, available, names, haystacks)
+
+    # ------------------------------------------------------------------
+    # Querying
+    # ------------------------------------------------------------------
+    def search(self, message: str, k: Optional[int] = None) -> List[dict]:
+        """Top-``k`` available dishes relevant to ``message`` (dish rows plus ``score``)."""
+        snap = self._snapshot
+        if snap is None or len(snap.dish_ids) == 0:
+            return []
+        k = k or self.top_k
+        budget = parse_budget(message)
+        # Exclusion terms come out normalised, so they must be cut from normalised text
+        query_text = _normalize(message)
+        exclusions = parse_exclusions(query_text)
+        for term in exclusions:
+            query_text = query_text.replace(term, " ")
+        query = [(snap.vocab[f], 1.0 + math.log(c)) for f, c in _features(query_text).items() if f in snap.vocab]
+
+        mask = snap.available.copy()
+        if budget is not None:
+            mask &= snap.prices <= budget
+        # Terms naming an ingredient drop the dishes /dishes/by-ingredients
+        # would (derived ingredients included) and the dishes named after it;
+        # the rest can only be looked for in the dish text
+        in_name = in_text = None
+        if exclusions:
+            containing, unknown = ingredient_index.dishes_containing(exclusions)
+            mask &= ~np.isin(snap.dish_ids, containing)
+            in_name, in_text = _term_matcher(exclusions), _term_matcher(unknown)
+        if query:
+            feats = np.fromiter((f for f, _ in query), dtype=np.int64, count=len(query))
+            q = np.fromiter((tf for _, tf in query), dtype=np.float64, count=len(query)) * snap.idf[feats]
+            q /= np.linalg.norm(q)
+            starts, stops = snap.indptr[feats], snap.indptr[feats + 1]
+            docs = np.concatenate([snap.postings_doc[a:b] for a, b in zip(starts, stops)])
+            weights = np.concatenate([snap.postings_weight[a:b] * w for a, b, w in zip(starts, stops, q)])
+            scores = np.bincount(docs, weights=weights, minlength=len(snap.dish_ids))
+            mask &= scores > 0
+        elif budget is not None:
+            # Only a budget: the best value for money, i.e. the priciest that fits
+            scores = np.where(np.isfinite(snap.prices), snap.prices, 0.0)
+        else:
+            return []
+
+        candidates = np.nonzero(mask)[0]
+        if len(candidates) == 0:
+            return []
+        # The score cutoff is relative to the best dish the exclusions leave
+        cutoff = None
+        results: List[dict] = []
+        for doc in _ranked(candidates, scores, k * 4 if exclusions else k):
+            if cutoff is not None and scores[doc] < cutoff:
+                break
+            if in_name is not None and in_name(snap.names[doc]):
+                continue
+            if in_text is not None and in_text(snap.haystacks[doc]):
+                continue
+            if query and cutoff is None:
+                cutoff = scores[doc] * MIN_RELATIVE_SCORE
+            results.append({**snap.meta[doc], "score": round(float(scores[doc]), 4)})
+            if len(results) == k:
+                break
+        return results
+
+    def stats(self) -> dict:
+        snap = self._snapshot
+        return {
+            "dishes": 0 if snap is None else len(snap.dish_ids),
+            "features": 0 if snap is None else len(snap.vocab),
+            "postings": 0 if snap is None else len(snap.postings_doc),
+            "age": None if self.built_at is None else round(time.monotonic() - self.built_at, 1),
+            "last_changed": self.last_changed,
+        }
+
+
+dish_index = DishRetrievalIndex()
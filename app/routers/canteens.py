@@ -1,45 +1,45 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 
-from app.db import get_connection
+from app.cache import catalog_cache
+from app.db import dict_rows
+from app.etag import CANTEEN_TABLES, conditional_get
 
 router = APIRouter()
 
 
+def _list_canteens(conn):
+    return dict_rows(conn, "SELECT id, name, location, description FROM canteens ORDER BY id")
+
+
 @router.get("/")
-async def list_canteens():
+async def list_canteens(request: Request):
     """Return all canteens."""
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT id, name, location, description FROM canteens ORDER BY id")
-        rows = cur.fetchall()
-        return [dict(row) for row in rows]
-    finally:
-        conn.close()
+    return await conditional_get(request, CANTEEN_TABLES, catalog_cache.load, ("canteens",), _list_canteens)
+
+
+def _list_dishes_for_canteen(conn, canteen_id: int):
+    cur = conn.cursor()
+
+    # Ensure canteen exists
+    cur.execute("SELECT id FROM canteens WHERE id = ?", (canteen_id,))
+    if cur.fetchone() is None:
+        raise HTTPException(status_code=404, detail="Canteen not found")
+
+    return dict_rows(
+        conn,
+        """
+        SELECT id, canteen_id, name, category, price, ingredients, ingredients_zh, calories, is_available, created_at
+        FROM dishes
+        WHERE canteen_id = ?
+        ORDER BY id
+        """,
+        (canteen_id,),
+    )
 
 
 @router.get("/{canteen_id}/dishes")
-async def list_dishes_for_canteen(canteen_id: int):
+async def list_dishes_for_canteen(canteen_id: int, request: Request):
     """Return dishes for a specific canteen."""
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-
-        # Ensure canteen exists
-        cur.execute("SELECT id FROM canteens WHERE id = ?", (canteen_id,))
-        if cur.fetchone() is None:
-            raise HTTPException(status_code=404, detail="Canteen not found")
-
-        cur.execute(
-            """
-            SELECT id, canteen_id, name, category, price, ingredients, ingredients_zh, calories, is_available, created_at
-            FROM dishes
-            WHERE canteen_id = ?
-            ORDER BY id
-            """,
-            (canteen_id,),
-        )
-        rows = cur.fetchall()
-        return [dict(row) for row in rows]
-    finally:
-        conn.close()
+    return await conditional_get(
+        request, CANTEEN_TABLES, catalog_cache.load, ("canteen_dishes", canteen_id), _list_dishes_for_canteen, canteen_id
+    )
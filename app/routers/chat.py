@@ -1,11 +1,19 @@
-import os
-from typing import List, Optional
+import json
+import time
+from typing import AsyncIterator, Callable, List, Optional
 
 import httpx
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from app.db import get_connection
+from app.cache import context_cache, response_cache
+from app.chat_cache import TimedAnswer, chat_metrics, prompt_key, singleflight
+from app.db import run_in_db
+from app.ingredients import ingredient_index
+from app.llm_client import MoonshotSettings, get_llm_client, get_settings
+from app.resilience import LimiterTimeout, llm_breaker, llm_limiter
+from app.retrieval import dish_index, parse_budget
 
 router = APIRouter()
 
@@ -17,116 +25,157 @@ class ChatMessage(BaseModel):
 
 class ChatAnswer(BaseModel):
     answer: str
+    # True when the LLM was unavailable and the answer was built locally
+    fallback: bool = False
 
 
-def _fetch_user_top_dishes(user_id: int, limit: int = 5) -> List[dict]:
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT d.id,
-                   d.name,
-                   d.category,
-                   d.price,
-                   c.name AS canteen_name,
-                   AVG(r.score) AS avg_score,
-                   COUNT(r.id) AS rating_count
-            FROM ratings r
-            JOIN dishes d ON r.dish_id = d.id
-            JOIN canteens c ON d.canteen_id = c.id
-            WHERE r.user_id = ?
-            GROUP BY d.id, d.name, d.category, d.price, c.name
-            ORDER BY avg_score DESC, rating_count DESC
-            LIMIT ?
-            """,
-            (user_id, limit),
-        )
-        return [dict(row) for row in cur.fetchall()]
-    finally:
-        conn.close()
+class UpstreamUnavailable(HTTPException):
+    """The LLM timed out, was unreachable or answered 429/5xx; counts against the breaker."""
 
 
-def _fetch_global_top_dishes(limit: int = 10) -> List[dict]:
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT d.id,
-                   d.name,
-                   d.category,
-                   d.price,
-                   c.name AS canteen_name,
-                   AVG(r.score) AS avg_score,
-                   COUNT(r.id) AS rating_count
-            FROM ratings r
-            JOIN dishes d ON r.dish_id = d.id
-            JOIN canteens c ON d.canteen_id = c.id
-            GROUP BY d.id, d.name, d.category, d.price, c.name
-            HAVING rating_count > 0
-            ORDER BY avg_score DESC, rating_count DESC
-            LIMIT ?
-            """,
-            (limit,),
-        )
-        return [dict(row) for row in cur.fetchall()]
-    finally:
-        conn.close()
+def _fetch_user_top_dishes(conn, user_id: int, limit: int = 5) -> List[dict]:
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT d.id,
+               d.name,
+               d.category,
+               d.price,
+               c.name AS canteen_name,
+               AVG(r.score) AS avg_score,
+               COUNT(r.id) AS rating_count
+        FROM ratings r
+        JOIN dishes d ON r.dish_id = d.id
+        JOIN canteens c ON d.canteen_id = c.id
+        WHERE r.user_id = ?
+        GROUP BY d.id, d.name, d.category, d.price, c.name
+        ORDER BY avg_score DESC, rating_count DESC
+        LIMIT ?
+        """,
+        (user_id, limit),
+    )
+    return [dict(row) for row in cur.fetchall()]
+
+
+def _fetch_global_top_dishes(conn, limit: int = 10) -> List[dict]:
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT d.id,
+               d.name,
+               d.category,
+               d.price,
+               c.name AS canteen_name,
+               s.avg_score,
+               s.rating_count
+        FROM dish_rating_stats s
+        JOIN dishes d ON d.id = s.dish_id
+        JOIN canteens c ON d.canteen_id = c.id
+        WHERE s.rating_count > 0
+        ORDER BY s.avg_score DESC, s.rating_count DESC
+        LIMIT ?
+        """,
+        (limit,),
+    )
+    return [dict(row) for row in cur.fetchall()]
+
+
+def _format_dish_line(d: dict) -> str:
+    return (
+        f"- {d['name']} (canteen={d['canteen_name']}, stall={d.get('category')}, "
+        f"avg_score={d['avg_score']:.1f}, ratings={d['rating_count']})"
+    )
 
 
-def _build_context_text(user_top: List[dict], global_top: List[dict]) -> str:
-    lines: List[str] = []
+def _format_user_block(user_top: List[dict]) -> str:
+    lines: List[str] = ["[User Favorite Dishes]"]
     if user_top:
-        lines.append("[User Favorite Dishes]")
-        for d in user_top:
-            lines.append(
-                f"- {d['name']} (canteen={d['canteen_name']}, stall={d.get('category')}, "
-                f"avg_score={d['avg_score']:.1f}, ratings={d['rating_count']})"
-            )
+        lines.extend(_format_dish_line(d) for d in user_top)
     else:
-        lines.append("[User Favorite Dishes]")
         lines.append("- This user has no historical high ratings yet.")
+    return "\n".join(lines)
 
-    if global_top:
-        lines.append("\n[Global Top Dishes]")
-        for d in global_top:
-            lines.append(
-                f"- {d['name']} (canteen={d['canteen_name']}, stall={d.get('category')}, "
-                f"avg_score={d['avg_score']:.1f}, ratings={d['rating_count']})"
-            )
 
+def _format_global_block(global_top: List[dict]) -> str:
+    if not global_top:
+        return ""
+    return "\n".join(["\n[Global Top Dishes]"] + [_format_dish_line(d) for d in global_top])
+
+
+def _format_relevant_block(dishes: List[dict]) -> str:
+    lines = ["\n[Relevant Dishes]"]
+    for d in dishes:
+        details = [f"canteen={d['canteen_name']}", f"stall={d.get('category')}"]
+        if d.get("price") is not None:
+            details.append(f"price={d['price']:.1f}")
+        if d.get("calories"):
+            details.append(f"calories={d['calories']}")
+        ingredients = d.get("ingredients_zh") or d.get("ingredients")
+        if ingredients:
+            details.append(f"ingredients={ingredients}")
+        lines.append(f"- {d['name']} ({', '.join(details)})")
     return "\n".join(lines)
 
 
-async def _call_moonshot(prompt: str, user_message: str) -> str:
-    api_key = os.getenv("MOONSHOT_API_KEY")
-    model = os.getenv("MOONSHOT_MODEL_NAME", "kimi-k2-0711-preview")
-    api_base = os.getenv("MOONSHOT_API_BASE", "https://api.moonshot.cn/v1")
-    language = os.getenv("LLM_DEFAULT_LANGUAGE", "zh")
-    assistant_name = os.getenv("LLM_ASSISTANT_NAME", "CampusCanteenAssistant")
+def _build_context_text(user_block: str, dish_block: str) -> str:
+    return f"{user_block}\n{dish_block}" if dish_block else user_block
+
+
+def _load_context_blocks(conn, user_id: int, need_user: bool, need_global: bool):
+    """Build whichever context blocks the cache didn't have and store them."""
+    user_block = global_block = None
+    if need_user:
+        user_block = _format_user_block(_fetch_user_top_dishes(conn, user_id=user_id, limit=5))
+        context_cache.set(("user", user_id), user_block)
+    if need_global:
+        global_top = _fetch_global_top_dishes(conn, limit=10)
+        global_block = _format_global_block(global_top)
+        context_cache.set(("global", "rows"), global_top)
+        context_cache.set(("global", "block"), global_block)
+    return user_block, global_block
+
+
+async def _get_context_text(user_id: int, message: str) -> str:
+    """RAG context: the user's favourites plus the dishes most relevant to
+    ``message``, or the global top list when nothing in the catalogue matches.
+    Cache lookups and an in-memory index query when warm.
+    """
+    if dish_index.is_stale():
+        await run_in_db(dish_index.ensure_fresh)
+    if ingredient_index.is_stale():
+        await run_in_db(ingredient_index.ensure_fresh)
+    relevant = dish_index.search(message)
+
+    user_hit, user_block = context_cache.get(("user", user_id))
+    global_hit, global_block = (True, "") if relevant else context_cache.get(("global", "block"))
+    if not (user_hit and global_hit):
+        loaded_user, loaded_global = await run_in_db(
+            _load_context_blocks, user_id, not user_hit, not global_hit
+        )
+        user_block = user_block if user_hit else loaded_user
+        global_block = global_block if global_hit else loaded_global
+    dish_block = _format_relevant_block(relevant) if relevant else global_block
+    return _build_context_text(user_block, dish_block)
 
-    if not api_key:
+
+def _check_api_key(settings: MoonshotSettings) -> None:
+    if not settings.api_key:
         raise HTTPException(status_code=500, detail="MOONSHOT_API_KEY未配置，请在.env文件中设置API密钥")
     
     # 验证API密钥格式
-    if not api_key.startswith("sk-"):
+    if not settings.api_key.startswith("sk-"):
         raise HTTPException(status_code=500, detail="API密钥格式不正确，应以'sk-'开头")
 
-    url = f"{api_base.rstrip('/')}/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
 
+def _build_request(settings: MoonshotSettings, prompt: str, user_message: str, stream: bool = False) -> dict:
     system_prompt = (
-        f"你是校园食堂点餐助手 {assistant_name}，主要负责根据数据库中真实存在的菜品、价格和评分信息，帮学生设计合适的点餐组合。"
+        f"你是校园食堂点餐助手 {settings.assistant_name}，主要负责根据数据库中真实存在的菜品、价格和评分信息，帮学生设计合适的点餐组合。"
         f"必须基于下面提供的菜品数据作答，不要编造数据库中不存在的餐厅或菜品；可以根据预算、口味偏好（比如不吃辣、少油）、就餐时间等给出推荐。"
-        f"回答语言使用 {language}，语气友好、简洁，并尽量给出具体菜名、食堂和档口信息。"
+        f"回答语言使用 {settings.language}，语气友好、简洁，并尽量给出具体菜名、食堂和档口信息。"
     )
 
     payload = {
-        "model": model,
+        "model": settings.model,
         "messages": [
             {"role": "system", "content": system_prompt},
             {
@@ -136,104 +185,345 @@ async def _call_moonshot(prompt: str, user_message: str) -> str:
             {"role": "user", "content": user_message},
         ],
     }
+    if stream:
+        payload["stream"] = True
+
+    return {
+        "url": settings.completions_url,
+        "headers": {
+            "Authorization": f"Bearer {settings.api_key}",
+            "Content-Type": "application/json",
+        },
+        "json": payload,
+    }
 
+
+def _upstream_error(status_code: int, body_text: str) -> HTTPException:
+    error_detail = f"HTTP {status_code}"
+    
+    # 尝试解析错误信息
     try:
-        # 配置httpx客户端，处理SSL和代理问题
-        client_kwargs = {
-            "timeout": 30.0,
-            "verify": True,  # SSL验证
-        }
-        # 如果环境变量设置了代理，使用代理
-        http_proxy = os.getenv("HTTP_PROXY") or os.getenv("http_proxy")
-        https_proxy = os.getenv("HTTPS_PROXY") or os.getenv("https_proxy")
-        if https_proxy or http_proxy:
-            proxies = {}
-            if https_proxy:
-                proxies["https://"] = https_proxy
-            if http_proxy:
-                proxies["http://"] = http_proxy
-            elif https_proxy:
-                proxies["http://"] = https_proxy  # 如果没有HTTP代理，使用HTTPS代理
-            client_kwargs["proxies"] = proxies
-        
-        async with httpx.AsyncClient(**client_kwargs) as client:
-            resp = await client.post(url, headers=headers, json=payload)
-            if resp.status_code != 200:
-                error_text = resp.text
-                error_detail = f"HTTP {resp.status_code}"
-                
-                # 尝试解析错误信息
-                try:
-                    error_json = resp.json()
-                    if "error" in error_json:
-                        error_info = error_json["error"]
-                        error_detail = error_info.get("message", error_info.get("type", error_text))
-                except:
-                    pass
-                
-                # 根据状态码提供更友好的错误信息
-                if resp.status_code == 401:
-                    error_detail = "API密钥无效或已过期，请检查.env文件中的MOONSHOT_API_KEY是否正确"
-                elif resp.status_code == 403:
-                    error_detail = "API密钥没有访问权限，请检查API密钥的权限设置"
-                elif resp.status_code == 429:
-                    error_detail = "API调用频率过高，请稍后再试"
-                elif resp.status_code >= 500:
-                    error_detail = f"Moonshot API服务器错误 ({resp.status_code})，请稍后再试"
-                else:
-                    error_detail = f"Moonshot API错误 ({resp.status_code}): {error_detail}"
-                
-                raise HTTPException(status_code=500, detail=error_detail)
-            data = resp.json()
+        error_json = json.loads(body_text)
+        if "error" in error_json:
+            error_info = error_json["error"]
+            error_detail = error_info.get("message", error_info.get("type", body_text))
+    except:
+        pass
+    
+    # 根据状态码提供更友好的错误信息
+    if status_code == 401:
+        error_detail = "API密钥无效或已过期，请检查.env文件中的MOONSHOT_API_KEY是否正确"
+    elif status_code == 403:
+        error_detail = "API密钥没有访问权限，请检查API密钥的权限设置"
+    elif status_code == 429:
+        return UpstreamUnavailable(status_code=500, detail="API调用频率过高，请稍后再试")
+    elif status_code >= 500:
+        return UpstreamUnavailable(status_code=500, detail=f"Moonshot API服务器错误 ({status_code})，请稍后再试")
+    else:
+        error_detail = f"Moonshot API错误 ({status_code}): {error_detail}"
+    
+    return HTTPException(status_code=500, detail=error_detail)
 
-        try:
-            return data["choices"][0]["message"]["content"]
-        except (KeyError, IndexError) as exc:
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Invalid response format from Moonshot: {exc}. Response: {data}"
-            )
-    except httpx.TimeoutException:
-        raise HTTPException(status_code=500, detail="请求超时（30秒）。如果使用代理，可能需要配置代理设置或增加超时时间")
-    except httpx.ConnectError as e:
-        error_msg = str(e)
+
+def _transport_error(exc: Exception, settings: MoonshotSettings) -> HTTPException:
+    if isinstance(exc, HTTPException):
+        return exc
+    if isinstance(exc, httpx.TimeoutException):
+        return UpstreamUnavailable(
+            status_code=500,
+            detail=f"请求超时（{settings.timeout:g}秒）。如果使用代理，可能需要配置代理设置或增加超时时间",
+        )
+    if isinstance(exc, httpx.ConnectError):
+        error_msg = str(exc)
         if "proxy" in error_msg.lower() or "代理" in error_msg:
-            raise HTTPException(
+            return UpstreamUnavailable(
                 status_code=500, 
                 detail="无法通过代理连接到Moonshot API。请检查：1) 代理设置是否正确 2) 代理服务器是否正常运行 3) 是否需要在.env中配置HTTPS_PROXY"
             )
-        raise HTTPException(
+        return UpstreamUnavailable(
             status_code=500, 
-            detail=f"无法连接到Moonshot API服务器。请检查：1) 网络连接是否正常 2) 防火墙设置 3) 如果使用代理，请配置HTTPS_PROXY环境变量"
+            detail="无法连接到Moonshot API服务器。请检查：1) 网络连接是否正常 2) 防火墙设置 3) 如果使用代理，请配置HTTPS_PROXY环境变量"
         )
-    except httpx.RequestError as e:
-        error_msg = str(e)
+    if isinstance(exc, httpx.RequestError):
+        error_msg = str(exc)
         if "SSL" in error_msg or "certificate" in error_msg.lower() or "TLS" in error_msg:
-            raise HTTPException(
+            return UpstreamUnavailable(
                 status_code=500, 
                 detail="SSL/TLS连接失败。如果使用代理，可能需要：1) 在.env中配置HTTPS_PROXY 2) 检查代理的SSL证书设置 3) 临时禁用SSL验证（不推荐）"
             )
-        raise HTTPException(status_code=500, detail=f"网络请求错误: {error_msg}")
+        return UpstreamUnavailable(status_code=500, detail=f"网络请求错误: {error_msg}")
+    return HTTPException(status_code=500, detail=f"Unexpected error calling Moonshot API: {str(exc)}")
+
+
+async def _call_moonshot(prompt: str, user_message: str) -> str:
+    settings = get_settings()
+    _check_api_key(settings)
+    request = _build_request(settings, prompt, user_message)
+
+    async with llm_limiter:
+        try:
+            # 复用应用启动时创建的共享客户端（连接池、keep-alive、代理配置）
+            client = get_llm_client()
+            resp = await client.post(**request)
+            if resp.status_code != 200:
+                raise _upstream_error(resp.status_code, resp.text)
+            data = resp.json()
+
+            try:
+                answer = data["choices"][0]["message"]["content"]
+            except (KeyError, IndexError) as exc:
+                raise HTTPException(
+                    status_code=500, 
+                    detail=f"Invalid response format from Moonshot: {exc}. Response: {data}"
+                )
+        except Exception as exc:
+            error = _transport_error(exc, settings)
+            _record_outcome(error)
+            raise error
+    _record_outcome(None)
+    return answer
+
+
+def _record_outcome(error: Optional[HTTPException]) -> None:
+    # Any answer from the upstream, even an error status, means it is reachable
+    if isinstance(error, UpstreamUnavailable):
+        llm_breaker.record_failure()
+    else:
+        llm_breaker.record_success()
+
+
+async def _stream_moonshot(prompt: str, user_message: str) -> AsyncIterator[Optional[str]]:
+    """Yield ``None`` once the upstream has accepted the request, then content deltas.
+
+    Priming the generator with the first ``__anext__()`` surfaces key, connect and
+    HTTP status errors as a regular ``HTTPException`` before any SSE bytes are sent.
+    Closing the generator (client went away) closes the upstream response.
+    The limiter slot is held until the stream ends.
+    """
+    settings = get_settings()
+    _check_api_key(settings)
+    request = _build_request(settings, prompt, user_message, stream=True)
+    client = get_llm_client()
+
+    await llm_limiter.acquire()
+    try:
+        async with client.stream("POST", **request) as resp:
+            if resp.status_code != 200:
+                await resp.aread()
+                raise _upstream_error(resp.status_code, resp.text)
+            _record_outcome(None)
+            yield None
+
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    delta = json.loads(data)["choices"][0].get("delta") or {}
+                except (ValueError, KeyError, IndexError) as exc:
+                    raise HTTPException(
+                        status_code=500,
+                        detail=f"Invalid stream chunk from Moonshot: {exc}. Chunk: {data}",
+                    )
+                if delta.get("content"):
+                    yield delta["content"]
+    except Exception as exc:
+        error = _transport_error(exc, settings)
+        _record_outcome(error)
+        raise error
+    finally:
+        llm_limiter.release()
+
+
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _relay_sse(
+    request: Request,
+    upstream: AsyncIterator[Optional[str]],
+    on_done: Optional[Callable[[str], None]] = None,
+) -> AsyncIterator[str]:
+    parts: List[str] = []
+    try:
+        async for delta in upstream:
+            if await request.is_disconnected():
+                break
+            parts.append(delta)
+            yield _sse({"delta": delta})
+        else:
+            if on_done is not None:
+                on_done("".join(parts))
+            yield _sse({}, event="done")
+    except HTTPException as exc:
+        yield _sse({"detail": exc.detail}, event="error")
+    finally:
+        await upstream.aclose()
+
+
+async def _replay_sse(answer: str, fallback: bool = False) -> AsyncIterator[str]:
+    yield _sse({"delta": answer})
+    yield _sse({"fallback": True} if fallback else {}, event="done")
+
+
+def _fallback_text(message: str, global_top: List[dict], language: str) -> str:
+    """A plain top-rated list, honouring a budget like "15元以内" when one is given."""
+    dishes = global_top
+    budget = parse_budget(message)
+    if budget is not None:
+        dishes = [d for d in global_top if d["price"] is not None and d["price"] <= budget] or global_top
+    dishes = dishes[:5]
+    zh = language.lower().startswith("zh")
+
+    if not dishes:
+        return "点餐助手暂时繁忙，请稍后再试。" if zh else "The assistant is busy right now, please try again shortly."
+    if zh:
+        lines = ["点餐助手暂时繁忙，先根据大家的评分为你推荐："]
+        lines += [
+            f"- {d['name']}（{d['canteen_name']} · {d.get('category')}，¥{d['price']:.1f}，"
+            f"评分 {d['avg_score']:.1f}，{d['rating_count']} 人评价）"
+            for d in dishes
+        ]
+    else:
+        lines = ["The assistant is busy right now. Top-rated dishes you could try:"]
+        lines += [
+            f"- {d['name']} ({d['canteen_name']} / {d.get('category')}, ¥{d['price']:.1f}, "
+            f"rated {d['avg_score']:.1f} by {d['rating_count']})"
+            for d in dishes
+        ]
+    return "\n".join(lines)
+
+
+async def _fallback_answer(message: str, reason: str) -> str:
+    """Answer built locally from the cached global top-dishes context."""
+    chat_metrics.record_fallback(reason)
+    hit, global_top = context_cache.get(("global", "rows"))
+    if not hit:
+        global_top = await run_in_db(_fetch_global_top_dishes, 10)
+        context_cache.set(("global", "rows"), global_top)
+    return _fallback_text(message, global_top, get_settings().language)
+
+
+async def _answer(context_text: str, message: str) -> ChatAnswer:
+    """Cached / coalesced / guarded wrapper around ``_call_moonshot``."""
+    key = prompt_key(message, context_text)
+    hit, cached = response_cache.get(key)
+    if hit:
+        chat_metrics.record_hit(cached.latency)
+        return ChatAnswer(answer=cached.answer)
+    if not llm_breaker.allow():
+        chat_metrics.record_short_circuit()
+        return ChatAnswer(answer=await _fallback_answer(message, "circuit_open"), fallback=True)
+
+    async def call() -> TimedAnswer:
+        started = time.perf_counter()
+        answer = await _call_moonshot(context_text, message)
+        result = TimedAnswer(answer, time.perf_counter() - started)
+        response_cache.set(key, result)
+        return result
+
+    try:
+        result, shared = await singleflight.do(key, call)
+    except LimiterTimeout:
+        chat_metrics.record_error()
+        return ChatAnswer(answer=await _fallback_answer(message, "queue_timeout"), fallback=True)
+    except UpstreamUnavailable:
+        chat_metrics.record_error()
+        return ChatAnswer(answer=await _fallback_answer(message, "upstream_error"), fallback=True)
     except HTTPException:
+        chat_metrics.record_error()
         raise
-    except Exception as exc:
-        raise HTTPException(status_code=500, detail=f"Unexpected error calling Moonshot API: {str(exc)}")
+    if shared:
+        chat_metrics.record_coalesced(result.latency)
+    else:
+        chat_metrics.record_upstream(result.latency)
+    return ChatAnswer(answer=result.answer)
 
 
 @router.post("/chat", response_model=ChatAnswer)
 async def chat_with_assistant(body: ChatMessage) -> ChatAnswer:
-    """Chat endpoint that uses Moonshot LLM + simple RAG over SQLite dishes/ratings."""
+    """Chat endpoint that uses Moonshot LLM + simple RAG over SQLite dishes/ratings.
+
+    If the LLM is overloaded, failing or behind an open circuit breaker the
+    answer is built locally from the top-rated dishes and ``fallback`` is set.
+    """
     try:
         user_id = body.user_id or 1
-        user_top = _fetch_user_top_dishes(user_id=user_id, limit=5)
-        global_top = _fetch_global_top_dishes(limit=10)
-        context_text = _build_context_text(user_top, global_top)
+        context_text = await _get_context_text(user_id, body.message)
 
-        answer_text = await _call_moonshot(context_text, body.message)
-        return ChatAnswer(answer=answer_text)
+        return await _answer(context_text, body.message)
     except HTTPException:
         raise
     except Exception as e:
         import traceback
         error_detail = f"Chat error: {str(e)}\n{traceback.format_exc()}"
         raise HTTPException(status_code=500, detail=error_detail)
+
+
+@router.post("/chat/stream")
+async def chat_stream(body: ChatMessage, request: Request) -> StreamingResponse:
+    """Streaming variant of /chat: relays the LLM answer as Server-Sent Events.
+
+    Each chunk is ``data: {"delta": "..."}``; the stream ends with ``event: done``,
+    or ``event: error`` carrying ``detail`` if the upstream fails mid-answer.
+    Cached and local fallback answers are replayed as a single delta (a
+    fallback's ``done`` event carries ``{"fallback": true}``).
+    """
+    user_id = body.user_id or 1
+    context_text = await _get_context_text(user_id, body.message)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    key = prompt_key(body.message, context_text)
+    hit, cached = response_cache.get(key)
+    if hit:
+        chat_metrics.record_hit(cached.latency)
+        return StreamingResponse(_replay_sse(cached.answer), media_type="text/event-stream", headers=headers)
+
+    fallback_reason = None
+    if not llm_breaker.allow():
+        chat_metrics.record_short_circuit()
+        fallback_reason = "circuit_open"
+    else:
+        started = time.perf_counter()
+
+        def on_done(answer: str) -> None:
+            result = TimedAnswer(answer, time.perf_counter() - started)
+            response_cache.set(key, result)
+            chat_metrics.record_upstream(result.latency)
+
+        upstream = _stream_moonshot(context_text, body.message)
+        try:
+            await upstream.__anext__()
+        except LimiterTimeout:
+            chat_metrics.record_error()
+            fallback_reason = "queue_timeout"
+        except UpstreamUnavailable:
+            chat_metrics.record_error()
+            fallback_reason = "upstream_error"
+        except HTTPException:
+            chat_metrics.record_error()
+            raise
+        else:
+            return StreamingResponse(
+                _relay_sse(request, upstream, on_done),
+                media_type="text/event-stream",
+                headers=headers,
+            )
+
+    answer = await _fallback_answer(body.message, fallback_reason)
+    return StreamingResponse(_replay_sse(answer, fallback=True), media_type="text/event-stream", headers=headers)
+
+
+@router.get("/chat/metrics")
+async def chat_metrics_view() -> dict:
+    """Answer reuse, fallback, limiter and circuit-breaker counters for the LLM path."""
+    return {
+        **chat_metrics.snapshot(in_flight=len(singleflight)),
+        "cache": response_cache.stats(),
+        "limiter": llm_limiter.stats(),
+        "breaker": llm_breaker.stats(),
+        "retrieval": dish_index.stats(),
+    }
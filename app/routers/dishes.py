@@ -1,10 +1,24 @@
+import re
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
 from pydantic import BaseModel, Field
 
-from app.db import get_connection
+from app.cache import catalog_cache
+from app.db import dict_rows, tuple_cursor
+from app.dish_search import (
+    BM25_WEIGHTS,
+    bigram_match_expression,
+    bigram_searchable,
+    fts_tables,
+    like_pattern,
+    match_expression,
+    split_query,
+)
+from app.etag import DISH_RATING_TABLES, DISH_TABLES, conditional_get
+from app.ingredients import UnknownIngredientError, ingredient_index
+from app.pagination import decode_cursor, encode_cursor, key_values, parse_fields, project, render_page, select_list
 
 router = APIRouter()
 
@@ -15,50 +29,427 @@ class RatingCreate(BaseModel):
     comment: Optional[str] = None
 
 
+DISH_FIELDS = (
+    "id", "canteen_id", "name", "category", "price",
+    "ingredients", "ingredients_zh", "calories", "is_available", "created_at",
+)
+DISH_SEARCH_EXPRESSIONS = {name: f"d.{name}" for name in DISH_FIELDS}
+
+
+def _list_dishes(conn, fields: Optional[str], limit: Optional[int], cursor: Optional[str]):
+    columns = parse_fields(fields, DISH_FIELDS)
+    where = ""
+    params: list = []
+    if cursor:
+        (last_id,) = decode_cursor(cursor, 1)
+        where = "WHERE id > ?"
+        params.append(last_id)
+    sql = f"SELECT {select_list(columns, keys=('id',))} FROM dishes {where} ORDER BY id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+
+    cur = tuple_cursor(conn)
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*key_values(cur, rows[-1], ("id",)))
+    return project(rows, columns), next_cursor
+
+
 @router.get("/")
-async def list_dishes():
-    """Return all dishes."""
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT id, canteen_id, name, category, price, ingredients, ingredients_zh, calories, is_available, created_at FROM dishes ORDER BY id"
+async def list_dishes(
+    request: Request,
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. id,name,price"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size (omit for all dishes)"),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page"),
+):
+    """Return all dishes, optionally paginated and projected."""
+    return await conditional_get(
+        request, DISH_TABLES, catalog_cache.load, ("dishes", fields, limit, cursor), _list_dishes, fields, limit, cursor,
+        render=render_page,
+    )
+
+
+def _search_dishes(conn, q: str, fields: Optional[str], limit: int, cursor: Optional[str]):
+    columns = parse_fields(fields, DISH_FIELDS)
+    offset = 0
+    if cursor:
+        (offset,) = decode_cursor(cursor, 1)
+        if not isinstance(offset, int) or offset < 0:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    long_terms, short_terms = split_query(q)
+    indexes = fts_tables(conn)
+    if "dishes_fts" not in indexes:
+        long_terms, short_terms = [], long_terms + short_terms
+    bigram_terms: List[str] = []
+    if "dishes_fts_bigram" in indexes:
+        bigram_terms = [t for t in short_terms if bigram_searchable(t)]
+        short_terms = [t for t in short_terms if not bigram_searchable(t)]
+
+    # Rank by the trigram index when there are long terms, else by the bigram one
+    where: List[str] = []
+    params: list = []
+    fts = None
+    match = match_expression(long_terms)
+    bigram_match = bigram_match_expression(bigram_terms)
+    if match:
+        fts = "dishes_fts"
+        where.append("dishes_fts MATCH ?")
+        params.append(match)
+        if bigram_match:
+            where.append("d.id IN (SELECT rowid FROM dishes_fts_bigram WHERE dishes_fts_bigram MATCH ?)")
+            params.append(bigram_match)
+    elif bigram_match:
+        fts = "dishes_fts_bigram"
+        where.append("dishes_fts_bigram MATCH ?")
+        params.append(bigram_match)
+    for term in short_terms:
+        where.append(
+            "(d.name LIKE ? ESCAPE '\\' OR d.category LIKE ? ESCAPE '\\' "
+            "OR d.ingredients LIKE ? ESCAPE '\\' OR d.ingredients_zh LIKE ? ESCAPE '\\')"
+        )
+        params.extend([like_pattern(term)] * 4)
+
+    select = select_list(columns, keys=("id",), expressions=DISH_SEARCH_EXPRESSIONS)
+    weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+    if fts and len(where) == 1:
+        # Rank and page inside the FTS table, then join only the page's rows
+        sql = (
+            f"SELECT {select} FROM ("
+            f"SELECT rowid, bm25({fts}, {weights}) AS score FROM {fts} "
+            f"WHERE {fts} MATCH ? ORDER BY score, rowid LIMIT ? OFFSET ?"
+            f") f JOIN dishes d ON d.id = f.rowid ORDER BY f.score, f.rowid"
+        )
+    elif fts:
+        sql = (
+            f"SELECT {select} FROM {fts} JOIN dishes d ON d.id = {fts}.rowid "
+            f"WHERE {' AND '.join(where)} ORDER BY bm25({fts}, {weights}), d.id LIMIT ? OFFSET ?"
+        )
+    else:
+        # No usable index (punctuated short terms or no FTS5): LIKE scan, name matches first
+        sql = (
+            f"SELECT {select} FROM dishes d WHERE {' AND '.join(where)} "
+            f"ORDER BY d.name LIKE ? ESCAPE '\\' DESC, d.id LIMIT ? OFFSET ?"
+        )
+        params.append(like_pattern(short_terms[0]))
+    params.extend([limit + 1, offset])
+
+    cur = tuple_cursor(conn)
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(offset + limit)
+    return project(rows, columns), next_cursor
+
+
+@router.get("/search")
+async def search_dishes(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=100, description="Search text; every term must match"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. id,name,price"),
+    limit: int = Query(20, ge=1, le=100, description="Page size"),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page"),
+):
+    """Full-text search over dish name, stall and ingredients (English and Chinese), best match first."""
+    q = q.strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="Empty search query")
+    return await conditional_get(request, DISH_TABLES, _search_dishes, q, fields, limit, cursor, render=render_page)
+
+
+# sort parameter -> (column, direction); "-" means descending
+BROWSE_SORTS = {
+    "id": ("id", "ASC"),
+    "price": ("price", "ASC"),
+    "-price": ("price", "DESC"),
+    "calories": ("calories", "ASC"),
+    "-calories": ("calories", "DESC"),
+}
+FACET_COLUMNS = ("is_available", "category", "canteen_id")
+
+
+def _range_clauses(filters: dict, sort_column: Optional[str], cursor_side: Optional[str] = None):
+    """WHERE terms for the price/calorie filters of a query ordered by ``sort_column``.
+
+    ``cursor_side`` (``">"`` or ``"<"``) is the side on which a keyset cursor
+    comparison already bounds the sort column.
+    """
+    clauses: List[str] = []
+    params: list = []
+    for column in ("price", "calories"):
+        for op, name in ((">=", f"min_{column}"), ("<=", f"max_{column}")):
+            value = filters[name]
+            if value is None:
+                continue
+            # Only the sort column may choose the index (a range on the other
+            # one would return its matches out of order, sorting them all),
+            # and with at most one bound per side: given more, SQLite prefers
+            # the index that uses them all over a longer equality prefix
+            indexed = column == sort_column and op[0] != cursor_side
+            clauses.append(f"{column if indexed else '+' + column} {op} ?")
+            params.append(value)
+    return clauses, params
+
+
+def _facet_counts(conn, filters: dict):
+    """``(total, facets)`` for the filtered dishes from a single grouped pass.
+
+    Each facet counts what its values would match with every *other* filter
+    kept, so the range clauses are applied in SQL and the equality filters in
+    Python over the (is_available, category, canteen_id) combinations.
+    """
+    # No range may choose the index: idx_dishes_facets covers the query
+    clauses, params = _range_clauses(filters, None)
+    where = " AND ".join(["is_available IN (0, 1)"] + clauses)
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT is_available, category, canteen_id, COUNT(*) FROM dishes WHERE {where} "
+        f"GROUP BY is_available, category, canteen_id",
+        params,
+    )
+    wanted = {
+        "is_available": int(filters["is_available"]),
+        "category": filters["category"],
+        "canteen_id": filters["canteen_id"],
+    }
+    total = 0
+    counts: dict = {facet: {} for facet in FACET_COLUMNS}
+    for *values, count in cur.fetchall():
+        row = dict(zip(FACET_COLUMNS, values))
+        mismatched = [f for f in FACET_COLUMNS if wanted[f] is not None and row[f] != wanted[f]]
+        if not mismatched:
+            total += count
+        for facet in FACET_COLUMNS:
+            if all(f == facet for f in mismatched):
+                counts[facet][row[facet]] = counts[facet].get(row[facet], 0) + count
+    facets = {
+        facet: [
+            {"value": value, "count": count}
+            for value, count in sorted(values.items(), key=lambda item: (-item[1], str(item[0])))
+        ]
+        for facet, values in counts.items()
+    }
+    return total, facets
+
+
+def _unbounded(filters: dict, sort_column: str) -> bool:
+    return filters[f"min_{sort_column}"] is None and filters[f"max_{sort_column}"] is None
+
+
+def _browse_walk(conn, filters: dict, sort_column: str, direction: str, select: str, after, nulls: bool, fetch: int):
+    """Up to ``fetch`` rows from one walk of an idx_dishes_*available_<sort column> index.
+
+    ``nulls`` walks the dishes with no value for the sort column (in id
+    order) instead of those with one; ``after`` holds the keyset cursor
+    values to resume after, if any.
+    """
+    op = "<" if direction == "DESC" else ">"
+    seek = after is not None and not nulls
+    clauses, params = _range_clauses(filters, sort_column, op if seek else None)
+    if nulls:
+        clauses.append(f"{sort_column} IS NULL")
+    elif sort_column != "id" and after is None and _unbounded(filters, sort_column):
+        clauses.append(f"{sort_column} IS NOT NULL")
+    for column in ("canteen_id", "category"):
+        if filters[column] is not None:
+            clauses.append(f"{column} = ?")
+            params.append(filters[column])
+    # Availability is always an equality so the query seeks into one of the
+    # idx_dishes_*available_<sort column> indexes and walks it in output order
+    clauses.append("is_available = ?")
+    params.append(int(filters["is_available"]))
+
+    if after is not None:
+        if sort_column == "id" or nulls:
+            clauses.append(f"id {op} ?")
+            params.append(after[-1])
+        else:
+            clauses.append(f"({sort_column}, id) {op} (?, ?)")
+            params.extend(after)
+    order = "id" if sort_column == "id" else f"{sort_column} {direction}, id {direction}"
+
+    cur = tuple_cursor(conn)
+    cur.execute(
+        f"SELECT {select} FROM dishes WHERE {' AND '.join(clauses)} ORDER BY {order} LIMIT ?",
+        params + [fetch],
+    )
+    return cur, cur.fetchall()
+
+
+def _browse_dishes(conn, filters: dict, sort: str, fields: Optional[str], limit: int, cursor: Optional[str]):
+    columns = parse_fields(fields, DISH_FIELDS)
+    sort_column, direction = BROWSE_SORTS[sort]
+    keys = ("id",) if sort_column == "id" else (sort_column, "id")
+    select = select_list(columns, keys=keys)
+    # A cursor past the last valued dish holds a null sort value
+    after = decode_cursor(cursor, len(keys), nullable=(0,) if sort_column != "id" else ()) if cursor else None
+    in_nulls = after is not None and sort_column != "id" and after[0] is None
+
+    # Dishes with no value for the sort column come last (in id order, either
+    # direction): a second walk of the same index, over its NULL entries,
+    # continues where the valued ones run out. A price/calorie range on the
+    # sort column leaves them out anyway
+    rows: list = []
+    cur = None
+    if not in_nulls:
+        cur, rows = _browse_walk(conn, filters, sort_column, direction, select, after, False, limit + 1)
+    if sort_column != "id" and _unbounded(filters, sort_column) and len(rows) <= limit:
+        cur, more = _browse_walk(
+            conn, filters, sort_column, direction, select, after if in_nulls else None, True, limit + 1 - len(rows)
         )
-        rows = cur.fetchall()
-        return [dict(row) for row in rows]
-    finally:
-        conn.close()
+        rows += more
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*key_values(cur, rows[-1], keys))
+
+    # The counts don't depend on the page or the sort, and take a pass over
+    # every dish matching the range filters, so they are cached per filter set
+    # until the catalog changes
+    total, facets = catalog_cache.load(conn, ("browse_facets", tuple(filters.values())), _facet_counts, filters)
+    return {"items": project(rows, columns), "total": total, "facets": facets}, next_cursor
+
+
+@router.get("/browse")
+async def browse_dishes(
+    request: Request,
+    canteen_id: Optional[int] = Query(None, description="Only dishes of this canteen"),
+    category: Optional[str] = Query(None, description="Only dishes of this category (stall)"),
+    is_available: bool = Query(True, description="Dishes on sale (true) or currently unavailable (false)"),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    min_calories: Optional[int] = Query(None, ge=0),
+    max_calories: Optional[int] = Query(None, ge=0),
+    sort: str = Query("id", description="One of: " + ", ".join(BROWSE_SORTS)),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. id,name,price"),
+    limit: int = Query(20, ge=1, le=200, description="Page size"),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page"),
+):
+    """Filter and sort dishes server-side, with facet counts.
+
+    Returns one page of ``items``, the ``total`` number of matches and, per
+    facet (category, canteen_id, is_available), how many dishes each value
+    would match with the other filters unchanged. Sorting never changes
+    which dishes match: those with no price (or calories) follow the rest
+    when sorting by it.
+    """
+    if sort not in BROWSE_SORTS:
+        raise HTTPException(status_code=400, detail=f"Unknown sort {sort!r}. Allowed: {', '.join(BROWSE_SORTS)}")
+    filters = {
+        "canteen_id": canteen_id, "category": category, "is_available": is_available,
+        "min_price": min_price, "max_price": max_price,
+        "min_calories": min_calories, "max_calories": max_calories,
+    }
+    key = ("browse", tuple(filters.values()), sort, fields, limit, cursor)
+    return await conditional_get(
+        request, DISH_TABLES, catalog_cache.load, key, _browse_dishes, filters, sort, fields, limit, cursor,
+        render=render_page,
+    )
+
+
+def _ingredient_names(value: Optional[str]) -> List[str]:
+    return [name.strip() for name in re.split(r"[,，、]", value or "") if name.strip()]
+
+
+def _dishes_by_ingredients(
+    conn, include: List[str], exclude: List[str], available_only: bool,
+    fields: Optional[str], limit: int, cursor: Optional[str],
+):
+    columns = parse_fields(fields, DISH_FIELDS)
+    after_id = None
+    if cursor:
+        (after_id,) = decode_cursor(cursor, 1)
+        if not isinstance(after_id, int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    ingredient_index.ensure_fresh(conn)
+    try:
+        dish_ids, has_more = ingredient_index.filter(include, exclude, available_only, after_id, limit)
+    except UnknownIngredientError as exc:
+        raise HTTPException(status_code=400, detail=f"Unknown ingredient(s): {exc}")
+    if not dish_ids:
+        return [], None
+
+    cur = tuple_cursor(conn)
+    cur.execute(
+        f"SELECT {select_list(columns, keys=('id',))} FROM dishes "
+        f"WHERE id IN ({', '.join('?' * len(dish_ids))}) ORDER BY id",
+        dish_ids,
+    )
+    rows = cur.fetchall()
+    next_cursor = encode_cursor(dish_ids[-1]) if has_more else None
+    return project(rows, columns), next_cursor
+
+
+@router.get("/by-ingredients")
+async def dishes_by_ingredients(
+    request: Request,
+    include: Optional[str] = Query(None, description="Comma-separated ingredients every dish must contain, e.g. 鸡肉,rice"),
+    exclude: Optional[str] = Query(None, description="Comma-separated ingredients to leave out, e.g. peanuts,猪肉"),
+    available_only: bool = Query(True, description="Only dishes currently on sale"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. id,name,price"),
+    limit: int = Query(50, ge=1, le=500, description="Page size"),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page"),
+):
+    """Filter dishes by ingredient (English or Chinese names), e.g. for allergies.
+
+    A name also covers ingredients derived from it: excluding "pork" drops
+    dishes with pork belly or ground pork too.
+    """
+    return await conditional_get(
+        request, DISH_TABLES, _dishes_by_ingredients, _ingredient_names(include), _ingredient_names(exclude),
+        available_only, fields, limit, cursor,
+        render=render_page,
+    )
+
+
+def _list_ingredients(conn, available_only: bool):
+    ingredient_index.ensure_fresh(conn)
+    return ingredient_index.ingredient_counts(available_only)
+
+
+@router.get("/ingredients")
+async def list_ingredients(
+    request: Request,
+    available_only: bool = Query(True, description="Count only dishes currently on sale"),
+):
+    """All known ingredients with their English/Chinese names and dish counts."""
+    return await conditional_get(request, DISH_TABLES, _list_ingredients, available_only)
+
+
+def _get_dish(conn, dish_id: int):
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT id, canteen_id, name, category, price, ingredients, ingredients_zh, calories, is_available, created_at FROM dishes WHERE id = ?",
+        (dish_id,),
+    )
+    row = cur.fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Dish not found")
+    return dict(row)
 
 
 @router.get("/{dish_id}")
-async def get_dish(dish_id: int):
+async def get_dish(dish_id: int, request: Request):
     """Return single dish details by id."""
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT id, canteen_id, name, category, price, ingredients, ingredients_zh, calories, is_available, created_at FROM dishes WHERE id = ?",
-            (dish_id,),
-        )
-        row = cur.fetchone()
-        if row is None:
-            raise HTTPException(status_code=404, detail="Dish not found")
-        return dict(row)
-    finally:
-        conn.close()
+    return await conditional_get(request, DISH_TABLES, catalog_cache.load, ("dish", dish_id), _get_dish, dish_id)
+
+
+def _get_dish_ratings(conn, dish_id: int):
+    return dict_rows(
+        conn,
+        "SELECT id, user_id, dish_id, score, comment, created_at FROM ratings WHERE dish_id = ? ORDER BY created_at DESC",
+        (dish_id,),
+    )
 
 
 @router.get("/{dish_id}/ratings")
-async def get_dish_ratings(dish_id: int):
+async def get_dish_ratings(dish_id: int, request: Request):
     """Return ratings for a specific dish (used by frontend)."""
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT id, user_id, dish_id, score, comment, created_at FROM ratings WHERE dish_id = ? ORDER BY created_at DESC",
-            (dish_id,),
-        )
-        rows = cur.fetchall()
-        return [dict(row) for row in rows]
-    finally:
-        conn.close()
+    return await conditional_get(request, DISH_RATING_TABLES, _get_dish_ratings, dish_id)
@@ -1,53 +1,55 @@
 """API for dish options"""
 import json
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 
-from app.db import get_connection
+from app.cache import catalog_cache
+from app.etag import OPTION_TABLES, conditional_get
 
 router = APIRouter()
 
 
-@router.get("/dish/{dish_id}")
-async def get_dish_options(dish_id: int):
-    """Get all option configurations for a specific dish"""
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        
-        # Check if dish exists
-        cur.execute("SELECT id FROM dishes WHERE id = ?", (dish_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Dish not found")
-        
-        # Get option configurations
-        cur.execute(
-            """
-            SELECT id, option_type, option_name_zh, option_name_en, option_values, is_required
-            FROM dish_option_configs
-            WHERE dish_id = ?
-            ORDER BY id
-            """,
-            (dish_id,),
-        )
-        rows = cur.fetchall()
+def _get_dish_options(conn, dish_id: int):
+    cur = conn.cursor()
+    
+    # Check if dish exists
+    cur.execute("SELECT id FROM dishes WHERE id = ?", (dish_id,))
+    if not cur.fetchone():
+        raise HTTPException(status_code=404, detail="Dish not found")
+    
+    # Get option configurations
+    cur.execute(
+        """
+        SELECT id, option_type, option_name_zh, option_name_en, option_values, is_required
+        FROM dish_option_configs
+        WHERE dish_id = ?
+        ORDER BY id
+        """,
+        (dish_id,),
+    )
+    rows = cur.fetchall()
+    
+    options = []
+    for row in rows:
+        try:
+            option_values = json.loads(row["option_values"])
+        except:
+            option_values = []
         
-        options = []
-        for row in rows:
-            try:
-                option_values = json.loads(row["option_values"])
-            except:
-                option_values = []
-            
-            options.append({
-                "id": row["id"],
-                "option_type": row["option_type"],
-                "option_name_zh": row["option_name_zh"],
-                "option_name_en": row["option_name_en"],
-                "option_values": option_values,
-                "is_required": bool(row["is_required"]),
-            })
-        
-        return options
-    finally:
-        conn.close()
+        options.append({
+            "id": row["id"],
+            "option_type": row["option_type"],
+            "option_name_zh": row["option_name_zh"],
+            "option_name_en": row["option_name_en"],
+            "option_values": option_values,
+            "is_required": bool(row["is_required"]),
+        })
+    
+    return options
+
 
+@router.get("/dish/{dish_id}")
+async def get_dish_options(dish_id: int, request: Request):
+    """Get all option configurations for a specific dish"""
+    return await conditional_get(
+        request, OPTION_TABLES, catalog_cache.load, ("dish_options", dish_id), _get_dish_options, dish_id
+    )
@@ -1,14 +1,20 @@
 import json
+import sqlite3
+from collections import defaultdict
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel, Field
 
-from app.db import get_connection
+from app.db import fetch_dicts, run_in_db, tuple_cursor
+from app.pagination import decode_cursor, encode_cursor, page_response
 
 router = APIRouter()
 
+# Orders whose items are fetched per query when listing a user's orders
+ORDER_ITEMS_BATCH = 500
+
 
 class OrderItemIn(BaseModel):
     dish_id: int
@@ -23,45 +29,48 @@ class OrderCreate(BaseModel):
     total_price: float = None  # Total price calculated by frontend (optional, for validation)
 
 
-@router.post("/", status_code=201)
-async def create_order(order: OrderCreate):
-    if not order.items:
-        raise HTTPException(status_code=400, detail="Order must contain at least one item")
-
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-
-        # Validate dishes and compute total
-        total_price = 0.0
-        priced_items = []  # (dish_id, quantity, price, options)
-        for item in order.items:
-            cur.execute(
-                "SELECT price FROM dishes WHERE id = ? AND is_available = 1",
-                (item.dish_id,),
-            )
-            row = cur.fetchone()
-            if row is None:
-                raise HTTPException(status_code=404, detail=f"Dish {item.dish_id} not found or not available")
-            
-            # If frontend has calculated price including options, use frontend price; otherwise use base price
-            if hasattr(item, 'price') and item.price is not None:
-                price = float(item.price)
-            else:
-                price = float(row["price"] or 0.0)
-                # If options exist, need to calculate extra price (simplified here, should get from option configs)
-                # Frontend has already calculated it, so use frontend price directly
-            
-            total_price += price * item.quantity
-            priced_items.append((item.dish_id, item.quantity, price, item.options))
+def _create_order(conn, order: OrderCreate):
+    cur = conn.cursor()
+    # Take the write lock up front so validation and inserts see one snapshot
+    # and concurrent orders queue on busy_timeout instead of failing to upgrade
+    cur.execute("BEGIN IMMEDIATE")
+
+    # Validate all dishes with a single lookup
+    dish_ids = sorted({item.dish_id for item in order.items})
+    placeholders = ",".join("?" * len(dish_ids))
+    cur.execute(
+        f"SELECT id, price FROM dishes WHERE id IN ({placeholders}) AND is_available = 1",
+        dish_ids,
+    )
+    base_prices = {row["id"]: row["price"] for row in cur.fetchall()}
+
+    # Compute total
+    total_price = 0.0
+    item_rows = []  # (dish_id, quantity, price, options_json); order_id filled in below
+    for item in order.items:
+        if item.dish_id not in base_prices:
+            raise HTTPException(status_code=404, detail=f"Dish {item.dish_id} not found or not available")
+        
+        # If frontend has calculated price including options, use frontend price; otherwise use base price
+        if item.price is not None:
+            price = float(item.price)
+        else:
+            price = float(base_prices[item.dish_id] or 0.0)
+            # If options exist, need to calculate extra price (simplified here, should get from option configs)
+            # Frontend has already calculated it, so use frontend price directly
         
-        # If frontend provided total price, use it (more accurate as it includes option costs)
-        if order.total_price is not None:
-            total_price = float(order.total_price)
+        total_price += price * item.quantity
+        options_json = json.dumps(item.options) if item.options else None
+        item_rows.append((item.dish_id, item.quantity, price, options_json))
+    
+    # If frontend provided total price, use it (more accurate as it includes option costs)
+    if order.total_price is not None:
+        total_price = float(order.total_price)
 
-        now = datetime.utcnow().isoformat()
+    now = datetime.utcnow().isoformat()
 
-        # Insert order
+    # Insert order (foreign_keys=ON rejects unknown users)
+    try:
         cur.execute(
             """
             INSERT INTO orders (user_id, total_price, status, created_at)
@@ -69,154 +78,176 @@ async def create_order(order: OrderCreate):
             """,
             (order.user_id, total_price, "pending", now),
         )
-        order_id = cur.lastrowid
-
-        # Insert order items
-        for idx, (dish_id, qty, price, options) in enumerate(priced_items):
-            item = order.items[idx]
-            options_json = json.dumps(item.options) if item.options else None
-            cur.execute(
-                """
-                INSERT INTO order_items (order_id, dish_id, quantity, price, options)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (order_id, dish_id, qty, price, options_json),
-            )
-
-        conn.commit()
-
-        return {
-            "id": order_id,
-            "user_id": order.user_id,
-            "total_price": total_price,
-            "status": "pending",
-            "created_at": now,
-        }
-    finally:
-        conn.close()
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=404, detail=f"User {order.user_id} not found")
+    order_id = cur.lastrowid
+
+    # Insert order items in one batch
+    cur.executemany(
+        """
+        INSERT INTO order_items (order_id, dish_id, quantity, price, options)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        [(order_id,) + row for row in item_rows],
+    )
+
+    conn.commit()
+
+    return {
+        "id": order_id,
+        "user_id": order.user_id,
+        "total_price": total_price,
+        "status": "pending",
+        "created_at": now,
+    }
 
 
-@router.get("/")
-async def list_orders(user_id: int = Query(..., description="User ID to list orders for")):
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        # Get order list
-        cur.execute(
-            """
-            SELECT id, user_id, total_price, status, created_at
-            FROM orders
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            """,
-            (user_id,),
-        )
-        orders = [dict(row) for row in cur.fetchall()]
-        
-        # Get order items for each order
-        result = []
-        for order in orders:
-            cur.execute(
-                """
-                SELECT oi.dish_id, d.name AS dish_name, oi.quantity, oi.price, oi.options
-                FROM order_items oi
-                JOIN dishes d ON oi.dish_id = d.id
-                WHERE oi.order_id = ?
-                ORDER BY oi.id
-                """,
-                (order['id'],),
-            )
-            items = []
-            for item_row in cur.fetchall():
-                item = dict(item_row)
-                if item.get('options'):
-                    try:
-                        item['options'] = json.loads(item['options'])
-                    except:
-                        item['options'] = {}
-                else:
-                    item['options'] = {}
-                items.append(item)
-            order['items'] = items
-            result.append(order)
-        
-        return result
-    finally:
-        conn.close()
+@router.post("/", status_code=201)
+async def create_order(order: OrderCreate):
+    if not order.items:
+        raise HTTPException(status_code=400, detail="Order must contain at least one item")
 
+    return await run_in_db(_create_order, order)
 
-@router.get("/{order_id}")
-async def get_order_detail(order_id: int):
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT id, user_id, total_price, status, created_at
-            FROM orders
-            WHERE id = ?
-            """,
-            (order_id,),
-        )
-        order_row = cur.fetchone()
-        if order_row is None:
-            raise HTTPException(status_code=404, detail="Order not found")
 
+def _parse_options(raw) -> dict:
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except:
+        return {}
+
+
+def _list_orders(conn, user_id: int, limit: int, cursor: Optional[str]):
+    cur = tuple_cursor(conn)
+    # Get one page of the order list, newest first
+    where = "user_id = ?"
+    params: list = [user_id]
+    if cursor:
+        created_at, last_id = decode_cursor(cursor, 2)
+        where += " AND (created_at, id) < (?, ?)"
+        params += [created_at, last_id]
+    sql = f"""
+        SELECT id, user_id, total_price, status, created_at
+        FROM orders
+        WHERE {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    """
+    cur.execute(sql, params + [limit + 1])
+    orders = fetch_dicts(cur)
+
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1]["created_at"], orders[-1]["id"])
+    if not orders:
+        return orders, next_cursor
+
+    # Get the items of the listed orders with one query per ORDER_ITEMS_BATCH
+    # orders (SQLite caps the number of bound parameters)
+    items_by_order = defaultdict(list)
+    order_ids = [order["id"] for order in orders]
+    for start in range(0, len(order_ids), ORDER_ITEMS_BATCH):
+        batch = order_ids[start:start + ORDER_ITEMS_BATCH]
+        placeholders = ",".join("?" * len(batch))
         cur.execute(
-            """
-            SELECT oi.id, oi.dish_id, d.name AS dish_name, oi.quantity, oi.price, oi.options
+            f"""
+            SELECT oi.order_id, oi.dish_id, d.name AS dish_name, oi.quantity, oi.price, oi.options
             FROM order_items oi
             JOIN dishes d ON oi.dish_id = d.id
-            WHERE oi.order_id = ?
-            ORDER BY oi.id
+            WHERE oi.order_id IN ({placeholders})
+            ORDER BY oi.order_id, oi.id
             """,
-            (order_id,),
+            batch,
         )
-        items = []
-        for row in cur.fetchall():
-            item = dict(row)
-            if item.get("options"):
-                try:
-                    item["options"] = json.loads(item["options"])
-                except:
-                    item["options"] = {}
-            else:
-                item["options"] = {}
-            items.append(item)
-
-        result = dict(order_row)
-        result["items"] = items
-        return result
-    finally:
-        conn.close()
+        for item in fetch_dicts(cur):
+            order_id = item.pop("order_id")
+            item["options"] = _parse_options(item["options"])
+            items_by_order[order_id].append(item)
+
+    for order in orders:
+        order["items"] = items_by_order.get(order["id"], [])
+    return orders, next_cursor
+
+
+@router.get("/")
+async def list_orders(
+    user_id: int = Query(..., description="User ID to list orders for"),
+    limit: int = Query(50, ge=1, le=200, description="Page size"),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page"),
+):
+    orders, next_cursor = await run_in_db(_list_orders, user_id, limit, cursor)
+    return page_response(orders, next_cursor)
+
+
+def _get_order_detail(conn, order_id: int):
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT id, user_id, total_price, status, created_at
+        FROM orders
+        WHERE id = ?
+        """,
+        (order_id,),
+    )
+    order_row = cur.fetchone()
+    if order_row is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    cur.execute(
+        """
+        SELECT oi.id, oi.dish_id, d.name AS dish_name, oi.quantity, oi.price, oi.options
+        FROM order_items oi
+        JOIN dishes d ON oi.dish_id = d.id
+        WHERE oi.order_id = ?
+        ORDER BY oi.id
+        """,
+        (order_id,),
+    )
+    items = []
+    for row in cur.fetchall():
+        item = dict(row)
+        item["options"] = _parse_options(item["options"])
+        items.append(item)
+
+    result = dict(order_row)
+    result["items"] = items
+    return result
+
+
+@router.get("/{order_id}")
+async def get_order_detail(order_id: int):
+    return await run_in_db(_get_order_detail, order_id)
+
+
+def _pay_order(conn, order_id: int):
+    cur = conn.cursor()
+    
+    # Check if order exists
+    cur.execute(
+        "SELECT id, user_id, status FROM orders WHERE id = ?",
+        (order_id,),
+    )
+    order_row = cur.fetchone()
+    if order_row is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    if order_row["status"] != "pending":
+        raise HTTPException(status_code=400, detail="Order already paid or cancelled")
+    
+    # Update order status to paid
+    cur.execute(
+        "UPDATE orders SET status = 'paid' WHERE id = ?",
+        (order_id,),
+    )
+    conn.commit()
+    
+    return {"message": "Payment successful", "order_id": order_id, "status": "paid"}
 
 
 @router.post("/{order_id}/pay")
 async def pay_order(order_id: int):
     """Pay for an order"""
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        
-        # Check if order exists
-        cur.execute(
-            "SELECT id, user_id, status FROM orders WHERE id = ?",
-            (order_id,),
-        )
-        order_row = cur.fetchone()
-        if order_row is None:
-            raise HTTPException(status_code=404, detail="Order not found")
-        
-        if order_row["status"] != "pending":
-            raise HTTPException(status_code=400, detail="Order already paid or cancelled")
-        
-        # Update order status to paid
-        cur.execute(
-            "UPDATE orders SET status = 'paid' WHERE id = ?",
-            (order_id,),
-        )
-        conn.commit()
-        
-        return {"message": "Payment successful", "order_id": order_id, "status": "paid"}
-    finally:
-        conn.close()
+    return await run_in_db(_pay_order, order_id)
@@ -1,9 +1,14 @@
+import sqlite3
 from datetime import datetime
+from typing import Optional
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel, Field
 
-from app.db import get_connection
+from app.cache import context_cache
+from app.db import run_in_db, tuple_cursor
+from app.pagination import decode_cursor, encode_cursor, key_values, page_response, parse_fields, project, select_list
+from app.recommender import recommender
 
 router = APIRouter()
 
@@ -15,104 +20,124 @@ class RatingCreate(BaseModel):
     comment: str = None
 
 
+RATING_FIELDS = ("id", "user_id", "dish_id", "score", "comment", "created_at")
+DISH_RATING_FIELDS = RATING_FIELDS + ("username",)
+DISH_RATING_EXPRESSIONS = {name: f"r.{name}" for name in RATING_FIELDS}
+DISH_RATING_EXPRESSIONS["username"] = "u.username"
+
+
+def _page(cur, sql: str, params: list, limit: Optional[int], columns):
+    """Run a (created_at DESC, id DESC) ordered query and cut one page from it."""
+    if limit is not None:
+        sql += " LIMIT ?"
+        params = params + [limit + 1]
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*key_values(cur, rows[-1], ("created_at", "id")))
+    return project(rows, columns), next_cursor
+
+
+def _list_ratings(conn, fields: Optional[str], limit: Optional[int], cursor: Optional[str]):
+    columns = parse_fields(fields, RATING_FIELDS)
+    where = ""
+    params: list = []
+    if cursor:
+        created_at, last_id = decode_cursor(cursor, 2)
+        where = "WHERE (created_at, id) < (?, ?)"
+        params += [created_at, last_id]
+    sql = (
+        f"SELECT {select_list(columns, keys=('id', 'created_at'))} FROM ratings {where} "
+        "ORDER BY created_at DESC, id DESC"
+    )
+    return _page(tuple_cursor(conn), sql, params, limit, columns)
+
+
 @router.get("/")
-async def list_ratings():
-    """Return all ratings."""
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT id, user_id, dish_id, score, comment, created_at FROM ratings ORDER BY created_at DESC"
-        )
-        rows = cur.fetchall()
-        return [dict(row) for row in rows]
-    finally:
-        conn.close()
+async def list_ratings(
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size (omit for all ratings)"),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page"),
+):
+    """Return all ratings, newest first, optionally paginated and projected."""
+    ratings, next_cursor = await run_in_db(_list_ratings, fields, limit, cursor)
+    return page_response(ratings, next_cursor)
+
+
+def _list_ratings_for_dish(conn, dish_id: int, fields: Optional[str], limit: Optional[int], cursor: Optional[str]):
+    columns = parse_fields(fields, DISH_RATING_FIELDS)
+    where = "r.dish_id = ?"
+    params: list = [dish_id]
+    if cursor:
+        created_at, last_id = decode_cursor(cursor, 2)
+        where += " AND (r.created_at, r.id) < (?, ?)"
+        params += [created_at, last_id]
+    sql = f"""
+        SELECT {select_list(columns, keys=('id', 'created_at'), expressions=DISH_RATING_EXPRESSIONS)}
+        FROM ratings r
+        JOIN users u ON r.user_id = u.id
+        WHERE {where}
+        ORDER BY r.created_at DESC, r.id DESC
+    """
+    return _page(tuple_cursor(conn), sql, params, limit, columns)
 
 
 @router.get("/dish/{dish_id}")
-async def list_ratings_for_dish(dish_id: int):
+async def list_ratings_for_dish(
+    dish_id: int,
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size (omit for all ratings)"),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page"),
+):
     """Return ratings for a specific dish."""
-    conn = get_connection()
+    ratings, next_cursor = await run_in_db(_list_ratings_for_dish, dish_id, fields, limit, cursor)
+    return page_response(ratings, next_cursor)
+
+
+def _missing_parent(conn, rating: RatingCreate) -> HTTPException:
+    """404 naming whichever foreign key an upsert failed on (error path only)."""
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM users WHERE id = ?", (rating.user_id,))
+    if cur.fetchone() is None:
+        return HTTPException(status_code=404, detail="用户不存在")
+    return HTTPException(status_code=404, detail="菜品不存在")
+
+
+def _create_rating(conn, rating: RatingCreate):
+    # One statement: the unique (user_id, dish_id) index turns a repeat
+    # rating into an update, foreign keys reject unknown users and dishes,
+    # and triggers keep dish_rating_stats in step
+    cur = conn.cursor()
     try:
-        cur = conn.cursor()
         cur.execute(
             """
-            SELECT r.id, r.user_id, r.dish_id, r.score, r.comment, r.created_at, u.username
-            FROM ratings r
-            JOIN users u ON r.user_id = u.id
-            WHERE r.dish_id = ? 
-            ORDER BY r.created_at DESC
+            INSERT INTO ratings (user_id, dish_id, score, comment, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, dish_id) DO UPDATE SET
+                score = excluded.score,
+                comment = excluded.comment,
+                created_at = excluded.created_at
+            RETURNING id, user_id, dish_id, score, comment, created_at,
+                      (SELECT username FROM users WHERE users.id = ratings.user_id) AS username
             """,
-            (dish_id,),
+            (rating.user_id, rating.dish_id, rating.score, rating.comment, datetime.utcnow().isoformat()),
         )
-        rows = cur.fetchall()
-        return [dict(row) for row in rows]
-    finally:
-        conn.close()
+        # fetchall steps the statement to completion before the commit
+        row = dict(cur.fetchall()[0])
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        raise _missing_parent(conn, rating)
+    conn.commit()
+
+    recommender.record_rating(rating.user_id, rating.dish_id, rating.score)
+    context_cache.discard(("user", rating.user_id))
+    context_cache.invalidate("global")
+    return row
 
 
 @router.post("/", status_code=201)
 async def create_rating(rating: RatingCreate):
     """Create a new rating for a dish."""
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        
-        # Check if user exists
-        cur.execute("SELECT id FROM users WHERE id = ?", (rating.user_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="用户不存在")
-        
-        # Check if dish exists
-        cur.execute("SELECT id FROM dishes WHERE id = ?", (rating.dish_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="菜品不存在")
-        
-        # Check if user already rated this dish
-        cur.execute(
-            "SELECT id FROM ratings WHERE user_id = ? AND dish_id = ?",
-            (rating.user_id, rating.dish_id),
-        )
-        existing = cur.fetchone()
-        
-        now = datetime.utcnow().isoformat()
-        
-        if existing:
-            # Update existing rating
-            cur.execute(
-                """
-                UPDATE ratings 
-                SET score = ?, comment = ?, created_at = ?
-                WHERE id = ?
-                """,
-                (rating.score, rating.comment, now, existing["id"]),
-            )
-            rating_id = existing["id"]
-        else:
-            # Create new rating
-            cur.execute(
-                """
-                INSERT INTO ratings (user_id, dish_id, score, comment, created_at)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (rating.user_id, rating.dish_id, rating.score, rating.comment, now),
-            )
-            rating_id = cur.lastrowid
-        
-        conn.commit()
-        
-        # Return the rating with username
-        cur.execute(
-            """
-            SELECT r.id, r.user_id, r.dish_id, r.score, r.comment, r.created_at, u.username
-            FROM ratings r
-            JOIN users u ON r.user_id = u.id
-            WHERE r.id = ?
-            """,
-            (rating_id,),
-        )
-        row = cur.fetchone()
-        return dict(row)
-    finally:
-        conn.close()
+    return await run_in_db(_create_rating, rating)
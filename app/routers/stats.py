@@ -1,97 +1,194 @@
 from datetime import datetime
-from fastapi import APIRouter
+from fastapi import APIRouter, Query, Request
 
-from app.db import get_connection
+from app.cache import cache_stats
+from app.db import fetch_dicts, run_in_db, tuple_cursor
+from app.etag import STATS_TABLES, conditional_get
+from app.metrics import metrics
+from app.recommender import recommender
+from app.responses import FastJSONResponse
 
 router = APIRouter()
 
 
+def _top_dishes(conn, limit: int):
+    cur = tuple_cursor(conn)
+    cur.execute(
+        """
+        SELECT d.id,
+               d.name,
+               d.category,
+               d.price,
+               d.ingredients,
+               d.ingredients_zh,
+               d.calories,
+               d.canteen_id,
+               s.avg_score,
+               s.rating_count
+        FROM dish_rating_stats s
+        JOIN dishes d ON d.id = s.dish_id
+        WHERE s.rating_count > 0
+        ORDER BY s.avg_score DESC, s.rating_count DESC
+        LIMIT ?
+        """,
+        (limit,),
+    )
+    return fetch_dicts(cur)
+
+
 @router.get("/top-dishes")
-async def top_dishes(limit: int = 5):
+async def top_dishes(request: Request, limit: int = 5):
     """Return top dishes by average rating and count."""
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT d.id,
-                   d.name,
-                   d.category,
-                   d.price,
-                   d.ingredients,
-                   d.ingredients_zh,
-                   d.calories,
-                   d.canteen_id,
-                   AVG(r.score) AS avg_score,
-                   COUNT(r.id) AS rating_count
-            FROM dishes d
-            JOIN ratings r ON d.id = r.dish_id
-            GROUP BY d.id, d.name, d.category, d.price, d.ingredients, d.ingredients_zh, d.calories, d.canteen_id
-            HAVING rating_count > 0
-            ORDER BY avg_score DESC, rating_count DESC
-            LIMIT ?
-            """,
-            (limit,),
-        )
-        rows = cur.fetchall()
-        return [dict(row) for row in rows]
-    finally:
-        conn.close()
+    return await conditional_get(request, STATS_TABLES, _top_dishes, limit)
+
+
+def _category_recommendations(conn, user_id: int, limit: int):
+    """Cold-start fallback: unrated dishes from categories the user scored >=4."""
+    cur = tuple_cursor(conn)
+
+    # Preferred categories: user rated >=4
+    cur.execute(
+        """
+        SELECT DISTINCT d.category
+        FROM ratings r
+        JOIN dishes d ON r.dish_id = d.id
+        WHERE r.user_id = ? AND r.score >= 4 AND d.category IS NOT NULL
+        """,
+        (user_id,),
+    )
+    categories = [row[0] for row in cur.fetchall()]
+    if not categories:
+        # Fallback: just return global top dishes
+        return _top_dishes(conn, limit)
+
+    # Recommend dishes in those categories user has not rated yet
+    placeholders = ",".join(["?"] * len(categories))
+    query = f"""
+        SELECT d.id,
+               d.name,
+               d.category,
+               d.price,
+               d.ingredients,
+               d.ingredients_zh,
+               d.calories,
+               d.canteen_id,
+               s.avg_score,
+               COALESCE(s.rating_count, 0) AS rating_count
+        FROM dishes d
+        LEFT JOIN dish_rating_stats s ON s.dish_id = d.id
+        WHERE d.category IN ({placeholders})
+          AND d.id NOT IN (SELECT dish_id FROM ratings WHERE user_id = ?)
+        ORDER BY (s.avg_score IS NULL), s.avg_score DESC, rating_count DESC
+        LIMIT ?
+    """
+    params = categories + [user_id, limit]
+    cur.execute(query, params)
+    return fetch_dicts(cur)
+
+
+def _recommendations_for_user(conn, user_id: int, limit: int):
+    recommender.ensure_fresh(conn)
+    predicted = recommender.recommend(user_id, limit)
+    if not predicted:
+        return _category_recommendations(conn, user_id, limit)
+
+    dish_ids = [dish_id for dish_id, _ in predicted]
+    placeholders = ",".join("?" * len(dish_ids))
+    cur = tuple_cursor(conn)
+    cur.execute(
+        f"""
+        SELECT d.id,
+               d.name,
+               d.category,
+               d.price,
+               d.ingredients,
+               d.ingredients_zh,
+               d.calories,
+               d.canteen_id,
+               s.avg_score,
+               COALESCE(s.rating_count, 0) AS rating_count
+        FROM dishes d
+        LEFT JOIN dish_rating_stats s ON s.dish_id = d.id
+        WHERE d.id IN ({placeholders})
+        """,
+        dish_ids,
+    )
+    by_id = {row["id"]: row for row in fetch_dicts(cur)}
+    result = [by_id[dish_id] for dish_id in dish_ids if dish_id in by_id]
+
+    # Top up a short list from the category heuristic
+    if len(result) < limit:
+        for row in _category_recommendations(conn, user_id, limit):
+            if len(result) >= limit:
+                break
+            if row["id"] not in by_id:
+                result.append(row)
+    return result
 
 
 @router.get("/recommendations/{user_id}")
 async def recommendations_for_user(user_id: int, limit: int = 5):
-    """Recommend dishes based on categories where the user has rated highly (score>=4)."""
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-
-        # Preferred categories: user rated >=4
-        cur.execute(
-            """
-            SELECT DISTINCT d.category
-            FROM ratings r
-            JOIN dishes d ON r.dish_id = d.id
-            WHERE r.user_id = ? AND r.score >= 4 AND d.category IS NOT NULL
-            """,
-            (user_id,),
-        )
-        categories = [row[0] for row in cur.fetchall()]
-        if not categories:
-            # Fallback: just return global top dishes
-            return await top_dishes(limit=limit)
-
-        # Recommend dishes in those categories user has not rated yet
-        placeholders = ",".join(["?"] * len(categories))
-        query = f"""
-            SELECT d.id,
-                   d.name,
-                   d.category,
-                   d.price,
-                   d.ingredients,
-                   d.ingredients_zh,
-                   d.calories,
-                   d.canteen_id,
-                   AVG(r.score) AS avg_score,
-                   COUNT(r.id) AS rating_count
-            FROM dishes d
-            LEFT JOIN ratings r ON d.id = r.dish_id
-            WHERE d.category IN ({placeholders})
-              AND d.id NOT IN (SELECT dish_id FROM ratings WHERE user_id = ?)
-            GROUP BY d.id, d.name, d.category, d.price, d.ingredients, d.ingredients_zh, d.calories, d.canteen_id
-            ORDER BY (avg_score IS NULL), avg_score DESC, rating_count DESC
-            LIMIT ?
+    """Recommend dishes via item-item collaborative filtering over all ratings.
+
+    Users without usable rating history fall back to categories where they
+    rated highly (score>=4), and then to the global top dishes.
+
+    No ETag: the in-memory model is rebuilt on its own schedule, so the body
+    isn't a function of the table versions alone.
+    """
+    return FastJSONResponse(await run_in_db(_recommendations_for_user, user_id, limit))
+
+
+def _ranked_daily_candidates(conn):
+    cur = tuple_cursor(conn)
+    
+    # 获取所有有评分的菜品
+    cur.execute(
         """
-        params = categories + [user_id, limit]
-        cur.execute(query, params)
-        rows = cur.fetchall()
-        return [dict(row) for row in rows]
-    finally:
-        conn.close()
+        SELECT d.id,
+               d.name,
+               d.category,
+               d.price,
+               d.ingredients,
+               d.ingredients_zh,
+               d.calories,
+               d.canteen_id,
+               c.name AS canteen_name,
+               s.avg_score,
+               s.rating_count
+        FROM dish_rating_stats s
+        JOIN dishes d ON d.id = s.dish_id
+        JOIN canteens c ON d.canteen_id = c.id
+        WHERE d.is_available = 1 AND s.rating_count > 0
+        ORDER BY s.avg_score DESC, s.rating_count DESC
+        """,
+    )
+    return fetch_dicts(cur)
+
+
+def _rotate_for_weekday(all_dishes, weekday: int, limit: int):
+    if not all_dishes:
+        return []
+    
+    # 根据星期几选择不同的菜品
+    # 使用星期几作为偏移量，确保每天推荐不同的菜品
+    start_idx = (weekday * limit) % len(all_dishes)
+    selected = []
+    
+    # 循环选择，确保选择足够的菜品
+    for i in range(limit):
+        idx = (start_idx + i) % len(all_dishes)
+        selected.append(all_dishes[idx])
+    
+    return selected
+
+
+def _daily_recommendations(conn, weekday: int, limit: int):
+    return _rotate_for_weekday(_ranked_daily_candidates(conn), weekday, limit)
 
 
 @router.get("/daily-recommendations")
-async def daily_recommendations(weekday: int = None, limit: int = 6):
+async def daily_recommendations(request: Request, weekday: int = None, limit: int = 6):
     """
     Get daily recommendations based on weekday (0=Monday, 6=Sunday).
     If weekday is not provided, use current weekday.
@@ -100,64 +197,41 @@ async def daily_recommendations(weekday: int = None, limit: int = 6):
     if weekday is None:
         weekday = datetime.now().weekday()  # 0=Monday, 6=Sunday
     
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        
-        # 获取所有有评分的菜品
-        cur.execute(
-            """
-            SELECT d.id,
-                   d.name,
-                   d.category,
-                   d.price,
-                   d.ingredients,
-                   d.ingredients_zh,
-                   d.calories,
-                   d.canteen_id,
-                   c.name AS canteen_name,
-                   AVG(r.score) AS avg_score,
-                   COUNT(r.id) AS rating_count
-            FROM dishes d
-            JOIN canteens c ON d.canteen_id = c.id
-            LEFT JOIN ratings r ON d.id = r.dish_id
-            WHERE d.is_available = 1
-            GROUP BY d.id, d.name, d.category, d.price, d.ingredients, d.ingredients_zh, d.calories, d.canteen_id, c.name
-            HAVING rating_count > 0
-            ORDER BY avg_score DESC, rating_count DESC
-            """,
-        )
-        all_dishes = [dict(row) for row in cur.fetchall()]
-        
-        if not all_dishes:
-            return []
-        
-        # 根据星期几选择不同的菜品
-        # 使用星期几作为偏移量，确保每天推荐不同的菜品
-        start_idx = (weekday * limit) % len(all_dishes)
-        selected = []
-        
-        # 循环选择，确保选择足够的菜品
-        for i in range(limit):
-            idx = (start_idx + i) % len(all_dishes)
-            selected.append(all_dishes[idx])
-        
-        return selected
-    finally:
-        conn.close()
+    return await conditional_get(
+        request, STATS_TABLES, _daily_recommendations, weekday, limit, variant=f"weekday={weekday}"
+    )
 
 
-@router.get("/weekly-recommendations")
-async def weekly_recommendations(limit_per_day: int = 4):
-    """Get recommendations for all 7 days of the week."""
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+DAY_NAMES_ZH = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+
+
+def _weekly_recommendations(conn, limit_per_day: int):
+    # Rank once and slice every weekday from the same list
+    all_dishes = _ranked_daily_candidates(conn)
     result = {}
     for day in range(7):  # 0-6 for Monday-Sunday
-        day_name = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'][day]
-        day_name_zh = ['周一', '周二', '周三', '周四', '周五', '周六', '周日'][day]
-        recommendations = await daily_recommendations(weekday=day, limit=limit_per_day)
         result[day] = {
-            'day_name_en': day_name,
-            'day_name_zh': day_name_zh,
-            'dishes': recommendations
+            'day_name_en': DAY_NAMES[day],
+            'day_name_zh': DAY_NAMES_ZH[day],
+            'dishes': _rotate_for_weekday(all_dishes, day, limit_per_day)
         }
     return result
+
+
+@router.get("/weekly-recommendations")
+async def weekly_recommendations(request: Request, limit_per_day: int = 4):
+    """Get recommendations for all 7 days of the week."""
+    return await conditional_get(request, STATS_TABLES, _weekly_recommendations, limit_per_day)
+
+
+@router.get("/cache")
+async def cache_statistics():
+    """Hit/miss/eviction counters of the in-process caches."""
+    return cache_stats()
+
+
+@router.get("/slow-queries")
+async def slow_queries(limit: int = Query(20, ge=1, le=100)):
+    """Recent statements slower than SLOW_QUERY_MS and the statements with the most SQL time."""
+    return metrics.slow_queries(limit)
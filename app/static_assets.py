@@ -0,0 +1,199 @@
+"""Fingerprinted, precompressed copies of the frontend assets in ``static/dist``.
+
+:func:`build` copies every asset under ``static/`` (except ``index.html``)
+to ``static/dist/`` with a content hash in its name (``css/style.3f2a9c1b7d4e.css``)
+and writes ``.gz`` (and, when the ``brotli`` package is installed, ``.br``)
+variants next to it. ``index.html`` is rewritten in memory to reference the
+hashed names. Because a name changes whenever the content does, the hashed
+files are served with ``Cache-Control: immutable`` and a one-year max-age;
+the index itself is revalidated on every load.
+
+The build runs at startup and is idempotent (a file whose hashed name
+already exists is left alone), so several workers can start at once. It
+can also be run ahead of time::
+
+    python -m app.static_assets
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+STATIC_DIR = Path(__file__).resolve().parent.parent / "static"
+DIST_DIR = STATIC_DIR / "dist"
+DIST_URL = "/static/dist"
+INDEX_NAME = "index.html"
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# Smaller files aren't worth a compressed variant
+MIN_COMPRESS_SIZE = 512
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".html", ".json", ".svg", ".txt", ".map"}
+# Accept-Encoding token -> file suffix, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+_REFERENCE_RE = re.compile(r"""(["'])/static/([^"'?#]+)(?:\?[^"'#]*)?\1""")
+
+
+def _fingerprint(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _compressed_variants(data: bytes) -> Dict[str, bytes]:
+    """Suffix -> compressed bytes, keeping only variants smaller than ``data``."""
+    variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=11)
+    return {suffix: body for suffix, body in variants.items() if len(body) < len(data)}
+
+
+def _accepted(accept_encoding: str) -> set:
+    """Content codings the client accepts (``q=0`` entries excluded)."""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        name, _, value = params.partition("=")
+        try:
+            q = float(value) if name.strip().lower() == "q" else 1.0
+        except ValueError:
+            q = 1.0
+        if coding.strip() and q > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class AssetBundle:
+    """The hashed asset names and the rewritten index page, with its encoded variants."""
+
+    def __init__(self, manifest: Dict[str, str], index: bytes):
+        self.manifest = manifest
+        self.index_etag = _fingerprint(index)
+        self.index_variants: Dict[str, bytes] = {"": index}
+        if len(index) >= MIN_COMPRESS_SIZE:
+            self.index_variants.update(_compressed_variants(index))
+
+    def index_response(self, request: Request) -> Response:
+        accepted = _accepted(request.headers.get("accept-encoding", ""))
+        suffix, coding = "", None
+        for candidate, candidate_suffix in ENCODINGS:
+            if candidate in accepted and candidate_suffix in self.index_variants:
+                suffix, coding = candidate_suffix, candidate
+                break
+        # One strong tag per encoding, as the bytes differ
+        etag = f'"{self.index_etag}{suffix.replace(".", "-")}"'
+        headers = {"ETag": etag, "Cache-Control": REVALIDATE, "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (
+            if_none_match.strip() == "*"
+            or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+        ):
+            return Response(status_code=304, headers=headers)
+        if coding:
+            headers["Content-Encoding"] = coding
+        return Response(self.index_variants[suffix], media_type="text/html", headers=headers)
+
+
+def build(static_dir: Path = STATIC_DIR, dist_dir: Path = DIST_DIR) -> AssetBundle:
+    """Write the hashed and precompressed assets; returns the bundle for the rewritten index."""
+    manifest: Dict[str, str] = {}
+    for path in sorted(static_dir.rglob("*")):
+        if not path.is_file() or dist_dir in path.parents or path == static_dir / INDEX_NAME:
+            continue
+        name = path.relative_to(static_dir).as_posix()
+        data = path.read_bytes()
+        hashed = f"{path.stem}.{_fingerprint(data)}{path.suffix}"
+        rel = Path(name).with_name(hashed)
+        target = dist_dir / rel
+        if not target.exists():
+            # Variants first: an interrupted build never leaves a hashed file without them
+            if path.suffix in COMPRESSIBLE_SUFFIXES and len(data) >= MIN_COMPRESS_SIZE:
+                for suffix, body in _compressed_variants(data).items():
+                    _write_atomic(target.with_name(target.name + suffix), body)
+            _write_atomic(target, data)
+        manifest[name] = rel.as_posix()
+
+    def rewrite(match: "re.Match") -> str:
+        quote, name = match.group(1), match.group(2)
+        if name not in manifest:
+            return match.group(0)
+        return f"{quote}{DIST_URL}/{manifest[name]}{quote}"
+
+    index = (static_dir / INDEX_NAME).read_text(encoding="utf-8")
+    return AssetBundle(manifest, _REFERENCE_RE.sub(rewrite, index).encode("utf-8"))
+
+
+_bundle: Optional[AssetBundle] = None
+_bundle_lock = threading.Lock()
+
+
+def get_bundle() -> AssetBundle:
+    """The bundle built at startup (built on first use if startup didn't run)."""
+    global _bundle
+    if _bundle is None:
+        with _bundle_lock:
+            if _bundle is None:
+                _bundle = build()
+    return _bundle
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """``StaticFiles`` for ``static/dist``: serves ``<file>.br``/``<file>.gz`` when the client accepts them.
+
+    Every response is marked immutable, since the file names are content hashes.
+    The variant's own stat drives ``ETag``/``Last-Modified``, so each encoding
+    gets its own validator.
+    """
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        accepted = _accepted(request_headers.get("accept-encoding", ""))
+        served: Tuple[str, os.stat_result] = (str(full_path), stat_result)
+        coding = None
+        for candidate, suffix in ENCODINGS:
+            if candidate not in accepted:
+                continue
+            try:
+                served = (f"{full_path}{suffix}", os.stat(f"{full_path}{suffix}"))
+            except FileNotFoundError:
+                continue
+            coding = candidate
+            break
+
+        # media_type from the original name, not the .gz/.br suffix
+        media_type, _ = mimetypes.guess_type(str(full_path))
+        response = FileResponse(served[0], status_code=status_code, stat_result=served[1], media_type=media_type)
+        response.headers["Cache-Control"] = IMMUTABLE
+        response.headers["Vary"] = "Accept-Encoding"
+        if coding:
+            response.headers["Content-Encoding"] = coding
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+if __name__ == "__main__":
+    bundle = build()
+    for source, hashed in sorted(bundle.manifest.items()):
+        print(f"{source} -> {DIST_URL}/{hashed}")
@@ -0,0 +1,22 @@
+"""Per-table change counters (``table_versions``) for cheap cache validation.
+
+Every tracked table has one row whose ``version`` a trigger bumps on each
+insert, update or delete, in the writer's own transaction, and whose
+``modified_at`` records when (unix seconds). Reading a handful of these rows
+tells whether anything a response was built from has changed since, without
+touching the tables themselves (see :mod:`app.etag`).
+"""
+import sqlite3
+from typing import List, Sequence, Tuple
+
+
+def read_versions(conn: sqlite3.Connection, tables: Sequence[str]) -> List[Tuple[str, int, int]]:
+    """``(name, version, modified_at)`` of each of ``tables``, ordered by name."""
+    placeholders = ", ".join("?" * len(tables))
+    rows = conn.execute(
+        f"SELECT name, version, modified_at FROM table_versions WHERE name IN ({placeholders}) ORDER BY name",
+        tuple(tables),
+    ).fetchall()
+    if len(rows) != len(set(tables)):
+        raise ValueError(f"Untracked table(s) in {tuple(tables)!r}")
+    return [tuple(row) for row in rows]
@@ -0,0 +1,128 @@
+"""Tail latency of cheap requests while slow aggregations run alongside them.
+
+A throwaway database is built through the normal migration path, filled with
+the demo seed data and padded with synthetic users who rate every dish (so
+the rating aggregations have real work to do). The app then runs in-process
+under an open-loop schedule: a cheap ``GET /canteens/`` every
+``--interval-ms``, plus once a second each ``--heavy`` path (by default the
+daily recommendations, an aggregation over every rating, and one dish's
+ratings, a few thousand rows). Requests are fired on schedule whether or not
+earlier ones finished, so a handler that blocks the event loop shows up as
+queueing delay in the cheap requests' latencies.
+
+Usage::
+
+    python bench_mixed_load.py                         # 300k ratings, 10 s
+    python bench_mixed_load.py --ratings 100000 --duration 5 --interval-ms 5
+    python bench_mixed_load.py --heavy /ratings/       # every rating, unpaged
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+LIGHT_PATH = "/canteens/"
+HEAVY_PATHS = ["/stats/daily-recommendations", "/ratings/dish/1"]
+
+
+def _add_ratings(conn, ratings: int) -> None:
+    """Synthetic users rating every dish until ``ratings`` rows exist."""
+    dish_ids = [row[0] for row in conn.execute("SELECT id FROM dishes ORDER BY id")]
+    now = datetime.utcnow().isoformat()
+    users = -(-ratings // len(dish_ids))
+    conn.executemany(
+        "INSERT INTO users (username, password_hash, created_at) VALUES (?, 'x', ?)",
+        ((f"bench_user_{i}", now) for i in range(users)),
+    )
+    user_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE username LIKE 'bench_user_%'")]
+    rows = (
+        (user_id, dish_id, 1 + (user_id * 7 + dish_id) % 5, now)
+        for user_id in user_ids
+        for dish_id in dish_ids
+    )
+    conn.execute("DELETE FROM ratings")
+    conn.executemany(
+        "INSERT INTO ratings (user_id, dish_id, score, created_at) VALUES (?, ?, ?, ?)",
+        (row for _, row in zip(range(ratings), rows)),
+    )
+    conn.commit()
+
+
+def _percentiles(latencies) -> str:
+    ordered = sorted(latencies)
+    if not ordered:
+        return "no requests"
+    pick = lambda q: ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1e3  # noqa: E731
+    return f"n={len(ordered)} p50 {pick(0.5):.1f} ms, p95 {pick(0.95):.1f} ms, p99 {pick(0.99):.1f} ms, max {ordered[-1] * 1e3:.1f} ms"
+
+
+async def _run(duration: float, interval: float, heavy_paths) -> None:
+    import httpx
+
+    from app.main import app
+
+    light, failed = [], 0
+    heavy = {path: [] for path in heavy_paths}
+
+    async def timed(client, path, into):
+        nonlocal failed
+        started = time.perf_counter()
+        response = await client.get(path)
+        into.append(time.perf_counter() - started)
+        failed += response.status_code >= 400
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for path in heavy_paths:
+                await client.get(path)  # warm-up
+            tasks = []
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            tick = 0
+            while tick * interval < duration:
+                if tick % max(1, round(1.0 / interval)) == 0:
+                    tasks.extend(asyncio.create_task(timed(client, path, heavy[path])) for path in heavy_paths)
+                tasks.append(asyncio.create_task(timed(client, LIGHT_PATH, light)))
+                tick += 1
+                await asyncio.sleep(max(0.0, start + tick * interval - loop.time()))
+            await asyncio.gather(*tasks)
+
+    print(f"{LIGHT_PATH} every {interval * 1e3:g} ms: {_percentiles(light)}")
+    for path, latencies in heavy.items():
+        print(f"{path} once a second: {_percentiles(latencies)}")
+    if failed:
+        print(f"{failed} request(s) failed")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ratings", type=int, default=300_000, help="synthetic ratings to load")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--interval-ms", type=float, default=10.0, help="gap between cheap requests")
+    parser.add_argument("--heavy", action="append", help=f"path fired once a second (default {HEAVY_PATHS})")
+    args = parser.parse_args()
+    os.environ.setdefault("MOONSHOT_API_KEY", "sk-bench-mixed-load")
+    with tempfile.TemporaryDirectory() as tmp:
+        from app import db
+
+        db.DB_PATH = Path(tmp) / "bench.db"
+        import seed_data
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            seed_data.seed()
+        conn = db.get_connection()
+        _add_ratings(conn, args.ratings)
+        conn.close()
+        asyncio.run(_run(args.duration, args.interval_ms / 1e3, args.heavy or HEAVY_PATHS))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Order placement throughput (orders/sec) for a range of cart sizes.
+
+A throwaway database is built through the normal migration path and filled
+with the demo seed data. For each ``--items`` cart size, ``--orders`` orders
+are placed through the ``POST /orders/`` helper on pooled connections, as
+``run_in_db`` would, spread over ``--threads`` threads (1 = sequential).
+Carts cycle through the available dishes; each configuration is timed
+``--repeat`` times and the median rate reported. The order and item counts
+are checked afterwards, so a lost or half-written order fails the run.
+
+Usage::
+
+    python bench_orders.py                               # 1- and 20-item carts, sequential
+    python bench_orders.py --items 1 5 20 --threads 4 --orders 2000
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+def _place(orders: int, threads: int, carts) -> float:
+    """Seconds to place ``orders`` orders, taking carts from ``carts`` in turn."""
+    from app import db
+    from app.routers.orders import _create_order
+
+    payloads = [next(carts) for _ in range(orders)]
+
+    def place(order) -> None:
+        with db.db_connection() as conn:
+            _create_order(conn, order)
+
+    started = time.perf_counter()
+    if threads == 1:
+        for order in payloads:
+            place(order)
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(place, payloads))
+    return time.perf_counter() - started
+
+
+def bench(path: Path, sizes, orders: int, threads: int, repeat: int) -> int:
+    from app import db
+
+    db.DB_PATH = path
+    import seed_data
+    from app.routers.orders import OrderCreate, OrderItemIn
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        seed_data.seed()
+    with db.db_connection() as conn:
+        dish_ids = [row[0] for row in conn.execute("SELECT id FROM dishes WHERE is_available = 1 ORDER BY id")]
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+        before = conn.execute("SELECT (SELECT COUNT(*) FROM orders), (SELECT COUNT(*) FROM order_items)").fetchone()
+
+    placed_orders = placed_items = 0
+    for size in sizes:
+        dishes = itertools.cycle(dish_ids)
+        users = itertools.cycle(user_ids)
+        carts = (
+            OrderCreate(
+                user_id=next(users),
+                items=[OrderItemIn(dish_id=next(dishes), quantity=1 + i % 3) for i in range(size)],
+            )
+            for _ in itertools.count()
+        )
+        _place(min(orders, 100), threads, carts)  # warm-up
+        rates = [orders / _place(orders, threads, carts) for _ in range(repeat)]
+        placed_orders += (repeat * orders) + min(orders, 100)
+        placed_items += ((repeat * orders) + min(orders, 100)) * size
+        print(
+            f"{size:>3}-item carts, {threads} thread(s): median {statistics.median(rates):,.0f} orders/s "
+            f"({', '.join(f'{rate:,.0f}' for rate in rates)})"
+        )
+
+    with db.db_connection() as conn:
+        after = conn.execute("SELECT (SELECT COUNT(*) FROM orders), (SELECT COUNT(*) FROM order_items)").fetchone()
+    db.close_pool()
+    if (after[0] - before[0], after[1] - before[1]) != (placed_orders, placed_items):
+        print(
+            f"FAIL expected {placed_orders} orders / {placed_items} items, "
+            f"found {after[0] - before[0]} / {after[1] - before[1]}"
+        )
+        return 1
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, nargs="+", default=[1, 20], help="cart sizes to measure")
+    parser.add_argument("--orders", type=int, default=1000, help="orders per timed run")
+    parser.add_argument("--threads", type=int, default=1, help="threads placing orders (1 = sequential)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per cart size")
+    args = parser.parse_args()
+    os.environ.setdefault("MOONSHOT_API_KEY", "sk-bench-orders")
+    with tempfile.TemporaryDirectory() as tmp:
+        return bench(Path(tmp) / "orders.db", args.items, args.orders, args.threads, args.repeat)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,334 @@
+"""Run EXPLAIN QUERY PLAN on every SQL statement the routers issue and flag table scans.
+
+A throwaway database is built through the normal migration path and filled
+with the demo seed data, then every endpoint is called (including the
+filter, projection and cursor variants, which build different SQL). Each
+statement whose caller is a function in ``app/routers/`` is explained, and
+the run fails when:
+
+* a plan contains a full ``SCAN`` of a table not in ``SMALL_TABLES`` (with or
+  without an index) that isn't listed in ``ALLOWED_SCANS`` for the statement
+  and router function that issued it, or
+* one of the queries in ``EXPECTED_PLANS`` no longer runs as a walk of its
+  index (i.e. it picks another index or sorts, or, for a covering index,
+  reads the table), or
+* a paged query in ``ORDERED_QUERIES`` sorts its matches instead of reading
+  them from an index in output order.
+
+/dishes/browse is called with every combination of its filters under every
+sort order, first and cursor pages alike, as each builds a different query.
+
+Plans come from the schema alone (no ``sqlite_stat1``), the same as on a
+production database that has never been ANALYZEd. Usage::
+
+    python check_query_plans.py          # exits 1 on a regression
+    python check_query_plans.py -v       # also print every plan
+"""
+import contextlib
+import io
+import itertools
+import os
+import re
+import sys
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+
+# Tables small enough that a full scan is fine wherever it happens
+SMALL_TABLES = {"canteens", "sqlite_master"}
+
+# SQL fragments below are regular expressions searched for in the statement
+# as traced (parameters inlined, whitespace collapsed)
+
+# Accepted scans: (router function, SQL fragment) -> (table, why)
+ALLOWED_SCANS = {
+    ("dishes._list_dishes", r"FROM dishes ORDER BY id"): ("dishes", "full catalogue listing, walks the rowid in output order"),
+    ("ratings._list_ratings", r"FROM ratings ORDER BY created_at DESC"): (
+        "ratings",
+        "all ratings, newest first: idx_ratings_created walk",
+    ),
+    ("stats._top_dishes", r"FROM dish_rating_stats s"): ("dish_rating_stats", "global top list over all rated dishes; cached"),
+    ("chat._load_context_blocks", r"FROM dish_rating_stats s"): (
+        "dish_rating_stats",
+        "global top list over all rated dishes; cached",
+    ),
+    ("chat._fetch_global_top_dishes", r"FROM dish_rating_stats s"): (
+        "dish_rating_stats",
+        "same top list, for the offline fallback answer",
+    ),
+}
+
+# Queries whose plan is pinned: (router function, SQL fragment) ->
+# (table, index every plan step on that table must search, whether it covers)
+EXPECTED_PLANS = {
+    ("dishes._get_dish_ratings", r"FROM ratings WHERE dish_id"): ("ratings", "idx_ratings_dish_recent", True),
+    ("ratings._list_ratings_for_dish", r"FROM ratings r"): ("ratings", "idx_ratings_dish_recent", True),
+    ("orders._list_orders", r"FROM orders"): ("orders", "idx_orders_user_recent", True),
+    ("orders._list_orders", r"FROM order_items oi"): ("order_items", "idx_order_items_order", True),
+    ("orders._get_order_detail", r"FROM order_items oi"): ("order_items", "idx_order_items_order", True),
+}
+
+# /dishes/browse pages: the last equality filter before availability picks the
+# index prefix and the sort picks its column. The pages select columns the
+# indexes don't carry, so those are read from the table
+_BROWSE_PREFIXES = {
+    "": r"(?:WHERE |IS (?:NOT )?NULL AND |[<>]= [\d.]+ AND )",
+    "canteen_": r"canteen_id = \d+ AND ",
+    "category_": r"category = '[^']*' AND ",
+}
+EXPECTED_PLANS.update(
+    {
+        ("dishes._browse_dishes", rf"{before}is_available = \d+\b.* ORDER BY {column}\b"): (
+            "dishes",
+            f"idx_dishes_{prefix}available_{column}",
+            False,
+        )
+        for prefix, before in _BROWSE_PREFIXES.items()
+        for column in ("id", "price", "calories")
+    }
+)
+
+# Paged queries that must never sort: (router function, SQL fragment)
+ORDERED_QUERIES = {
+    ("dishes._browse_dishes", "ORDER BY"),
+}
+
+NEXT_CURSOR = "X-Next-Cursor"
+
+# (method, path, JSON body); GETs with a page size also fetch their second page
+REQUESTS = [
+    ("POST", "/auth/register", {"username": "plan_user", "password": "secret1", "email": "plan@example.com"}),
+    ("POST", "/auth/login", {"username": "plan_user", "password": "secret1"}),
+    ("GET", "/auth/user/1", None),
+    ("GET", "/canteens/", None),
+    ("GET", "/canteens/1/dishes", None),
+    ("GET", "/dishes/", None),
+    ("GET", "/dishes/?limit=5&fields=id,name,price", None),
+    ("GET", "/dishes/search?q=noodle&limit=3", None),
+    ("GET", "/dishes/search?q=noodle+rice&limit=3", None),
+    ("GET", "/dishes/search?q=面&limit=3", None),
+    ("GET", "/dishes/search?q=noodle+面&limit=3", None),
+    ("GET", "/dishes/search?q=牛肉&limit=3", None),
+    ("GET", "/dishes/search?q=面+牛肉&limit=3", None),
+    ("GET", "/dishes/by-ingredients?include=egg&exclude=pork&limit=1", None),
+    ("GET", "/dishes/ingredients", None),
+    ("GET", "/dishes/1", None),
+    ("GET", "/dishes/1/ratings", None),
+    ("GET", "/options/dish/14", None),
+    ("POST", "/orders/", {"user_id": 1, "items": [{"dish_id": 1, "quantity": 2}, {"dish_id": 2, "quantity": 1}]}),
+    ("GET", "/orders/?user_id=1&limit=1", None),
+    ("GET", "/orders/1", None),
+    ("POST", "/orders/1/pay", None),
+    ("GET", "/ratings/?limit=2", None),
+    ("GET", "/ratings/dish/1?limit=1", None),
+    ("POST", "/ratings/", {"user_id": 1, "dish_id": 1, "score": 4, "comment": "again"}),
+    ("POST", "/ratings/", {"user_id": 4, "dish_id": 2, "score": 5}),
+    ("GET", "/stats/top-dishes", None),
+    ("GET", "/stats/recommendations/1", None),
+    ("GET", "/stats/recommendations/4", None),
+    ("GET", "/stats/daily-recommendations", None),
+    ("GET", "/stats/weekly-recommendations", None),
+    ("POST", "/chat", {"user_id": 1, "message": "Any cheap noodles?"}),
+]
+
+# /dishes/browse filters, combined in every subset
+BROWSE_FILTERS = {
+    "canteen_id": 1,
+    "category": "Noodles",
+    "min_price": 5,
+    "max_price": 20,
+    "min_calories": 100,
+    "max_calories": 900,
+}
+
+_ROUTERS_DIR = str(Path(__file__).resolve().parent / "app" / "routers")
+_TABLE_ALIAS_RE = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)(?:\s+(?:AS\s+)?([A-Za-z_][A-Za-z0-9_]*))?", re.I)
+_SQL_KEYWORDS = {"WHERE", "JOIN", "LEFT", "INNER", "CROSS", "ON", "ORDER", "GROUP", "LIMIT", "USING", "AS", "NATURAL"}
+_SCAN_RE = re.compile(r"^SCAN (\S+)(?: USING (?:COVERING )?INDEX (\S+))?")
+_SEARCH_RE = re.compile(r"^SEARCH (\S+) USING (?:COVERING )?INDEX (\S+)")
+
+
+def _router_caller():
+    """``module.function`` of the outermost app/routers/ frame on the stack, if any.
+
+    That is the function handed to ``run_in_db`` (or to a cache loader),
+    rather than a shared helper such as ``ratings._page``.
+    """
+    caller = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_ROUTERS_DIR):
+            caller = f"{Path(filename).stem}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return caller
+
+
+def _aliases(sql: str) -> dict:
+    aliases = {}
+    for table, alias in _TABLE_ALIAS_RE.findall(sql):
+        aliases[table] = table
+        if alias and alias.upper() not in _SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def _browse_urls():
+    """Every /dishes/browse filter combination and sort, each with and without a cursor.
+
+    The demo data is too small for every combination to have a second page,
+    so the cursor pages are requested with a made-up cursor, and for price
+    and calorie sorts also with one inside the dishes lacking that value.
+    """
+    from app.pagination import encode_cursor
+    from app.routers.dishes import BROWSE_SORTS
+
+    for size in range(len(BROWSE_FILTERS) + 1):
+        for names in itertools.combinations(BROWSE_FILTERS, size):
+            query = "".join(f"&{name}={BROWSE_FILTERS[name]}" for name in names)
+            for sort, (column, _) in BROWSE_SORTS.items():
+                url = f"/dishes/browse?limit=5&sort={sort}{query}"
+                yield url
+                if column == "id":
+                    yield f"{url}&cursor={encode_cursor(5)}"
+                else:
+                    yield f"{url}&cursor={encode_cursor(10, 5)}"
+                    yield f"{url}&cursor={encode_cursor(None, 5)}"
+
+
+def _capture(path: Path):
+    """Drive every endpoint against a fresh database at ``path``; returns {caller: [sql, ...]}."""
+    from app import db
+
+    db.DB_PATH = path
+    statements = defaultdict(list)
+
+    def trace(sql: str) -> None:
+        if sql.startswith("--"):
+            return  # statements run by triggers
+        caller = _router_caller()
+        if caller is not None and sql not in statements[caller]:
+            statements[caller].append(sql)
+
+    class TracingPool(db.ConnectionPool):
+        def _open(self):
+            conn = super()._open()
+            conn.set_trace_callback(trace)
+            return conn
+
+    import seed_data
+    import seed_dish_options
+    from fastapi.testclient import TestClient
+
+    from app.ingredients import parse_queued_dishes
+    from app.main import app
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        seed_data.seed()
+        seed_dish_options.seed_dish_options()
+    # The demo dishes have no ingredient lists; give a few some so the
+    # ingredient filter has names to resolve
+    conn = db.get_connection()
+    conn.execute("UPDATE dishes SET ingredients = 'Egg, Noodles' WHERE id IN (1, 2)")
+    conn.execute("UPDATE dishes SET ingredients = 'Pork, Rice' WHERE id = 3")
+    parse_queued_dishes(conn.cursor())
+    conn.commit()
+    conn.close()
+    db._pool = TracingPool(path)
+    with TestClient(app) as client:
+        for method, url, body in REQUESTS:
+            response = client.request(method, url, json=body)
+            if response.status_code >= 400:
+                print(f"warning: {method} {url} -> {response.status_code}", file=sys.stderr)
+            cursor = response.headers.get(NEXT_CURSOR)
+            if method == "GET" and cursor:
+                sep = "&" if "?" in url else "?"
+                client.get(f"{url}{sep}cursor={cursor}")
+        for url in _browse_urls():
+            response = client.get(url)
+            if response.status_code >= 400:
+                print(f"warning: GET {url} -> {response.status_code}", file=sys.stderr)
+    return statements
+
+
+def _uses_index(plan, aliases: dict, table: str, index: str, covering: bool) -> bool:
+    """Every step on ``table`` searches ``index`` (without table lookups if ``covering``), and nothing sorts."""
+    steps = [step for step in plan if step.split()[0] in ("SCAN", "SEARCH") and aliases.get(step.split()[1]) == table]
+    if not steps or any("TEMP B-TREE" in step for step in plan):
+        return False
+    return all(
+        (match := _SEARCH_RE.match(step)) is not None
+        and match.group(2) == index
+        and ("COVERING INDEX" in step or not covering)
+        for step in steps
+    )
+
+
+def _explain(conn, sql: str):
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def check(path: Path, verbose: bool = False) -> int:
+    import sqlite3
+
+    statements = _capture(path)
+    conn = sqlite3.connect(path)
+    failures = []
+    explained = 0
+    for caller in sorted(statements):
+        for sql in statements[caller]:
+            if not sql.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")):
+                continue
+            plan = _explain(conn, sql)
+            explained += 1
+            aliases = _aliases(sql)
+            flat = " ".join(sql.split())
+            if verbose:
+                print(f"{caller}: {flat[:160]}")
+                for step in plan:
+                    print(f"    {step}")
+            for step in plan:
+                match = _SCAN_RE.match(step)
+                if not match or "VIRTUAL TABLE" in step:
+                    continue
+                table = aliases.get(match.group(1), match.group(1))
+                if table in SMALL_TABLES or table not in aliases.values():
+                    continue  # small table, subquery or CTE
+                if not any(
+                    allowed_caller == caller and allowed_table == table and re.search(fragment, flat)
+                    for (allowed_caller, fragment), (allowed_table, _) in ALLOWED_SCANS.items()
+                ):
+                    failures.append(f"{caller}: {step}\n    {flat}")
+            for (expected_caller, fragment), (table, index, covering) in EXPECTED_PLANS.items():
+                if caller == expected_caller and re.search(fragment, flat):
+                    if not _uses_index(plan, aliases, table, index, covering):
+                        walk = "a covering walk" if covering else "a walk"
+                        failures.append(f"{caller}: expected {walk} of {index}, got {plan}\n    {flat}")
+            for ordered_caller, fragment in ORDERED_QUERIES:
+                if caller == ordered_caller and re.search(fragment, flat) and any("TEMP B-TREE" in step for step in plan):
+                    failures.append(f"{caller}: sorts its matches, got {plan}\n    {flat}")
+    conn.close()
+
+    missing = {
+        key for key in EXPECTED_PLANS if not any(re.search(key[1], " ".join(s.split())) for s in statements.get(key[0], []))
+    }
+    for caller, fragment in sorted(missing):
+        failures.append(f"{caller}: no statement matching {fragment!r} was issued")
+
+    print(f"Explained {explained} statement(s) from {len(statements)} router function(s)")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+def main() -> int:
+    verbose = "-v" in sys.argv[1:]
+    # Never reach a real LLM: the refused connection sends /chat down its fallback path
+    os.environ["MOONSHOT_API_KEY"] = "sk-check-query-plans"
+    os.environ["MOONSHOT_API_BASE"] = "http://127.0.0.1:9/v1"
+    with tempfile.TemporaryDirectory() as tmp:
+        return check(Path(tmp) / "plans.db", verbose=verbose)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
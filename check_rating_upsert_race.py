@@ -0,0 +1,117 @@
+"""Race concurrent submissions of the same rating and check nothing is duplicated.
+
+A throwaway database is built through the normal migration path and filled
+with the demo seed data, its ratings are cleared, and then for every
+(user, dish) pair ``--writers`` threads released together by a barrier each
+submit a rating through the ``POST /ratings/`` helper on a pooled
+connection, as ``run_in_db`` would. The run fails when:
+
+* any submission raised (e.g. SQLITE_BUSY or an IntegrityError from the
+  unique index surfacing instead of turning into an update),
+* a (user_id, dish_id) pair ends up with more than one row, or
+* ``dish_rating_stats`` (kept by triggers) disagrees with aggregates
+  recomputed from ``ratings``.
+
+Usage::
+
+    python check_rating_upsert_race.py                 # exits 1 on a failure
+    python check_rating_upsert_race.py --writers 8 --users 4 --dishes 60
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+
+def race(path: Path, writers: int, users: int, dishes: int) -> int:
+    from app import db
+
+    db.DB_PATH = path
+    import seed_data
+    from app.recommender import recommender
+    from app.routers.ratings import RatingCreate, _create_rating
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        seed_data.seed()
+    with db.db_connection() as conn:
+        conn.execute("DELETE FROM ratings")
+        conn.commit()
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id LIMIT ?", (users,))]
+        dish_ids = [row[0] for row in conn.execute("SELECT id FROM dishes ORDER BY id LIMIT ?", (dishes,))]
+        recommender.build(conn)
+    pairs = [(user_id, dish_id) for user_id in user_ids for dish_id in dish_ids]
+
+    errors: Counter = Counter()
+    started = time.perf_counter()
+    for user_id, dish_id in pairs:
+        barrier = threading.Barrier(writers)
+
+        def submit(score: int) -> None:
+            barrier.wait()
+            try:
+                with db.db_connection() as conn:
+                    _create_rating(conn, RatingCreate(user_id=user_id, dish_id=dish_id, score=score))
+            except Exception as exc:  # counted and reported below
+                errors[type(exc).__name__] += 1
+
+        threads = [threading.Thread(target=submit, args=(1 + i % 5,)) for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+
+    with db.db_connection() as conn:
+        duplicates = conn.execute(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM ratings GROUP BY user_id, dish_id HAVING COUNT(*) > 1)"
+        ).fetchone()[0]
+        rows = conn.execute("SELECT COUNT(*) FROM ratings").fetchone()[0]
+        stored = {
+            row[0]: (row[1], row[2])
+            for row in conn.execute("SELECT dish_id, rating_count, score_sum FROM dish_rating_stats WHERE rating_count > 0")
+        }
+        fresh = {
+            row[0]: (row[1], row[2])
+            for row in conn.execute("SELECT dish_id, COUNT(*), SUM(score) FROM ratings GROUP BY dish_id")
+        }
+    db.close_pool()
+    drifted = sorted(dish_id for dish_id in stored.keys() | fresh.keys() if stored.get(dish_id) != fresh.get(dish_id))
+
+    submissions = len(pairs) * writers
+    print(
+        f"{len(pairs)} (user, dish) pairs x {writers} simultaneous writers: "
+        f"{submissions} submissions in {elapsed:.2f} s ({submissions / elapsed:.0f}/s), {rows} rating rows"
+    )
+    failures = []
+    if errors:
+        failures.append(f"submissions raised: {dict(errors)}")
+    if duplicates:
+        failures.append(f"{duplicates} (user, dish) pair(s) have more than one rating")
+    if rows != len(pairs):
+        failures.append(f"expected {len(pairs)} rating rows, found {rows}")
+    if drifted:
+        failures.append(f"dish_rating_stats drifted for {len(drifted)} dish(es), e.g. {drifted[:5]}")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8, help="simultaneous submissions per (user, dish) pair")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--dishes", type=int, default=60)
+    args = parser.parse_args()
+    os.environ.setdefault("MOONSHOT_API_KEY", "sk-check-rating-race")
+    with tempfile.TemporaryDirectory() as tmp:
+        return race(Path(tmp) / "race.db", args.writers, args.users, args.dishes)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Local stand-in for the Moonshot chat-completions API.
+
+Lets the /chat integration be exercised and timed without the real network:
+
+    MOCK_LLM_LATENCY_MS=300 uvicorn mock_moonshot:app --port 9000
+
+then start the app with
+``MOONSHOT_API_BASE=http://127.0.0.1:9000/v1 MOONSHOT_API_KEY=sk-test``.
+
+``MOCK_LLM_LATENCY_MS`` is the time to the first token; with ``"stream": true``
+the answer is then sent as SSE chunks every ``MOCK_LLM_CHUNK_DELAY_MS``.
+``GET /mock/stats`` reports how many streams finished or were cut off by the
+caller.
+
+Fault injection, from the env at start-up or at runtime via ``POST /mock/faults``
+(e.g. ``{"error_rate": 1}``): ``MOCK_LLM_ERROR_RATE`` is the share of calls
+answered with a 503, ``MOCK_LLM_HANG_RATE`` the share that stall for
+``MOCK_LLM_HANG_SECONDS`` (longer than the app's client timeout).
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from typing import Optional
+
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+faults = {
+    "latency_ms": float(os.getenv("MOCK_LLM_LATENCY_MS", "200")),
+    "chunk_delay_ms": float(os.getenv("MOCK_LLM_CHUNK_DELAY_MS", "50")),
+    "error_rate": float(os.getenv("MOCK_LLM_ERROR_RATE", "0")),
+    "hang_rate": float(os.getenv("MOCK_LLM_HANG_RATE", "0")),
+    "hang_seconds": float(os.getenv("MOCK_LLM_HANG_SECONDS", "60")),
+}
+
+app = FastAPI(title="Mock Moonshot API")
+
+
+class CompletionRequest(BaseModel):
+    model: str
+    messages: list
+    stream: bool = False
+
+
+class Faults(BaseModel):
+    latency_ms: Optional[float] = None
+    chunk_delay_ms: Optional[float] = None
+    error_rate: Optional[float] = None
+    hang_rate: Optional[float] = None
+    hang_seconds: Optional[float] = None
+
+
+stream_stats = {"started": 0, "completed": 0, "cancelled": 0}
+call_stats = {"calls": 0, "errors": 0, "hangs": 0}
+
+
+def _answer_for(messages: list) -> str:
+    question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    return f"[mock] 根据评分数据，推荐你试试热门菜品。你的问题是：{question}"
+
+
+def _chunks(text: str, size: int = 4) -> list:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+async def _stream_answer(completion_id: str, model: str, answer: str):
+    stream_stats["started"] += 1
+    try:
+        await asyncio.sleep(faults["latency_ms"] / 1000)
+        for piece in _chunks(answer):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(faults["chunk_delay_ms"] / 1000)
+        yield "data: [DONE]\n\n"
+        stream_stats["completed"] += 1
+    except (asyncio.CancelledError, GeneratorExit):
+        stream_stats["cancelled"] += 1
+        raise
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(body: CompletionRequest, authorization: str = Header("")):
+    if not authorization.startswith("Bearer sk-"):
+        raise HTTPException(status_code=401, detail={"error": {"message": "invalid api key"}})
+    call_stats["calls"] += 1
+    roll = random.random()
+    if roll < faults["error_rate"]:
+        call_stats["errors"] += 1
+        raise HTTPException(status_code=503, detail={"error": {"message": "injected upstream failure"}})
+    if roll < faults["error_rate"] + faults["hang_rate"]:
+        call_stats["hangs"] += 1
+        await asyncio.sleep(faults["hang_seconds"])
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    answer = _answer_for(body.messages)
+    if body.stream:
+        return StreamingResponse(
+            _stream_answer(completion_id, body.model, answer), media_type="text/event-stream"
+        )
+    await asyncio.sleep(faults["latency_ms"] / 1000)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop",
+            }
+        ],
+    }
+
+
+@app.get("/mock/stats")
+async def mock_stats() -> dict:
+    return {**call_stats, "streams": stream_stats, "faults": faults}
+
+
+@app.post("/mock/faults")
+async def set_faults(body: Faults) -> dict:
+    faults.update(body.model_dump(exclude_none=True))
+    return faults
@@ -0,0 +1,18 @@
+"""Re-derive the normalised ingredient tables from dishes.ingredients / ingredients_zh."""
+from app.db import get_connection, init_db
+from app.ingredients import rebuild_ingredients
+
+
+def main():
+    init_db()
+    conn = get_connection()
+    try:
+        processed = rebuild_ingredients(conn)
+        cur = conn.execute("SELECT COUNT(*) FROM ingredients")
+        print(f"Re-parsed {processed} dish(es); {cur.fetchone()[0]} distinct ingredient(s)")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""Reconcile dish_rating_stats against the raw ratings table."""
+from app.db import get_connection, init_db
+from app.rating_stats import rebuild_rating_stats
+
+
+def main():
+    init_db()
+    conn = get_connection()
+    try:
+        drifted = rebuild_rating_stats(conn)
+        print(f"Rebuilt dish_rating_stats: {drifted} dish(es) had drifted aggregates")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
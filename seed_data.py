@@ -1,6 +1,7 @@
 from datetime import datetime
 
 from app.db import get_connection, init_db
+from app.ingredients import parse_queued_dishes
 
 
 def seed():
@@ -203,6 +204,9 @@ def seed():
         """,
     )
 
+    # Parse the ingredients of the dishes inserted above (queued by the
+    # dishes triggers) in the same transaction
+    parse_queued_dishes(cur)
     conn.commit()
     conn.close()
 
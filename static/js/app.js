@@ -200,6 +200,7 @@ const translations = {
     total: "合计",
     rec_title: "为您推荐", 
     no_orders: "暂无历史订单", 
+    load_more: "加载更多", 
     cart_empty: "购物车空空如也",
     loading: "加载中...", 
     submit_success: "订单提交成功！", 
@@ -250,6 +251,7 @@ const translations = {
     total: "Total",
     rec_title: "Recommended", 
     no_orders: "No past orders", 
+    load_more: "Load more", 
     cart_empty: "Cart is empty",
     loading: "Loading...", 
     submit_success: "Order Placed!", 
@@ -325,33 +327,99 @@ function getCurrentWeekday() {
 
 function t(key) { return translations[state.lang][key] || key; }
 
+// Stream an assistant answer from /chat/stream (Server-Sent Events).
+// onDelta receives the answer so far; resolves with the full answer.
+async function streamChat(message, onDelta) {
+  const res = await fetch(`${apiBase}/chat/stream`, {
+    method: 'POST',
+    headers: {'Content-Type':'application/json', 'Accept':'text/event-stream'},
+    body: JSON.stringify({ user_id: currentUserId, message })
+  });
+  if (!res.ok || !res.body) {
+    let errorText = `HTTP ${res.status}`;
+    try {
+      const errorData = await res.json();
+      if (errorData.detail) errorText = errorData.detail;
+    } catch {}
+    const error = new Error(errorText);
+    error.status = res.status;
+    throw error;
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let answer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      let event = 'message';
+      let data = '';
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      if (!data) continue;
+      const payload = JSON.parse(data);
+      if (event === 'error') throw new Error(payload.detail || 'Stream error');
+      if (event === 'done') return answer;
+      if (payload.delta) {
+        answer += payload.delta;
+        onDelta(answer);
+      }
+    }
+  }
+  return answer;
+}
+
 async function fetchJSON(url, options) {
   try {
     const res = await fetch(url, options);
+    await checkResponse(res);
+    return await res.json();
+  } catch (e) { 
+    console.error('fetchJSON error:', e);
+    throw e; 
+  }
+}
+
+// One page of a cursor-paginated list: its items and the cursor of the next page (null on the last one)
+async function fetchPage(url, options) {
+  try {
+    const res = await fetch(url, options);
+    await checkResponse(res);
+    return { items: await res.json(), nextCursor: res.headers.get('X-Next-Cursor') };
+  } catch (e) {
+    console.error('fetchPage error:', e);
+    throw e;
+  }
+}
+
+async function checkResponse(res) {
   if (!res.ok) {
-      let errorText = `HTTP ${res.status}`;
+    let errorText = `HTTP ${res.status}`;
+    try {
+      const errorData = await res.json();
+      if (errorData.detail) {
+        errorText = errorData.detail;
+      } else if (errorData.message) {
+        errorText = errorData.message;
+      }
+    } catch {
       try {
-        const errorData = await res.json();
-        if (errorData.detail) {
-          errorText = errorData.detail;
-        } else if (errorData.message) {
-          errorText = errorData.message;
-        }
+        errorText = await res.text();
       } catch {
-        try {
-          errorText = await res.text();
-        } catch {
-          errorText = `HTTP ${res.status} ${res.statusText}`;
-        }
+        errorText = `HTTP ${res.status} ${res.statusText}`;
       }
-      const error = new Error(errorText);
-      error.status = res.status;
-      throw error;
     }
-    return await res.json();
-  } catch (e) { 
-    console.error('fetchJSON error:', e);
-    throw e; 
+    const error = new Error(errorText);
+    error.status = res.status;
+    throw error;
   }
 }
 
@@ -1105,6 +1173,8 @@ async function loadWeeklyRecommendations() {
   }
 }
 
+const ORDERS_PAGE_SIZE = 50;
+
 async function loadOrders() {
   const orderView = document.getElementById('view-order');
   if (!orderView) return;
@@ -1124,8 +1194,8 @@ async function loadOrders() {
   orderView.innerHTML = `<div style="text-align:center;padding:2rem;color:#94a3b8">${t('loading')}</div>`;
   
   try {
-    const orders = await fetchJSON(`${apiBase}/orders?user_id=${currentUserId}`);
-    if (!orders || orders.length === 0) {
+    const page = await fetchPage(ordersPageUrl(null));
+    if (page.items.length === 0) {
       orderView.innerHTML = `
         <div class="card empty-order-card">
           <i class="fas fa-clipboard-list"></i>
@@ -1136,102 +1206,135 @@ async function loadOrders() {
       return;
     }
     
-    orderView.innerHTML = '<div style="display:flex;flex-direction:column;gap:1rem;">';
-    orders.forEach(order => {
-      const orderCard = document.createElement('div');
-      orderCard.className = 'card';
-      orderCard.style.padding = '1.5rem';
-      const date = new Date(order.created_at).toLocaleString(state.lang === 'zh' ? 'zh-CN' : 'en-US');
+    orderView.innerHTML = '';
+    const orderList = document.createElement('div');
+    orderList.style.cssText = 'display:flex;flex-direction:column;gap:1rem;';
+    orderView.appendChild(orderList);
+    page.items.forEach(order => orderList.appendChild(renderOrderCard(order)));
+    showMoreOrdersButton(orderView, orderList, page.nextCursor);
+  } catch (e) {
+    console.error('Error loading orders:', e);
+    orderView.innerHTML = `<div style="text-align:center;padding:2rem;color:red">${t('error_loading')}: ${e.message}</div>`;
+  }
+}
+
+function ordersPageUrl(cursor) {
+  const url = `${apiBase}/orders?user_id=${currentUserId}&limit=${ORDERS_PAGE_SIZE}`;
+  return cursor ? `${url}&cursor=${encodeURIComponent(cursor)}` : url;
+}
+
+// The order list is paged; older orders are fetched on demand by following X-Next-Cursor
+function showMoreOrdersButton(orderView, orderList, nextCursor) {
+  if (!nextCursor) return;
+  const button = document.createElement('button');
+  button.className = 'btn-primary';
+  button.style.cssText = 'width:100%;margin-top:1rem;';
+  button.setAttribute('data-i18n', 'load_more');
+  button.textContent = t('load_more');
+  button.onclick = async () => {
+    button.disabled = true;
+    try {
+      const page = await fetchPage(ordersPageUrl(nextCursor));
+      button.remove();
+      page.items.forEach(order => orderList.appendChild(renderOrderCard(order)));
+      showMoreOrdersButton(orderView, orderList, page.nextCursor);
+    } catch (e) {
+      console.error('Error loading orders:', e);
+      button.disabled = false;
+    }
+  };
+  orderView.appendChild(button);
+}
+
+function renderOrderCard(order) {
+  const orderCard = document.createElement('div');
+  orderCard.className = 'card';
+  orderCard.style.padding = '1.5rem';
+  const date = new Date(order.created_at).toLocaleString(state.lang === 'zh' ? 'zh-CN' : 'en-US');
+  
+  // Format order items display
+  let itemsHtml = '';
+  if (order.items && order.items.length > 0) {
+    itemsHtml = '<div style="margin-top:1rem;padding-top:1rem;border-top:1px solid #e2e8f0;">';
+    order.items.forEach(item => {
+      const dishName = translateDishName(item.dish_name || `Dish ${item.dish_id}`);
+      let optionsText = '';
       
-      // Format order items display
-      let itemsHtml = '';
-      if (order.items && order.items.length > 0) {
-        itemsHtml = '<div style="margin-top:1rem;padding-top:1rem;border-top:1px solid #e2e8f0;">';
-        order.items.forEach(item => {
-          const dishName = translateDishName(item.dish_name || `Dish ${item.dish_id}`);
-          let optionsText = '';
-          
-          // Format options display
-          if (item.options && Object.keys(item.options).length > 0) {
-            const optionLabels = [];
-            const optionLabelMap = {
-              'add_egg': { zh: '加蛋', en: 'Add Egg' },
-              'add_sausage': { zh: '加火腿肠', en: 'Add Sausage' },
-              'add_meat': { zh: '加肉', en: 'Add Meat' },
-              'spicy_level': { zh: '辣度', en: 'Spicy Level' },
-              'temperature': { zh: '温度', en: 'Temperature' },
-              'sugar_level': { zh: '糖度', en: 'Sugar Level' }
-            };
-            const valueLabelMap = {
-              'yes': { zh: '是', en: 'Yes' },
-              'mild': { zh: '微辣', en: 'Mild' },
-              'medium': { zh: '中辣', en: 'Medium' },
-              'hot': { zh: '重辣', en: 'Hot' },
-              'ice': { zh: '冰的', en: 'Iced' },
-              'less_ice': { zh: '少冰', en: 'Less Ice' },
-              'no_ice': { zh: '去冰', en: 'No Ice' },
-              'no_sugar': { zh: '不额外加糖', en: 'No Extra Sugar' },
-              'half': { zh: '五分糖', en: '50% Sugar' },
-              'seven': { zh: '七分糖', en: '70% Sugar' },
-              'full': { zh: '满糖', en: 'Full Sugar' }
-            };
-            
-            Object.entries(item.options).forEach(([key, value]) => {
-              if (value && value !== 'no') {
-                const optionName = optionLabelMap[key] ? (state.lang === 'zh' ? optionLabelMap[key].zh : optionLabelMap[key].en) : key;
-                const valueLabel = valueLabelMap[value] ? (state.lang === 'zh' ? valueLabelMap[value].zh : valueLabelMap[value].en) : value;
-                optionLabels.push(`${optionName}: ${valueLabel}`);
-              }
-            });
-            if (optionLabels.length > 0) {
-              optionsText = `<div style="font-size:0.75rem;color:#64748b;margin-top:2px">${optionLabels.join(', ')}</div>`;
-            }
+      // Format options display
+      if (item.options && Object.keys(item.options).length > 0) {
+        const optionLabels = [];
+        const optionLabelMap = {
+          'add_egg': { zh: '加蛋', en: 'Add Egg' },
+          'add_sausage': { zh: '加火腿肠', en: 'Add Sausage' },
+          'add_meat': { zh: '加肉', en: 'Add Meat' },
+          'spicy_level': { zh: '辣度', en: 'Spicy Level' },
+          'temperature': { zh: '温度', en: 'Temperature' },
+          'sugar_level': { zh: '糖度', en: 'Sugar Level' }
+        };
+        const valueLabelMap = {
+          'yes': { zh: '是', en: 'Yes' },
+          'mild': { zh: '微辣', en: 'Mild' },
+          'medium': { zh: '中辣', en: 'Medium' },
+          'hot': { zh: '重辣', en: 'Hot' },
+          'ice': { zh: '冰的', en: 'Iced' },
+          'less_ice': { zh: '少冰', en: 'Less Ice' },
+          'no_ice': { zh: '去冰', en: 'No Ice' },
+          'no_sugar': { zh: '不额外加糖', en: 'No Extra Sugar' },
+          'half': { zh: '五分糖', en: '50% Sugar' },
+          'seven': { zh: '七分糖', en: '70% Sugar' },
+          'full': { zh: '满糖', en: 'Full Sugar' }
+        };
+        
+        Object.entries(item.options).forEach(([key, value]) => {
+          if (value && value !== 'no') {
+            const optionName = optionLabelMap[key] ? (state.lang === 'zh' ? optionLabelMap[key].zh : optionLabelMap[key].en) : key;
+            const valueLabel = valueLabelMap[value] ? (state.lang === 'zh' ? valueLabelMap[value].zh : valueLabelMap[value].en) : value;
+            optionLabels.push(`${optionName}: ${valueLabel}`);
           }
-          
-          itemsHtml += `
-            <div style="display:flex;justify-content:space-between;align-items:start;margin-bottom:0.75rem;">
-              <div style="flex:1">
-                <div style="font-weight:500;margin-bottom:2px">${dishName}</div>
-                ${optionsText}
-                <div style="font-size:0.85rem;color:#94a3b8">x ${item.quantity || 1}</div>
-              </div>
-              <div style="font-weight:bold;color:#4361ee;margin-left:1rem">¥${((item.price || 0) * (item.quantity || 1)).toFixed(2)}</div>
-            </div>
-          `;
         });
-        itemsHtml += '</div>';
+        if (optionLabels.length > 0) {
+          optionsText = `<div style="font-size:0.75rem;color:#64748b;margin-top:2px">${optionLabels.join(', ')}</div>`;
+        }
       }
       
-      orderCard.innerHTML = `
-        <div style="display:flex;justify-content:space-between;align-items:center;margin-bottom:1rem;">
-          <div>
-            <div style="font-weight:bold;font-size:1.1rem;">${state.lang === 'zh' ? '订单' : 'Order'} #${order.id}</div>
-            <div style="font-size:0.85rem;color:#94a3b8;margin-top:4px">${date}</div>
-          </div>
-          <div>
-            <span style="padding:4px 12px;background:#e0e7ff;color:#4361ee;border-radius:12px;font-size:0.85rem;font-weight:500">${order.status || 'pending'}</span>
+      itemsHtml += `
+        <div style="display:flex;justify-content:space-between;align-items:start;margin-bottom:0.75rem;">
+          <div style="flex:1">
+            <div style="font-weight:500;margin-bottom:2px">${dishName}</div>
+            ${optionsText}
+            <div style="font-size:0.85rem;color:#94a3b8">x ${item.quantity || 1}</div>
           </div>
+          <div style="font-weight:bold;color:#4361ee;margin-left:1rem">¥${((item.price || 0) * (item.quantity || 1)).toFixed(2)}</div>
         </div>
-        ${itemsHtml}
-        <div style="margin-top:1rem;padding-top:1rem;border-top:1px solid #e2e8f0;display:flex;justify-content:space-between;align-items:center">
-          <div style="font-weight:600;color:#1e293b">${state.lang === 'zh' ? '合计' : 'Total'}</div>
-          <div style="font-size:1.2rem;font-weight:bold;color:#4361ee">¥${(order.total_price || 0).toFixed(2)}</div>
-        </div>
-        ${order.status === 'pending' ? `
-          <div style="margin-top:1rem;padding-top:1rem;border-top:1px solid #e2e8f0;">
-            <button onclick="payOrder(${order.id})" class="btn-primary" style="width:100%">
-              <i class="fas fa-credit-card"></i> <span data-i18n="pay_now">立即支付</span>
-            </button>
-          </div>
-        ` : ''}
       `;
-      orderView.appendChild(orderCard);
     });
-    orderView.innerHTML += '</div>';
-  } catch (e) {
-    console.error('Error loading orders:', e);
-    orderView.innerHTML = `<div style="text-align:center;padding:2rem;color:red">${t('error_loading')}: ${e.message}</div>`;
+    itemsHtml += '</div>';
   }
+  
+  orderCard.innerHTML = `
+    <div style="display:flex;justify-content:space-between;align-items:center;margin-bottom:1rem;">
+      <div>
+        <div style="font-weight:bold;font-size:1.1rem;">${state.lang === 'zh' ? '订单' : 'Order'} #${order.id}</div>
+        <div style="font-size:0.85rem;color:#94a3b8;margin-top:4px">${date}</div>
+      </div>
+      <div>
+        <span style="padding:4px 12px;background:#e0e7ff;color:#4361ee;border-radius:12px;font-size:0.85rem;font-weight:500">${order.status || 'pending'}</span>
+      </div>
+    </div>
+    ${itemsHtml}
+    <div style="margin-top:1rem;padding-top:1rem;border-top:1px solid #e2e8f0;display:flex;justify-content:space-between;align-items:center">
+      <div style="font-weight:600;color:#1e293b">${state.lang === 'zh' ? '合计' : 'Total'}</div>
+      <div style="font-size:1.2rem;font-weight:bold;color:#4361ee">¥${(order.total_price || 0).toFixed(2)}</div>
+    </div>
+    ${order.status === 'pending' ? `
+      <div style="margin-top:1rem;padding-top:1rem;border-top:1px solid #e2e8f0;">
+        <button onclick="payOrder(${order.id})" class="btn-primary" style="width:100%">
+          <i class="fas fa-credit-card"></i> <span data-i18n="pay_now">立即支付</span>
+        </button>
+      </div>
+    ` : ''}
+  `;
+  return orderCard;
 }
 
 // Login and registration related functions
@@ -1526,13 +1629,13 @@ window.addEventListener('DOMContentLoaded', () => {
       
       try {
         console.log('发送聊天消息:', text);
-        const res = await fetchJSON(`${apiBase}/chat`, { 
-          method: 'POST',
-          headers: {'Content-Type':'application/json'}, 
-          body: JSON.stringify({ user_id: currentUserId, message: text }) 
+        const answer = await streamChat(text, (partial) => {
+          thinkingDiv.textContent = partial;
+          thinkingDiv.style.color = '';
+          msgs.scrollTop = msgs.scrollHeight;
         });
-        console.log('收到回复:', res);
-        thinkingDiv.textContent = res.answer || t('no_response');
+        console.log('收到回复:', answer);
+        thinkingDiv.textContent = answer || t('no_response');
         thinkingDiv.style.color = '';
       } catch(e) { 
         console.error('Chat error:', e);
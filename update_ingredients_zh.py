@@ -1,5 +1,6 @@
 """更新菜品配料中文翻译的脚本"""
 from app.db import get_connection
+from app.ingredients import parse_queued_dishes
 
 # 配料中英文映射
 ingredients_translations = {
@@ -91,6 +92,8 @@ def update_ingredients_zh():
                 # 这里可以添加更复杂的翻译逻辑
                 print(f"Warning: No translation found for dish {dish_id}: {ingredients_en}")
         
+        # 在同一事务中重新解析被修改菜品的配料
+        parse_queued_dishes(cur)
         conn.commit()
         print(f"已更新 {updated_count} 个菜品的中文配料")
     finally: